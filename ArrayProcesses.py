@@ -0,0 +1,187 @@
+import os
+import stat
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+from Wrappers import Process
+
+##
+# Array edges hold a single array in the NumPy .npy format (a small header with dtype and
+# shape followed by the raw data), so consumers can map them into memory without copying.
+
+# readers of the .npy header versions, by version
+HEADER_READERS = {
+    (1, 0) : np.lib.format.read_array_header_1_0,
+    (2, 0) : np.lib.format.read_array_header_2_0}
+
+##
+# @brief Reads exactly len(<buf>) bytes from the file object <f> into <buf>
+def __readInto(f, buf):
+    view = memoryview(buf).cast('B')
+    pos = 0
+    while pos < len(view):
+        n = f.readinto(view[pos:])
+        if not n:
+            raise ValueError('Array data is truncated')
+        pos += n
+
+
+##
+# @brief Reads an array from the pipe <path>. np.load needs to seek, so the header and the data
+# are read in order instead.
+def __readFifo(path):
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version not in HEADER_READERS:
+            raise ValueError('Unsupported .npy version %d.%d' % version)
+        shape, fortranOrder, dtype = HEADER_READERS[version](f)
+        if dtype.hasobject:
+            raise ValueError('Arrays of objects are not supported')
+        array = np.empty(shape, dtype, order='F' if fortranOrder else 'C')
+        if array.nbytes:
+            __readInto(f, array.reshape(-1, order='A').view(np.uint8))
+    return array
+
+
+##
+# @brief Writes <array> to the pipe <path>, np.save needs the position in the file
+def __writeFifo(path, array):
+    array = np.asanyarray(array)
+    if not array.flags.c_contiguous:
+        array = array.copy(order='C')
+    if array.dtype.hasobject:
+        raise ValueError('Arrays of objects are not supported')
+    with open(path, 'wb') as f:
+        np.lib.format.write_array_header_1_0(f, np.lib.format.header_data_from_array_1_0(array))
+        if array.nbytes:
+            f.write(array.reshape(-1).view(np.uint8))
+
+
+##
+# @brief Returns the array stored in <path>, memory mapped if possible
+def readArray(path):
+    if stat.S_ISFIFO(os.stat(path).st_mode):
+        return __readFifo(path)
+    return np.load(path, mmap_mode='r')
+
+
+##
+# @brief Returns an array of <shape> and <dtype> that is backed by the file <path> if possible.
+# Results can be computed into it directly, call finishArray when done.
+def outputArray(path, shape, dtype):
+    if stat.S_ISFIFO(os.stat(path).st_mode) or 0 in shape:
+        return np.empty(shape, dtype)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+##
+# @brief Writes <array> to <path>, unless it was created by outputArray for <path> already
+def finishArray(path, array):
+    if isinstance(array, np.memmap):
+        array.flush()
+        return
+    if stat.S_ISFIFO(os.stat(path).st_mode):
+        __writeFifo(path, array)
+        return
+    with open(path, 'wb') as f:
+        np.save(f, np.asanyarray(array))
+
+
+##
+# @brief Source of a constant array, given as comma separated values
+class ArrayConstantProcess(Process):
+    def __init__(self, name):
+        super(ArrayConstantProcess, self).__init__(name)
+        self.params['value'] = '0.0'
+        self.params['dtype'] = 'float64'
+        # comma separated dimensions, empty for a flat array
+        self.params['shape'] = ''
+
+    def getPortSpecs(self):
+        return [[],['out']]
+
+    def run(self, inFds, outFds):
+        values = [v for v in str(self.params['value']).split(',') if v.strip()]
+        array = np.array([v.strip() for v in values]).astype(self.params['dtype'])
+        if str(self.params['shape']).strip():
+            array = array.reshape([int(d) for d in str(self.params['shape']).split(',')])
+        for o in outFds:
+            finishArray(o, array)
+
+
+##
+# @brief Element-wise arithmetic on two arrays with broadcasting
+class ArrayArithmeticProcess(Process):
+    OPERATIONS = {
+        'add' : np.add,
+        'subtract' : np.subtract,
+        'multiply' : np.multiply,
+        'divide' : np.true_divide,
+        'power' : np.power,
+        'minimum' : np.minimum,
+        'maximum' : np.maximum,
+    }
+
+    def __init__(self, name):
+        super(ArrayArithmeticProcess, self).__init__(name)
+        self.params['operation'] = 'add'
+
+    def getPortSpecs(self):
+        return [['a', 'b'],['result']]
+
+    def run(self, inFds, outFds):
+        ufunc = ArrayArithmeticProcess.OPERATIONS[self.params['operation']]
+        a = readArray(inFds[0])
+        b = readArray(inFds[1])
+
+        shape = np.broadcast_shapes(a.shape, b.shape)
+        with np.errstate(all='ignore'):
+            dtype = ufunc(np.zeros(1, a.dtype), np.zeros(1, b.dtype)).dtype
+        result = outputArray(outFds[0], shape, dtype)
+        ufunc(a, b, out=result)
+        finishArray(outFds[0], result)
+
+
+##
+# @brief Reduces an array along one axis (or all axes)
+class ArrayReduceProcess(Process):
+    OPERATIONS = {
+        'sum' : np.sum,
+        'prod' : np.prod,
+        'mean' : np.mean,
+        'std' : np.std,
+        'min' : np.min,
+        'max' : np.max,
+    }
+
+    def __init__(self, name):
+        super(ArrayReduceProcess, self).__init__(name)
+        self.params['operation'] = 'sum'
+        # index of the axis to reduce, empty to reduce all axes
+        self.params['axis'] = ''
+
+    def getPortSpecs(self):
+        return [['in'],['result']]
+
+    def run(self, inFds, outFds):
+        reduceFun = ArrayReduceProcess.OPERATIONS[self.params['operation']]
+        axis = int(self.params['axis']) if str(self.params['axis']).strip() else None
+        finishArray(outFds[0], reduceFun(readArray(inFds[0]), axis=axis))
+
+
+##
+# @brief Converts an array to another dtype
+class ArrayCastProcess(Process):
+    def __init__(self, name):
+        super(ArrayCastProcess, self).__init__(name)
+        self.params['dtype'] = 'float32'
+
+    def getPortSpecs(self):
+        return [['in'],['out']]
+
+    def run(self, inFds, outFds):
+        a = readArray(inFds[0])
+        result = outputArray(outFds[0], a.shape, np.dtype(self.params['dtype']))
+        np.copyto(result, a, casting='unsafe')
+        finishArray(outFds[0], result)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import struct
+import argparse
+import resource
+import tempfile
+import platform
+import subprocess
+import contextlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+SHAPES = ['chain', 'fan', 'diamond', 'random']
+KINDS = ['scalar', 'file']
+
+##
+# Graph generators return the shape of a DAG as a list with the predecessors of every vertex
+# (at most two, as addition and merge nodes have two inputs). Predecessors come first.
+
+##
+# @brief Chain of <n> vertices
+def chainGraph(n, rng):
+    return [[]] + [[i - 1] for i in range(1, n)]
+
+
+##
+# @brief One source fanned out to about <n> / 2 vertices, which are joined again by a binary tree
+def fanGraph(n, rng):
+    width = max(n // 2, 1)
+    preds = [[]] + [[0] for i in range(width)]
+    level = list(range(1, width + 1))
+    while len(level) > 1:
+        nextLevel = []
+        for i in range(0, len(level) - 1, 2):
+            preds.append([level[i], level[i + 1]])
+            nextLevel.append(len(preds) - 1)
+        if len(level) % 2:
+            nextLevel.append(level[-1])
+        level = nextLevel
+    return preds
+
+
+##
+# @brief Diamonds (one vertex split into two and joined again) in a row, about <n> vertices
+def diamondGraph(n, rng):
+    preds = [[]]
+    for i in range(max((n - 1) // 3, 1)):
+        top = len(preds) - 1
+        preds += [[top], [top], [top + 1, top + 2]]
+    return preds
+
+
+##
+# @brief Random DAG with <n> vertices, each with one or two random predecessors
+def randomGraph(n, rng):
+    preds = [[]]
+    for i in range(1, n):
+        preds.append(sorted(set(rng.randrange(i) for k in range(rng.randint(1, 2)))))
+    return preds
+
+GENERATORS = {'chain' : chainGraph, 'fan' : fanGraph, 'diamond' : diamondGraph, 'random' : randomGraph}
+
+
+##
+# @brief Writes a bash script that concatenates its <arity> inputs and keeps the first <payload>
+# bytes, so the data size stays the same along the graph
+def writeMergeScript(directory, arity, payload):
+    path = os.path.join(directory, 'merge%d.bash' % arity)
+    with open(path, 'w') as f:
+        f.write('#!/bin/bash\n'
+                'if [ "$#" -eq 0 ]; then echo "%s out1"; exit 1; fi\n'
+                'IFS="," read -r -a inFiles <<< "$1"\n'
+                'cat "${inFiles[@]}" | head -c %d > "$2"\n' % (','.join('in%d' % (i + 1) for i in range(arity)), payload))
+    os.chmod(path, 0o755)
+    return path
+
+
+##
+# @brief Creates the nodes for the DAG <preds>
+#
+# scalar: constant sources and addition nodes, file: a file source and bash nodes that pass on
+# <payload> bytes. Every vertex without successors gets a file sink.
+#
+# @return The connections to make, as pairs of output and input port
+def createGraph(procGraph, preds, kind, payload, directory):
+    hasSuccessor = set(p for ps in preds for p in ps)
+    if kind == 'file':
+        source = os.path.join(directory, 'payload')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(payload))
+        scripts = {arity : writeMergeScript(directory, arity, payload) for arity in (1, 2)}
+
+    nodes = []
+    connections = []
+    for i, ps in enumerate(preds):
+        name = 'n%d' % i
+        if not ps and kind == 'scalar':
+            node = procGraph.createNode(name, 'const')
+            node.setParam('encoding', 'latin-1')
+            node.setParam('value', struct.pack('f', 1.0).decode('latin-1'))
+        elif not ps:
+            node = procGraph.createNode(name, 'fileread')
+            node.setParam('filename', source)
+        elif kind == 'scalar':
+            node = procGraph.createNode(name, 'add')
+            # a single predecessor is added to itself
+            connections += [(nodes[p].outputPorts['out' if not preds[p] else 'sum'], node.inputPorts[ip]) \
+                    for p, ip in zip(ps * 2 if len(ps) == 1 else ps, ['summand1', 'summand2'])]
+        else:
+            node = procGraph.createNode(name, 'bash')
+            node.setParam('filename', scripts[len(ps)])
+            connections += [(nodes[p].outputPorts['out' if not preds[p] else 'out1'], node.inputPorts['in%d' % (k + 1)]) \
+                    for k, p in enumerate(ps)]
+        nodes.append(node)
+
+        if i not in hasSuccessor:
+            sink = procGraph.createNode(name + '_sink', 'filewrite')
+            sink.setParam('filename', os.path.join(directory, name + '.out'))
+            sink.setParam('append', False)
+            outPort = next(iter(node.outputPorts.values()))
+            connections.append((outPort, sink.inputPorts['in']))
+    return connections
+
+
+def openFileDescriptors():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        # listing needs a descriptor itself, so all are in use
+        return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+##
+# @brief Runs one benchmark case in this process
+#
+# @return Dict with the timings of every phase in seconds, peak memory and file descriptors
+def runCase(shape, kind, n, payload, workers, seed):
+    from Processing import ProcessingGraph, ProcessingNode
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    result = {'shape' : shape, 'kind' : kind, 'n' : n, 'payload' : payload, 'workers' : workers, \
+            'seed' : seed, 'times' : {}, 'maxFds' : openFileDescriptors(), 'fdLimit' : hard}
+    times = result['times']
+    directory = tempfile.mkdtemp(prefix='indprog-bench-')
+
+    @contextlib.contextmanager
+    def phase(name):
+        start = time.perf_counter()
+        try:
+            yield
+            times[name] = time.perf_counter() - start
+        finally:
+            result['maxFds'] = max(result['maxFds'], openFileDescriptors())
+
+    try:
+        preds = GENERATORS[shape](n, random.Random(seed))
+        procGraph = ProcessingGraph()
+        with phase('create'):
+            connections = createGraph(procGraph, preds, kind, payload, directory)
+        with phase('connect'):
+            for outPort, inPort in connections:
+                ProcessingNode.connectPorts(outPort, inPort)
+        with phase('getSinks'):
+            sinks = procGraph.getSinks()
+        with phase('plan'):
+            procGraph.topologicalSort(sinks)
+        with phase('process'):
+            result['ok'] = procGraph.process(workers=workers)
+        with phase('noop'):
+            procGraph.process(workers=workers)
+        graphFile = os.path.join(directory, 'graph.bin')
+        with phase('save'):
+            procGraph.saveToFile(graphFile)
+        with phase('load'):
+            ProcessingGraph().loadFromFile(graphFile)
+        result['nodes'] = len(procGraph.nodes)
+        result['edges'] = len(connections)
+    except Exception as e:
+        # e.g. running out of file descriptors, the phases that finished are still of interest
+        logger.exception(e)
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    # ru_maxrss is in KiB
+    result['maxRss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    result['maxChildRss'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return result
+
+
+##
+# @brief Runs every case in a fresh interpreter, so that peak memory and file descriptors of one
+# case do not affect the next
+def runCases(cases, payload, workers, seed):
+    results = []
+    for shape, kind, n in cases:
+        with tempfile.NamedTemporaryFile(suffix='.json') as out:
+            cmd = [sys.executable, os.path.abspath(__file__), '--case', shape, kind, str(n), \
+                    '--payload', str(payload), '-j', str(workers), '--seed', str(seed), '-o', out.name]
+            # new bash nodes look for the template script in the working directory
+            proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if proc.returncode != 0:
+                logger.error('Case %s/%s/%d failed with exit code %d', shape, kind, n, proc.returncode)
+                results.append({'shape' : shape, 'kind' : kind, 'n' : n, 'error' : 'exit code %d' % proc.returncode})
+                continue
+            results.append(json.load(out))
+        r = results[-1]
+        print('%-8s %-7s %7d  %s  %6.1f MiB  %5d fds%s' % (shape, kind, n, \
+                ' '.join('%s %.4f' % kv for kv in r['times'].items()), r['maxRss'] / 2**20, r['maxFds'], \
+                '  (%s)' % r['error'] if 'error' in r else ''))
+    return results
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)), \
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip() or None
+    except OSError:
+        return None
+
+
+##
+# @brief Prints the timings of the cases in the result file <newFile> relative to <oldFile>
+def compare(oldFile, newFile):
+    with open(oldFile) as f:
+        old = {(r['shape'], r['kind'], r['n']) : r for r in json.load(f)['cases'] if 'times' in r}
+    with open(newFile) as f:
+        new = json.load(f)['cases']
+    for r in new:
+        key = (r['shape'], r['kind'], r['n'])
+        if key not in old or 'times' not in r:
+            continue
+        ratios = ['%s %.2fx' % (p, t / old[key]['times'][p]) for p, t in r['times'].items() \
+                if old[key]['times'].get(p)]
+        print('%-8s %-7s %7d  %s  mem %.2fx' % (key + (' '.join(ratios), r['maxRss'] / old[key]['maxRss'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time planning, connecting and processing of synthetic graphs')
+    parser.add_argument("-s", "--shapes", dest="shapes", default=','.join(SHAPES), \
+            help="Comma separated graph shapes (%s)" % ', '.join(SHAPES))
+    parser.add_argument("-k", "--kinds", dest="kinds", default=','.join(KINDS), \
+            help="Comma separated node kinds: scalar (constant and addition nodes) or file (file and bash nodes)")
+    parser.add_argument("-n", "--nodes", dest="sizes", default='100,1000', \
+            help="Comma separated numbers of nodes per graph")
+    parser.add_argument("--payload", dest="payload", type=int, default=4096, \
+            help="Bytes passed along every connection of file graphs")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, \
+            help="Number of nodes that are processed in parallel")
+    parser.add_argument("--seed", dest="seed", type=int, default=0, \
+            help="Seed for random graphs")
+    parser.add_argument("-o", "--output", dest="output", default='benchmark.json', \
+            help="File the results are written to as JSON")
+    parser.add_argument("--compare", dest="compare", nargs=2, metavar=('OLD', 'NEW'), \
+            help="Compare two result files instead of running benchmarks")
+    parser.add_argument("--case", dest="case", nargs=3, metavar=('SHAPE', 'KIND', 'N'), help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    if args.case:
+        # opened first, the case may use up all file descriptors
+        with open(args.output, 'w') as f:
+            json.dump(runCase(args.case[0], args.case[1], int(args.case[2]), args.payload, args.jobs, args.seed), f)
+        sys.exit(0)
+
+    cases = [(s, k, int(n)) for s in args.shapes.split(',') for k in args.kinds.split(',') for n in args.sizes.split(',')]
+    for s, k, n in cases:
+        if s not in GENERATORS or k not in KINDS:
+            parser.error('Unknown shape or kind: %s, %s' % (s, k))
+
+    results = runCases(cases, args.payload, args.jobs, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump({'revision' : revision(), 'python' : platform.python_version(), 'date' : time.strftime('%Y-%m-%d %H:%M:%S'), \
+                'cpus' : os.cpu_count(), 'cases' : results}, f, indent=1)
+    sys.exit(0)
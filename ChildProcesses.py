@@ -0,0 +1,183 @@
+import os
+import time
+import signal
+import weakref
+import selectors
+import contextlib
+import threading
+import subprocess
+import logging
+logger = logging.getLogger(__name__)
+
+##
+# @brief Runs external commands for processes, at most <maxProcesses> at a time.
+#
+# Output of the children is forwarded to the log line by line while they run, a timeout kills
+# the child together with everything it started, and a non-zero exit code raises an error.
+class ChildProcessExecutor:
+    READ_SIZE = 64 * 1024
+
+    ##
+    # @param maxProcesses None for the number of CPUs, or the number of processing threads if
+    # there are more (see useWorkers)
+    def __init__(self, maxProcesses=None):
+        self.setMaxProcesses(maxProcesses)
+        self.local = threading.local()
+        # running children and the group they belong to, see setGroup
+        self.children = {}
+        self.cancelled = weakref.WeakSet()
+        self.lock = threading.Lock()
+
+    ##
+    # @brief Limits the number of children that run at the same time, None for the default.
+    # Only affects commands that are started after the call.
+    def setMaxProcesses(self, maxProcesses):
+        self.fixed = maxProcesses is not None
+        self.maxProcesses = maxProcesses or os.cpu_count() or 1
+        self.slots = threading.BoundedSemaphore(self.maxProcesses)
+
+    ##
+    # @brief Raises the default limit to <workers>, so that every thread that processes nodes
+    # can run a child. A limit that was set with setMaxProcesses is kept.
+    def useWorkers(self, workers):
+        if not self.fixed and workers > self.maxProcesses:
+            self.maxProcesses = workers
+            self.slots = threading.BoundedSemaphore(workers)
+
+    ##
+    # @brief Commands started by the current thread inside this context do not count against
+    # the limit. Needed for children that have to run together, e.g. both ends of a pipe.
+    @contextlib.contextmanager
+    def unlimited(self):
+        self.local.unlimited = True
+        try:
+            yield
+        finally:
+            self.local.unlimited = False
+
+    ##
+    # @brief Context that holds one of the child slots (unless the thread is unlimited)
+    def slot(self):
+        return contextlib.nullcontext() if getattr(self.local, 'unlimited', False) else self.slots
+
+    ##
+    # @brief Adds CPU time and peak memory of the children started by the current thread to
+    # the entries childCpu and childMaxRss of the dict <usage>. None stops recording.
+    def setUsageRecord(self, usage):
+        self.local.usage = usage
+
+    def recordsUsage(self):
+        return getattr(self.local, 'usage', None) is not None
+
+    ##
+    # @brief Adds <cpu> seconds and <maxRss> bytes to the usage record of the current thread
+    def recordUsage(self, cpu, maxRss):
+        usage = getattr(self.local, 'usage', None)
+        if usage is not None:
+            usage['childCpu'] += cpu
+            usage['childMaxRss'] = max(usage['childMaxRss'], maxRss)
+
+    ##
+    # @brief Children started by the current thread belong to <group> (any object that can be
+    # weakly referenced, None for none), so that they can be killed together by cancel
+    def setGroup(self, group):
+        self.local.group = group
+
+    ##
+    # @brief Kills all running children of <group>. Children the group starts later on are
+    # killed right away.
+    def cancel(self, group):
+        with self.lock:
+            self.cancelled.add(group)
+            procs = [p for p, g in self.children.items() if g is group]
+        for p in procs:
+            self.kill(p)
+
+    ##
+    # @brief Context in which the child <proc> is killed if the group of the current thread
+    # is cancelled
+    @contextlib.contextmanager
+    def track(self, proc):
+        group = getattr(self.local, 'group', None)
+        with self.lock:
+            self.children[proc] = group
+            cancelled = group is not None and group in self.cancelled
+        if cancelled:
+            self.kill(proc)
+        try:
+            yield proc
+        finally:
+            with self.lock:
+                self.children.pop(proc, None)
+
+    ##
+    # @brief Runs the shell command <cmd> and waits until it exited
+    #
+    # @param name Prefix for log messages
+    # @param timeout Seconds after which the command is killed, None to wait forever
+    #
+    # @return The exit code, which is always 0 as other codes raise subprocess.CalledProcessError
+    def run(self, cmd, name, timeout=None):
+        with self.slot():
+            proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, \
+                    stderr=subprocess.PIPE, start_new_session=True)
+            with self.track(proc):
+                try:
+                    self.__forwardOutput(proc, name, time.monotonic() + timeout if timeout else None)
+                except subprocess.TimeoutExpired:
+                    self.kill(proc)
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                finally:
+                    proc.stdout.close()
+                    proc.stderr.close()
+                    returnCode = self.__wait(proc)
+
+        if returnCode != 0:
+            raise subprocess.CalledProcessError(returnCode, cmd)
+        return returnCode
+
+    ##
+    # @brief Kills the child <proc> and all processes it started
+    def kill(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def __wait(self, proc):
+        try:
+            pid, status, rusage = os.wait4(proc.pid, 0)
+        except ChildProcessError:
+            # reaped already
+            return proc.wait()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in KiB
+        self.recordUsage(rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss * 1024)
+        return proc.returncode
+
+    def __forwardOutput(self, proc, name, deadline):
+        logFuns = {proc.stdout : logger.info, proc.stderr : logger.warning}
+        partial = {proc.stdout : b'', proc.stderr : b''}
+        with selectors.DefaultSelector() as sel:
+            for stream in logFuns:
+                sel.register(stream, selectors.EVENT_READ)
+
+            while sel.get_map():
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    raise subprocess.TimeoutExpired(proc.args, 0)
+
+                for key, events in sel.select(remaining):
+                    stream = key.fileobj
+                    data = os.read(stream.fileno(), ChildProcessExecutor.READ_SIZE)
+                    if not data:
+                        sel.unregister(stream)
+                        data = b'\n' if partial[stream] else b''
+                    lines = (partial[stream] + data).split(b'\n')
+                    partial[stream] = lines.pop()
+                    for line in lines:
+                        logFuns[stream]('[%s] %s', name, line.decode('utf-8', 'replace'))
+
+
+# shared by all processes that start children
+defaultExecutor = ChildProcessExecutor()
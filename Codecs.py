@@ -0,0 +1,149 @@
+import os
+import zlib
+import lzma
+import importlib
+import logging
+logger = logging.getLogger(__name__)
+
+from SecureFileOps import COPY_CHUNK_SIZE
+
+##
+# Codecs compress intermediate data (see EdgeStore). zlib and lzma come with python, zstd is used
+# if the zstandard package is installed. "auto" picks the fastest codec that is available. All
+# codecs compress and decompress incrementally, so neither side needs the whole data in memory.
+
+# data that does not shrink below this ratio is stored as it is
+SKIP_RATIO = 0.9
+# bytes at the start of a file that are compressed to decide whether the file is worth it
+SAMPLE_SIZE = 256 * 1024
+# smaller files are not worth the effort
+MIN_SIZE = 64 * 1024
+
+class Codec:
+    def __init__(self, name, extension, compressor, decompressor, reader=None):
+        self.name = name
+        # appended to the name of compressed files
+        self.extension = extension
+        # return objects with compress/flush resp. decompress methods, decompress has to take
+        # max_length like zlib and lzma unless there is a reader
+        self.compressor = compressor
+        self.decompressor = decompressor
+        # optional, returns a file object that reads the decompressed data from a file object
+        self.reader = reader
+
+
+def __zstd():
+    zstd = importlib.import_module('zstandard')
+    return Codec('zstd', '.zst', lambda: zstd.ZstdCompressor(level=1).compressobj(), \
+            lambda: zstd.ZstdDecompressor().decompressobj(), lambda f: zstd.ZstdDecompressor().stream_reader(f))
+
+CODECS = {
+    'zlib' : lambda: Codec('zlib', '.z', lambda: zlib.compressobj(1), zlib.decompressobj),
+    'lzma' : lambda: Codec('lzma', '.xz', lambda: lzma.LZMACompressor(preset=1), lzma.LZMADecompressor),
+    'zstd' : __zstd}
+# fastest first
+AUTO_ORDER = ['zstd', 'zlib']
+
+__loaded = {}
+
+##
+# @brief Returns the codec named <name> ("none" and None for no compression, "auto" for the
+# fastest available one), logs an error and returns None if it is not available
+def getCodec(name):
+    if not name or name == 'none':
+        return None
+    if name in __loaded:
+        return __loaded[name]
+    if name == 'auto':
+        for n in AUTO_ORDER:
+            try:
+                __loaded[name] = CODECS[n]()
+            except ImportError:
+                continue
+            logger.debug('Using codec %s for compression', n)
+            return __loaded[name]
+    if name not in CODECS:
+        logger.error('Unknown codec "%s", data is not compressed', name)
+        return None
+    try:
+        __loaded[name] = CODECS[name]()
+    except ImportError as e:
+        logger.error('Codec "%s" is not available (%s), data is not compressed', name, e)
+        __loaded[name] = None
+    return __loaded[name]
+
+
+##
+# @brief Compresses the file <src> to <dst> with <codec>, unless the data does not shrink
+# enough: the start of the file is tried before anything is written, and the result is
+# dropped if the whole file does not get smaller than SKIP_RATIO of its size.
+#
+# @return Size of <dst>, None if the data was not compressed (<dst> does not exist then)
+def compressFile(src, dst, codec, chunkSize=COPY_CHUNK_SIZE):
+    size = os.path.getsize(src)
+    if size < MIN_SIZE:
+        return None
+    with open(src, 'rb') as fi:
+        sample = fi.read(SAMPLE_SIZE)
+        compressor = codec.compressor()
+        if len(compressor.compress(sample)) + len(compressor.flush()) > SKIP_RATIO * len(sample):
+            logger.debug('Not compressing %s, the data does not shrink', src)
+            return None
+
+        fi.seek(0)
+        written = 0
+        compressor = codec.compressor()
+        try:
+            with open(dst, 'wb') as fo:
+                for chunk in iter(lambda: fi.read(chunkSize), b''):
+                    written += fo.write(compressor.compress(chunk))
+                written += fo.write(compressor.flush())
+        except BaseException:
+            os.remove(dst)
+            raise
+
+    if written > SKIP_RATIO * size:
+        logger.debug('Not compressing %s, the data does not shrink', src)
+        os.remove(dst)
+        return None
+    logger.debug('Compressed %d bytes of %s to %d bytes (%s)', size, src, written, codec.name)
+    return written
+
+
+##
+# @brief Reads the file <path> that was compressed with <codec>, yields the decompressed data
+# in chunks of at most <chunkSize> bytes, however well it compressed
+def decompressChunks(path, codec, chunkSize=COPY_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        if codec.reader:
+            reader = codec.reader(f)
+            for chunk in iter(lambda: reader.read(chunkSize), b''):
+                yield chunk
+            return
+
+        decompressor = codec.decompressor()
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            data = decompressor.decompress(chunk, chunkSize)
+            while True:
+                if data:
+                    yield data
+                # zlib keeps the input that did not fit into the output, lzma the output
+                if getattr(decompressor, 'unconsumed_tail', b''):
+                    data = decompressor.decompress(decompressor.unconsumed_tail, chunkSize)
+                elif not getattr(decompressor, 'needs_input', True) and not decompressor.eof:
+                    data = decompressor.decompress(b'', chunkSize)
+                else:
+                    break
+    flush = getattr(decompressor, 'flush', None)
+    if flush:
+        data = flush()
+        if data:
+            yield data
+
+
+##
+# @brief Decompresses the file <src> that was compressed with <codec> to <dst>
+def decompressFile(src, dst, codec):
+    with open(dst, 'wb') as f:
+        for chunk in decompressChunks(src, codec):
+            f.write(chunk)
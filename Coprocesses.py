@@ -0,0 +1,233 @@
+import os
+import time
+import atexit
+import selectors
+import threading
+import subprocess
+import ChildProcesses
+import logging
+logger = logging.getLogger(__name__)
+
+##
+# Scripts that support the worker mode are started once with the single argument --worker and
+# then process jobs sent to their stdin, one line per request, until stdin is closed:
+#
+#   PING                                       -> PONG
+#   RUN<TAB>in1,...,inN<TAB>out1,...,outM[<TAB>key=value ...] -> OK | ERROR<TAB>message
+#
+# stdout is reserved for the replies, everything the worker writes to stderr goes to the log.
+
+##
+# @brief A long-lived worker process that runs the script <command> in worker mode
+class Coprocess:
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, command):
+        self.proc = subprocess.Popen(command + ' --worker', shell=True, stdin=subprocess.PIPE, \
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        self.jobs = 0
+        self.partial = b''
+        self.logName = '%s:%d' % (os.path.basename(command), self.proc.pid)
+        self.stderrThread = threading.Thread(target=self.__forwardStderr, daemon=True)
+        self.stderrThread.start()
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    ##
+    # @brief Sends the request <line> and waits for the reply
+    #
+    # @param timeout Seconds to wait for the reply, None to wait forever
+    #
+    # @return The reply without the line break. Raises subprocess.TimeoutExpired or EOFError if
+    # the worker does not answer, it is unusable afterwards.
+    def request(self, line, timeout=None):
+        self.proc.stdin.write(line.encode('utf-8') + b'\n')
+        self.proc.stdin.flush()
+
+        deadline = time.monotonic() + timeout if timeout else None
+        with selectors.DefaultSelector() as sel:
+            sel.register(self.proc.stdout, selectors.EVENT_READ)
+            while b'\n' not in self.partial:
+                remaining = deadline - time.monotonic() if deadline else None
+                if (remaining is not None and remaining <= 0) or not sel.select(remaining):
+                    raise subprocess.TimeoutExpired(self.proc.args, timeout)
+                data = os.read(self.proc.stdout.fileno(), Coprocess.READ_SIZE)
+                if not data:
+                    raise EOFError('Worker %s exited' % self.logName)
+                self.partial += data
+
+        reply, self.partial = self.partial.split(b'\n', 1)
+        return reply.decode('utf-8', 'replace')
+
+    ##
+    # @brief Returns True if the worker is running and answers within <timeout> seconds
+    def ping(self, timeout):
+        try:
+            return self.alive() and self.request('PING', timeout) == 'PONG'
+        except (OSError, EOFError, subprocess.TimeoutExpired):
+            return False
+
+    ##
+    # @brief Resident memory of the worker and its children in bytes
+    def memoryUsage(self):
+        total = 0
+        for pid in [self.proc.pid] + self.__children(self.proc.pid):
+            try:
+                with open('/proc/%d/statm' % pid) as f:
+                    total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            except (OSError, ValueError, IndexError):
+                pass
+        return total
+
+    ##
+    # @brief CPU seconds used by the worker and the children it waited for
+    def cpuTime(self):
+        try:
+            with open('/proc/%d/stat' % self.proc.pid) as f:
+                fields = f.read().rpartition(')')[2].split()
+            return sum(int(t) for t in fields[11:15]) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError):
+            return 0.0
+
+    ##
+    # @brief Asks the worker to exit by closing its stdin, kills it if it does not
+    def close(self, timeout=1):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        ChildProcesses.defaultExecutor.kill(self.proc)
+        self.proc.wait()
+        self.proc.stdout.close()
+
+    def __children(self, pid):
+        try:
+            with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+                children = [int(c) for c in f.read().split()]
+        except OSError:
+            return []
+        return children + [g for c in children for g in self.__children(c)]
+
+    def __forwardStderr(self):
+        with self.proc.stderr:
+            for line in self.proc.stderr:
+                logger.warning('[%s] %s', self.logName, line.rstrip(b'\n').decode('utf-8', 'replace'))
+
+
+##
+# @brief Workers for one script, shared by all nodes that use it.
+#
+# Idle workers are checked with a PING before they get a job, and replaced after <maxJobs> jobs
+# or when they use more than <maxMemory> bytes. Running jobs count against the limit of
+# ChildProcesses.defaultExecutor like ordinary children.
+class CoprocessPool:
+    MAX_JOBS = 100
+    MAX_MEMORY = 1024 * 1024 * 1024
+    HEALTH_TIMEOUT = 5
+
+    def __init__(self, command, maxJobs=MAX_JOBS, maxMemory=MAX_MEMORY):
+        self.command = command
+        self.maxJobs = maxJobs
+        self.maxMemory = maxMemory
+        self.idle = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+    ##
+    # @brief Runs one job on a worker of the pool
+    #
+    # @param name Prefix for log messages
+    # @param timeout Seconds after which the worker is killed, None to wait forever
+    def run(self, inFiles, outFiles, params, name, timeout=None):
+        fields = ['RUN', ','.join(inFiles), ','.join(outFiles)]
+        fields += ['%s=%s' % (k, CoprocessPool.__escape(v)) for k, v in params.items()]
+
+        executor = ChildProcesses.defaultExecutor
+        with executor.slot():
+            worker = self.__acquire()
+            cpu = worker.cpuTime() if executor.recordsUsage() else None
+            try:
+                # cancelling kills the worker along with the job
+                with executor.track(worker.proc):
+                    reply = worker.request('\t'.join(fields), timeout)
+            except:
+                logger.error('[%s] Worker %s failed, restarting it for the next job', name, worker.logName)
+                worker.close(0)
+                raise
+            if cpu is not None:
+                executor.recordUsage(worker.cpuTime() - cpu, worker.memoryUsage())
+            self.__release(worker)
+
+        if reply != 'OK':
+            raise RuntimeError('[%s] %s' % (name, reply.partition('\t')[2] or reply))
+
+    ##
+    # @brief Stops all idle workers, busy workers are stopped when their job is done
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for worker in idle:
+            worker.close()
+
+    def __acquire(self):
+        while True:
+            with self.lock:
+                worker = self.idle.pop() if self.idle else None
+            if worker is None:
+                logger.debug('Starting worker for %s', self.command)
+                return Coprocess(self.command)
+            if worker.ping(CoprocessPool.HEALTH_TIMEOUT):
+                return worker
+            logger.warning('Worker %s does not respond, replacing it', worker.logName)
+            worker.close(0)
+
+    def __release(self, worker):
+        worker.jobs += 1
+        if worker.jobs >= self.maxJobs or worker.memoryUsage() > self.maxMemory:
+            logger.debug('Recycling worker %s after %d jobs', worker.logName, worker.jobs)
+            worker.close()
+            return
+        with self.lock:
+            if not self.closed:
+                self.idle.append(worker)
+                return
+        worker.close()
+
+    @staticmethod
+    def __escape(value):
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+##
+# @brief Returns the pool for the script <command>, creating it on first use
+#
+# @param state Snapshot of the script (see SecureFileOps.secureFileStat). The pool of an
+# earlier state is closed, so that no job runs on a worker that still has the old script.
+def getPool(command, state=None):
+    stale = []
+    with poolsLock:
+        if (command, state) not in pools:
+            stale = [pools.pop(key) for key in list(pools) if key[0] == command]
+            pools[(command, state)] = CoprocessPool(command)
+        pool = pools[(command, state)]
+    for p in stale:
+        logger.debug('Closing the workers of %s, the script changed', command)
+        p.close()
+    return pool
+
+
+##
+# @brief Stops the workers of all pools
+def closePools():
+    with poolsLock:
+        allPools = list(pools.values())
+        pools.clear()
+    for pool in allPools:
+        pool.close()
+
+pools = {}
+poolsLock = threading.Lock()
+atexit.register(closePools)
@@ -0,0 +1,275 @@
+import os
+import shutil
+import atexit
+import tempfile
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+import Codecs
+
+# tmpfs that is available on most Linux systems, files there live in memory
+DEFAULT_MEMORY_DIR = '/dev/shm'
+DEFAULT_SPILL_THRESHOLD = 4 * 1024 * 1024
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+##
+# @brief The file that backs a (non-pipe) connection. Mimics the parts of a file object that
+# ports rely on (name, close), like Fifo.
+#
+# Data on disk may be compressed (see EdgeStore), it is then kept in <name> + the extension of
+# the codec and <name> does not exist. Readers either stream it via chunks or get a
+# decompressed copy via acquirePlain.
+class EdgeFile:
+    def __init__(self, store, name, inMemory, codec=None):
+        self.store = store
+        self.name = name
+        self.inMemory = inMemory
+        # Codec to compress the data with once it is on disk, None to keep it as it is
+        self.codec = codec
+        # Codec the data is compressed with, None if it is not
+        self.compressed = None
+        # bytes accounted for this file
+        self.size = 0
+        # size of the data, also while it is compressed
+        self.dataSize = 0
+        # deleted on purpose after all consumers read it, the producer has to run again for new consumers
+        self.released = False
+        # decompressed copy for readers that need a path, and how many use it
+        self.plain = None
+        self.readers = 0
+        self.lock = threading.Lock()
+
+    def close(self):
+        pass
+
+    ##
+    # @brief See EdgeStore.reserve
+    def reserve(self, size):
+        return self.store.reserve(self, size)
+
+    ##
+    # @brief See EdgeStore.settle
+    def settle(self):
+        return self.store.settle(self)
+
+    ##
+    # @brief See EdgeStore.restore
+    def restore(self):
+        self.store.restore(self)
+
+    ##
+    # @brief Deletes the file and returns its space to the store
+    def remove(self):
+        self.store.release(self)
+
+    ##
+    # @brief Yields the data in chunks, decompresses it on the fly if it is compressed
+    def chunks(self, chunkSize=Codecs.COPY_CHUNK_SIZE):
+        codec = self.compressed
+        if codec:
+            yield from Codecs.decompressChunks(self.name + codec.extension, codec, chunkSize)
+            return
+        with open(self.name, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunkSize), b''):
+                yield chunk
+
+    ##
+    # @brief Returns the path of the data for a reader that needs a plain file (e.g. a script).
+    # Compressed data is decompressed into a copy that is shared by all readers until the last
+    # one called releasePlain.
+    def acquirePlain(self):
+        with self.lock:
+            codec = self.compressed
+            if not codec:
+                return self.name
+            if self.plain is None:
+                plain = self.store.create('none')
+                logger.debug('Decompressing %s for readers that need a path', self.name)
+                Codecs.decompressFile(self.name + codec.extension, plain.name, codec)
+                plain.settle()
+                self.plain = plain
+            self.readers += 1
+            return self.plain.name
+
+    ##
+    # @brief Tells that the reader of <path> (from acquirePlain) is done with it
+    def releasePlain(self, path):
+        with self.lock:
+            if self.plain is None or path != self.plain.name:
+                return
+            self.readers -= 1
+            if self.readers == 0:
+                self.plain.remove()
+                self.plain = None
+
+
+##
+# @brief Creates the files behind connections, in memory while they are small.
+#
+# New files are created in <memoryDir> (a tmpfs) as long as the files there use less than
+# <memoryBudget> bytes, otherwise in <scratchDir>. Once the producer wrote a file, settle moves it
+# to <scratchDir> if it is larger than <spillThreshold> or the budget is exceeded. Scripts get
+# paths in either case. A budget of 0 keeps all files on disk.
+#
+# With a <codec> (see Codecs.getCodec), files on disk are compressed when they are settled, and
+# files that spill from memory are compressed on the way to disk. Data that does not shrink is
+# kept as it is. The codec can also be chosen per file (see create).
+#
+# The store also keeps track of the space used by all files, in memory and on disk, and of the
+# peak since the last call of resetPeak.
+class EdgeStore:
+    def __init__(self, scratchDir=None, memoryDir=DEFAULT_MEMORY_DIR, spillThreshold=DEFAULT_SPILL_THRESHOLD, \
+            memoryBudget=DEFAULT_MEMORY_BUDGET, codec=None):
+        self.scratchDir = scratchDir
+        self.codec = Codecs.getCodec(codec)
+        self.memoryDir = memoryDir if memoryDir and os.path.isdir(memoryDir) else None
+        self.spillThreshold = spillThreshold
+        self.memoryBudget = memoryBudget
+        self.memoryUsed = 0
+        self.diskUsed = 0
+        self.peakUsed = 0
+        # directories of this process inside memoryDir and scratchDir, created on first use
+        self.dirs = {}
+        self.lock = threading.Lock()
+
+    ##
+    # @brief Returns a new, empty EdgeFile
+    #
+    # @param codec Name of the codec for this file, "none" to not compress it, None for the
+    # codec of the store
+    def create(self, codec=None):
+        with self.lock:
+            inMemory = self.memoryDir is not None and self.memoryUsed < self.memoryBudget
+            directory = self.__dir(self.memoryDir if inMemory else self.scratchDir)
+        fd, name = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        return EdgeFile(self, name, inMemory, self.codec if codec is None else Codecs.getCodec(codec))
+
+    ##
+    # @brief Moves <edgeFile> to disk before <size> bytes are written to it, if they would not
+    # stay in memory anyway. Saves writing them to memory first. The old contents are dropped.
+    #
+    # @return True if the file was moved, its name changed in that case
+    def reserve(self, edgeFile, size):
+        with self.lock:
+            if not edgeFile.inMemory or (size <= self.spillThreshold \
+                    and self.memoryUsed - edgeFile.size + size <= self.memoryBudget):
+                return False
+            self.__account(edgeFile, 0)
+            edgeFile.inMemory = False
+            directory = self.__dir(self.scratchDir)
+
+        os.remove(edgeFile.name)
+        fd, edgeFile.name = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        edgeFile.released = False
+        return True
+
+    ##
+    # @brief Accounts the size of <edgeFile> after it was written and moves it to disk if it is
+    # too large for memory. Compresses it if it ends up on disk and has a codec.
+    #
+    # @return True if the file was moved, its name changed in that case
+    def settle(self, edgeFile):
+        try:
+            size = os.path.getsize(edgeFile.name)
+        except OSError:
+            return False
+
+        with self.lock:
+            edgeFile.released = False
+            edgeFile.dataSize = size
+            self.__account(edgeFile, size)
+            spill = edgeFile.inMemory and (size > self.spillThreshold or self.memoryUsed > self.memoryBudget)
+            if spill:
+                self.__account(edgeFile, 0)
+                edgeFile.inMemory = False
+                self.__account(edgeFile, size)
+                directory = self.__dir(self.scratchDir)
+
+        name = os.path.join(directory, os.path.basename(edgeFile.name)) if spill else edgeFile.name
+        if edgeFile.codec and not edgeFile.inMemory:
+            compressedSize = Codecs.compressFile(edgeFile.name, name + edgeFile.codec.extension, edgeFile.codec)
+            if compressedSize is not None:
+                os.remove(edgeFile.name)
+                with self.lock:
+                    edgeFile.name = name
+                    edgeFile.compressed = edgeFile.codec
+                    self.__account(edgeFile, compressedSize)
+                return spill
+        if not spill:
+            return False
+
+        logger.debug('Moving %d bytes from %s to %s', size, edgeFile.name, name)
+        shutil.move(edgeFile.name, name)
+        edgeFile.name = name
+        return True
+
+    ##
+    # @brief Deletes the contents of <edgeFile>, the name stays reserved for restore
+    def release(self, edgeFile):
+        with self.lock:
+            self.__account(edgeFile, 0)
+            edgeFile.released = True
+        self.__removeData(edgeFile)
+
+    ##
+    # @brief Creates <edgeFile> again (empty) after it was released, so that it can be written.
+    # Compressed data is dropped, the producer writes a plain file again.
+    def restore(self, edgeFile):
+        if edgeFile.compressed:
+            with self.lock:
+                self.__account(edgeFile, 0)
+            self.__removeData(edgeFile)
+            edgeFile.released = True
+        if edgeFile.released:
+            open(edgeFile.name, 'wb').close()
+            edgeFile.released = False
+
+    def resetPeak(self):
+        with self.lock:
+            self.peakUsed = self.memoryUsed + self.diskUsed
+
+    ##
+    # @brief Deletes all files of this store
+    def clear(self):
+        with self.lock:
+            dirs, self.dirs = self.dirs, {}
+            self.memoryUsed = self.diskUsed = 0
+        for d in dirs.values():
+            shutil.rmtree(d, ignore_errors=True)
+
+    def __account(self, edgeFile, size):
+        if edgeFile.inMemory:
+            self.memoryUsed += size - edgeFile.size
+        else:
+            self.diskUsed += size - edgeFile.size
+        edgeFile.size = size
+        self.peakUsed = max(self.peakUsed, self.memoryUsed + self.diskUsed)
+
+    def __removeData(self, edgeFile):
+        names = [edgeFile.name]
+        with edgeFile.lock:
+            if edgeFile.compressed:
+                names.append(edgeFile.name + edgeFile.compressed.extension)
+                edgeFile.compressed = None
+            plain, edgeFile.plain, edgeFile.readers = edgeFile.plain, None, 0
+        if plain:
+            plain.remove()
+        for name in names:
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def __dir(self, parent):
+        if parent not in self.dirs:
+            self.dirs[parent] = tempfile.mkdtemp(prefix='indprog-', dir=parent)
+        return self.dirs[parent]
+
+
+# shared by all graphs, so that the memory budget is global
+defaultStore = EdgeStore()
+# files in memory would outlive the process otherwise
+atexit.register(lambda: defaultStore.clear())
@@ -0,0 +1,152 @@
+import itertools
+import logging
+logger = logging.getLogger(__name__)
+
+##
+# @brief Adjacency index of a directed acyclic graph that keeps a topological order up to date.
+#
+# Vertices can be any hashable objects. Edges are counted, so several connections between the
+# same pair of vertices (e.g. between different ports of two nodes) are one edge with a count.
+# The order is maintained incrementally with the algorithm of Pearce and Kelly: inserting an edge
+# only reorders the vertices between its two ends, and an edge that would close a cycle is
+# rejected before the index changes.
+class GraphIndex:
+    def __init__(self):
+        self.succs = {}
+        self.preds = {}
+        self.order = {}
+        # vertices without successors, a dict to keep insertion order
+        self.sinks = {}
+        self.__nextOrder = itertools.count()
+
+    def addVertex(self, v):
+        if v in self.order:
+            return
+        self.succs[v] = {}
+        self.preds[v] = {}
+        self.order[v] = next(self.__nextOrder)
+        self.sinks[v] = None
+
+    def removeVertex(self, v):
+        for s in list(self.succs[v]):
+            self.preds[s].pop(v)
+        for p in list(self.preds[v]):
+            self.succs[p].pop(v)
+            if not self.succs[p]:
+                self.sinks[p] = None
+        del self.succs[v], self.preds[v], self.order[v]
+        self.sinks.pop(v, None)
+
+    ##
+    # @brief Adds the edge <u> -> <v>
+    #
+    # @return False if the edge would create a cycle, the index is unchanged in that case
+    def addEdge(self, u, v):
+        if v in self.succs[u]:
+            self.succs[u][v] += 1
+            self.preds[v][u] += 1
+            return True
+        if u is v:
+            return False
+
+        lower, upper = self.order[v], self.order[u]
+        if upper > lower:
+            # vertices after v that have to move behind u, if u is among them there is a cycle
+            forward = self.__collect(v, self.succs, lambda n: self.order[n] <= upper, u)
+            if forward is None:
+                return False
+            # vertices before u that have to move in front of v
+            backward = self.__collect(u, self.preds, lambda n: self.order[n] >= lower)
+            self.__reorder(backward, forward)
+
+        self.succs[u][v] = 1
+        self.preds[v][u] = 1
+        self.sinks.pop(u, None)
+        return True
+
+    ##
+    # @brief Adds many edges at once and recomputes the order in linear time
+    #
+    # @return False if the edges would create a cycle, the index is unchanged in that case
+    def addEdges(self, edges):
+        added = []
+        for u, v in edges:
+            self.succs[u][v] = self.succs[u].get(v, 0) + 1
+            self.preds[v][u] = self.preds[v].get(u, 0) + 1
+            added.append((u, v))
+
+        order = self.__kahn()
+        if order is None:
+            for u, v in added:
+                self.removeEdge(u, v)
+            return False
+
+        self.order = {n : i for i, n in enumerate(order)}
+        self.__nextOrder = itertools.count(len(order))
+        for u, v in added:
+            self.sinks.pop(u, None)
+        return True
+
+    def removeEdge(self, u, v):
+        self.succs[u][v] -= 1
+        self.preds[v][u] -= 1
+        if self.succs[u][v] == 0:
+            del self.succs[u][v], self.preds[v][u]
+            if not self.succs[u]:
+                self.sinks[u] = None
+
+    ##
+    # @brief Returns <vertices> and all vertices upstream of them
+    def ancestors(self, vertices):
+        return self.__closure(vertices, self.preds)
+
+    ##
+    # @brief Returns <vertices> and all vertices downstream of them
+    def descendants(self, vertices):
+        return self.__closure(vertices, self.succs)
+
+    ##
+    # @brief Sorts <vertices> topologically (sources first)
+    def sort(self, vertices):
+        return sorted(vertices, key=self.order.__getitem__)
+
+    def __closure(self, vertices, adjacency):
+        result = set(vertices)
+        stack = list(result)
+        while stack:
+            for n in adjacency[stack.pop()]:
+                if n not in result:
+                    result.add(n)
+                    stack.append(n)
+        return result
+
+    def __collect(self, start, adjacency, inRange, forbidden=None):
+        result = [start]
+        visited = set(result)
+        for n in result:
+            for an in adjacency[n]:
+                if an is forbidden:
+                    return None
+                if an not in visited and inRange(an):
+                    visited.add(an)
+                    result.append(an)
+        return result
+
+    def __reorder(self, backward, forward):
+        vertices = self.sort(backward) + self.sort(forward)
+        slots = sorted(self.order[n] for n in vertices)
+        for n, o in zip(vertices, slots):
+            self.order[n] = o
+
+    def __kahn(self):
+        indegree = {n : len(p) for n, p in self.preds.items()}
+        queue = [n for n, d in indegree.items() if d == 0]
+        order = []
+        while queue:
+            n = queue.pop()
+            order.append(n)
+            for s in self.succs[n]:
+                indegree[s] -= 1
+                if indegree[s] == 0:
+                    queue.append(s)
+        return order if len(order) == len(indegree) else None
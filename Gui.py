@@ -11,12 +11,31 @@ from gi.repository import GtkFlow
 from gi.repository.Gdk import Color
 from gi.repository import Gdk
 
+import sys
 import logging
 logger = logging.getLogger(__name__)
 
+from Processing import ProcessingGraph
+import NodeTypes
+from Profiling import formatRecord
+
+##
+# @brief Returns the value of the text <valStr> for a parameter that has the value <old> now,
+# raises ValueError if the text does not fit the type of <old>
+def parseParam(old, valStr):
+    # bool("False") would be True
+    if isinstance(old, bool):
+        if valStr.strip().lower() in ('1', 'true', 'yes', 'on'):
+            return True
+        if valStr.strip().lower() in ('0', 'false', 'no', 'off'):
+            return False
+        raise ValueError('Not a boolean: "%s"' % valStr)
+    return type(old)(valStr)
+
 class FlowGuiNode(GFlow.SimpleNode):
     #COLOR_INVALID = Gdk.RGBA(255,0,0)
     COLOR_INVALID = Color(50000, 0, 0)
+    STATE_COLORS = {'queued' : 'gray', 'running' : 'blue', 'done' : 'darkgreen', 'failed' : 'red', 'skipped' : 'orange'}
 
     def __new__(cls, *args, **kwargs):
         x = GFlow.SimpleNode.new()
@@ -32,6 +51,14 @@ class FlowGuiNode(GFlow.SimpleNode):
         self.vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
         label = Gtk.Label.new(procNode.name)
         self.vbox.pack_start(label, False, False, 0)
+        # state in the current or last run
+        self.stateLabel = Gtk.Label.new('')
+        self.stateLabel.set_no_show_all(True)
+        self.vbox.pack_start(self.stateLabel, False, False, 0)
+        # timings of the last run, only shown while profiling
+        self.profileLabel = Gtk.Label.new('')
+        self.profileLabel.set_no_show_all(True)
+        self.vbox.pack_start(self.profileLabel, False, False, 0)
         self.generateParamBox()
 
     def __del__(self):
@@ -68,11 +95,14 @@ class FlowGuiNode(GFlow.SimpleNode):
 
 
     def setPorts(self, ins, outs):
+        self.sinks = {}
         for i in ins:
             sink = GFlow.SimpleSink.new("")
             sink.set_name(i)
             self.add_sink(sink)
+            self.sinks[i] = sink
 
+        self.sources = {}
         for o in outs:
             source = GFlow.SimpleSource.new("")
             source.set_name(o)
@@ -80,14 +110,27 @@ class FlowGuiNode(GFlow.SimpleNode):
             source.connect("linked", self.__sourceLinked)
             source.connect("unlinked", self.__sourceUnlinked)
             self.add_source(source)
+            self.sources[o] = source
 
     def setParams(self, paramDict):
         pass
 
+    ##
+    # @brief Shows the state of the node in a run (see ProcessingRun) below its name
+    def showState(self, state):
+        self.stateLabel.set_markup('<span foreground="%s">%s</span>' % (FlowGuiNode.STATE_COLORS.get(state, 'gray'), state))
+        self.stateLabel.set_visible(True)
+
+    ##
+    # @brief Shows <text> below the name of the node, hides it if empty
+    def showProfile(self, text):
+        self.profileLabel.set_text(text)
+        self.profileLabel.set_visible(bool(text))
+
     def __paramChanged(self, gtkEntry, key):
         valStr = gtkEntry.get_text()
         try:
-            val = type(self.procNode.getParam(key))(valStr)
+            val = parseParam(self.procNode.getParam(key), valStr)
             if self.procNode.setParam(key, val):
                 logger.debug('Changing parameter "%s" to value "%s"', key, val)
             else:
@@ -107,6 +150,9 @@ class FlowGuiNode(GFlow.SimpleNode):
 
         sinkPort = sinkNode.inputPorts[sinkName]
         sourcePort = sourceNode.outputPorts[sourceName]
+        if sourcePort in sinkPort.connectedTo:
+            # link of a connection that already exists, e.g. after loading a graph
+            return
         self.procNode.connectPorts(sourcePort, sinkPort)
 
     def __sourceUnlinked(self, sourceDock, sinkDock):
@@ -125,8 +171,175 @@ class FlowGui(object):
         self.nv.set_show_types(True)
         vbox.pack_end(self.nv, True, True, 0)
         #w.add(self.nv)
+        self.flowNodes = {}
 
     def createFlowNode(self, procNode):
         n = FlowGuiNode(procNode)
         self.nv.add_with_child(n, n.vbox)
         #self.nv.add_node(n)
+        self.flowNodes[procNode] = n
+        return n
+
+    ##
+    # @brief Shows <state> on the widget of <procNode>, if it has one
+    def showState(self, procNode, state):
+        if procNode in self.flowNodes:
+            self.flowNodes[procNode].showState(state)
+
+    ##
+    # @brief Overlays the last record of <profiler> on every node that has one
+    def showProfile(self, profiler):
+        records = profiler.latest()
+        for pn, fn in self.flowNodes.items():
+            fn.showProfile(formatRecord(records[pn]) if pn in records else '')
+
+    ##
+    # @brief Creates widgets for <procNodes> and links them like the connections
+    # between the processing nodes
+    def createFlowNodes(self, procNodes):
+        flowNodes = {pn : self.createFlowNode(pn) for pn in procNodes}
+        for pn, fn in flowNodes.items():
+            for op in pn.outputPorts.values():
+                for ip in op.connectedTo:
+                    if ip.node in flowNodes:
+                        fn.sources[op.name].link(flowNodes[ip.node].sinks[ip.name])
+
+
+class Indprog(object):
+    def __init__(self, workers=1, cache=None, pipes=False, profiler=None, remote=None, memoryBudget=None, release=False):
+        self.workers = workers
+        self.pipes = pipes
+        # ProcessingRun of the graph, if it is processed right now
+        self.currentRun = None
+        self.w = Gtk.Window.new(Gtk.WindowType.TOPLEVEL)
+        self.w.connect("destroy", self.__quit)
+        self.vbox = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
+        self.w.add(self.vbox)
+
+        self.createHud()
+
+        self.fgui = FlowGui(self.w, self.vbox)
+        self.procGraph = ProcessingGraph(cache)
+        self.procGraph.profiler = profiler
+        self.procGraph.remote = remote
+        self.procGraph.releaseIntermediates = release
+        if memoryBudget is not None:
+            self.procGraph.memoryBudget = memoryBudget
+
+    def __quit(self, widget=None, data=None):
+        Gtk.main_quit()
+        sys.exit(0)
+
+    def __createNode(self, nodeType, widget=None, data=None):
+        node = self.procGraph.createNode('node_' + nodeType, nodeType)
+        self.fgui.createFlowNode(node)
+
+    def __loadGraph(self, widget=None, data=None):
+        dialog = Gtk.FileChooserDialog('Load Graph From File', self.w,
+                Gtk.FileChooserAction.OPEN,
+                (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                 Gtk.STOCK_OPEN, Gtk.ResponseType.OK))
+        response = dialog.run()
+        if response == Gtk.ResponseType.OK:
+            knownNodes = set(self.procGraph.nodes)
+            if self.procGraph.loadFromFile(dialog.get_filename()):
+                self.fgui.createFlowNodes([n for n in self.procGraph.nodes if n not in knownNodes])
+        elif response == Gtk.ResponseType.CANCEL \
+            or response == Gtk.ResponseType.CLOSE \
+            or response == Gtk.ResponseType.DELETE_EVENT:
+            logger.debug('Loading cancelled')
+
+        dialog.destroy()
+
+    def __saveGraph(self, widget=None, data=None):
+        dialog = Gtk.FileChooserDialog('Save Graph To File', self.w,
+                Gtk.FileChooserAction.SAVE,
+                (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                 Gtk.STOCK_SAVE, Gtk.ResponseType.OK))
+        dialog.set_do_overwrite_confirmation(True)
+        response = dialog.run()
+        if response == Gtk.ResponseType.OK:
+            self.procGraph.saveToFile(dialog.get_filename())
+        else:
+            logger.debug('Saving cancelled')
+
+        dialog.destroy()
+
+    def __executeGraph(self, widget=None, data=None):
+        if self.currentRun:
+            logger.warning('The graph is processed already')
+            return
+        if self.pipes:
+            self.procGraph.setEdgeMode(True)
+        # the graph must not change while it is processed
+        self.fgui.nv.set_sensitive(False)
+        self.tools.set_sensitive(False)
+        self.cancelItem.set_sensitive(True)
+        # the callbacks run in the background, widgets may only be touched from the main loop
+        self.currentRun = self.procGraph.processAsync(workers=self.workers, \
+                onEvent=lambda node, state: GLib.idle_add(self.fgui.showState, node, state), \
+                onDone=lambda handle: GLib.idle_add(self.__executionFinished, handle))
+
+    def __cancelExecution(self, widget=None, data=None):
+        if self.currentRun:
+            self.currentRun.cancel()
+
+    def __executionFinished(self, handle):
+        self.currentRun = None
+        self.fgui.nv.set_sensitive(True)
+        self.tools.set_sensitive(True)
+        self.cancelItem.set_sensitive(False)
+        if self.procGraph.profiler:
+            self.fgui.showProfile(self.procGraph.profiler)
+        logger.info('Processing %s', 'finished' if handle.result else 'failed' if not handle.cancelled else 'cancelled')
+
+    def createHud(self):
+        self.tools = Gtk.ToolPalette()
+
+        # general functions
+        generalTools = Gtk.ToolItemGroup.new('General')
+        self.tools.add(generalTools)
+
+        loadItem = Gtk.ToolButton.new(None, 'Load')
+        loadItem.connect("clicked", self.__loadGraph)
+        generalTools.insert(loadItem, -1)
+
+        saveItem = Gtk.ToolButton.new(None, 'Save')
+        saveItem.connect("clicked", self.__saveGraph)
+        generalTools.insert(saveItem, -1)
+
+        runItem = Gtk.ToolButton.new(None, 'Run')
+        runItem.connect("clicked", self.__executeGraph)
+        generalTools.insert(runItem, -1)
+
+        # outside of the palette, which is insensitive while the graph is processed
+        self.cancelItem = Gtk.Button.new_with_label('Cancel')
+        self.cancelItem.connect("clicked", self.__cancelExecution)
+        self.cancelItem.set_sensitive(False)
+
+        # node functions, one group per group of node types
+        nodeTools = {}
+        for nodeType in NodeTypes.defaultRegistry.list():
+            if not nodeType.group:
+                continue
+            if nodeType.group not in nodeTools:
+                nodeTools[nodeType.group] = Gtk.ToolItemGroup.new(nodeType.group)
+                self.tools.add(nodeTools[nodeType.group])
+            nodeItem = Gtk.ToolButton.new(None, nodeType.label)
+            nodeItem.connect("clicked", lambda w = None, d = None, t = nodeType.name: self.__createNode(t, w, d))
+            nodeTools[nodeType.group].insert(nodeItem, -1)
+
+        toolBox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
+        toolBox.pack_start(self.tools, True, True, 0)
+        toolBox.pack_end(self.cancelItem, False, False, 0)
+        self.vbox.pack_start(toolBox, False, False, 0)
+
+        vsep = Gtk.VSeparator()
+        self.vbox.pack_start(vsep, False, False, 0)
+
+        logger.debug('HUD populated')
+
+
+    def run(self):
+        self.w.show_all()
+        Gtk.main()
@@ -0,0 +1,160 @@
+import os
+import sys
+import importlib
+import importlib.util
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+##
+# Node types map the type name of a node (as used by ProcessingGraph.createNode and stored in
+# graph files) to its process class. Classes are given as "module:Class" and their module is only
+# imported when the first node of the type is created, so that heavy dependencies (NumPy, the
+# MATLAB engine) do not slow down the start.
+#
+# Besides the built-in types, the registry discovers plugins:
+#  - installed packages that declare entry points in the group "indprog.nodes", named after the
+#    type and pointing to the class (e.g. "fft = mypackage.nodes:FftProcess")
+#  - files named *Plugin.py in the plugin directories (INDPROG_PLUGIN_PATH, separated like PATH,
+#    and ~/.indprog/plugins) that define register(registry) and call NodeTypeRegistry.register
+#    in there. These files are imported on discovery and should only refer to their classes
+#    by name, other modules in the plugin directories can be imported.
+
+ENTRY_POINT_GROUP = 'indprog.nodes'
+DEFAULT_PLUGIN_DIR = os.path.join(os.path.expanduser('~'), '.indprog', 'plugins')
+
+##
+# @brief Raised for a type name that is not registered
+class UnknownNodeType(KeyError):
+    def __str__(self):
+        return self.args[0]
+
+
+class NodeType:
+    def __init__(self, name, target, label=None, group=None):
+        self.name = name
+        # class or "module:Class"
+        self.target = target
+        # for the palette of the GUI, types without a group are not listed
+        self.label = label or name
+        self.group = group
+
+    ##
+    # @brief Returns the process class, imports its module on the first call
+    def load(self):
+        if isinstance(self.target, str):
+            module, _, cls = self.target.partition(':')
+            logger.debug('Loading node type "%s" from %s', self.name, self.target)
+            self.target = getattr(importlib.import_module(module), cls)
+        return self.target
+
+
+class NodeTypeRegistry:
+    def __init__(self):
+        self.types = {}
+        self.pluginDirs = []
+        # whether entry points and plugin directories were searched already
+        self.discovered = False
+        self.lock = threading.RLock()
+
+    ##
+    # @brief Adds the node type <name> for the process class <target> (or "module:Class"), a
+    # type that exists already is replaced
+    #
+    # @param label Name shown in the palette of the GUI
+    # @param group Palette group, None to not show the type
+    def register(self, name, target, label=None, group=None):
+        with self.lock:
+            self.types[name] = NodeType(name, target, label, group)
+
+    ##
+    # @brief Returns the process class of type <name>
+    #
+    # @raise UnknownNodeType
+    def get(self, name):
+        nodeType = self.types.get(name)
+        if nodeType is None:
+            self.discover()
+            nodeType = self.types.get(name)
+            if nodeType is None:
+                raise UnknownNodeType('Unknown node type "%s"' % name)
+        with self.lock:
+            return nodeType.load()
+
+    ##
+    # @brief Returns a new process of type <typeName> for the node <nodeName>
+    #
+    # @raise UnknownNodeType
+    def create(self, typeName, nodeName):
+        return self.get(typeName)(nodeName)
+
+    ##
+    # @brief Returns all types (including plugins), in the order they were registered
+    def list(self):
+        self.discover()
+        with self.lock:
+            return list(self.types.values())
+
+    ##
+    # @brief Searches <directory> for plugins as well, also if discover ran already
+    def addPluginDirectory(self, directory):
+        with self.lock:
+            self.pluginDirs.append(directory)
+            if self.discovered:
+                self.__loadDirectory(directory)
+
+    ##
+    # @brief Registers the types of all plugins, only searches once
+    def discover(self):
+        with self.lock:
+            if self.discovered:
+                return
+            self.discovered = True
+
+            # only imported here, it takes a large part of the start time otherwise
+            import importlib.metadata
+            try:
+                entryPoints = importlib.metadata.entry_points(group=ENTRY_POINT_GROUP)
+            except Exception as e:
+                logger.error('Failed to list installed node types: %s', e)
+                entryPoints = []
+            for ep in entryPoints:
+                self.register(ep.name, ep.value, group='Plugins')
+
+            dirs = [d for d in os.environ.get('INDPROG_PLUGIN_PATH', '').split(os.pathsep) if d]
+            for d in dirs + [DEFAULT_PLUGIN_DIR] + self.pluginDirs:
+                self.__loadDirectory(d)
+
+    def __loadDirectory(self, directory):
+        if not os.path.isdir(directory):
+            return
+        if directory not in sys.path:
+            sys.path.append(directory)
+        for fileName in sorted(os.listdir(directory)):
+            if not fileName.endswith('Plugin.py'):
+                continue
+            path = os.path.join(directory, fileName)
+            try:
+                spec = importlib.util.spec_from_file_location('indprog_plugin_' + fileName[:-3], path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                module.register(self)
+            except Exception as e:
+                logger.error('Failed to load plugin "%s": %s', path, e)
+
+
+defaultRegistry = NodeTypeRegistry()
+for name, target, label, group in [
+        ('fileread', 'Wrappers:FileReadProcess', 'FileRead', 'New Node'),
+        ('filewrite', 'Wrappers:FileWriteProcess', 'FileWrite', 'New Node'),
+        ('const', 'Wrappers:ConstantProcess', 'Constant', 'New Node'),
+        ('print', 'Wrappers:PrinterProcess', 'Printer', 'New Node'),
+        ('add', 'Wrappers:AdditionProcess', 'Adder', 'New Node'),
+        ('bash', 'Wrappers:BashProcess', 'Bash', 'New Node'),
+        ('python', 'Wrappers:PythonProcess', 'Python', 'New Node'),
+        ('matlab', 'Wrappers:MatlabProcess', 'MatLab', 'New Node'),
+        ('array', 'ArrayProcesses:ArrayConstantProcess', 'Array', 'Array Nodes'),
+        ('arith', 'ArrayProcesses:ArrayArithmeticProcess', 'Arithmetic', 'Array Nodes'),
+        ('reduce', 'ArrayProcesses:ArrayReduceProcess', 'Reduce', 'Array Nodes'),
+        ('cast', 'ArrayProcesses:ArrayCastProcess', 'Cast', 'Array Nodes')]:
+    defaultRegistry.register(name, target, label, group)
@@ -1,67 +1,909 @@
 import os
 import struct
 from abc import ABC, abstractmethod
-import uuid
+import itertools
 import tempfile
+import json
+import collections
+import gc
 import logging
+import threading
+import concurrent.futures
 
-from Wrappers import *
+from SecureFileOps import mapFile
+import NodeTypes
+from GraphIndex import GraphIndex
+import ChildProcesses
+import EdgeStore
+import Scheduling
+from Profiling import Profiler
 
 logger = logging.getLogger(__name__)
 
-class ProcessingGraph:
+##
+# Graphs are saved as JSON or in a binary form that loads faster. Both hold the same data, the
+# binary form is (all integers unsigned, little endian):
+#  - GRAPH_FILE_MAGIC
+#  - header: binary version, number of strings, bytes of strings, number of nodes, number of
+#    edges (5 x 32 bit)
+#  - strings: names of nodes, process types and ports, UTF-8, each terminated by a zero byte
+#  - nodes: string index of the name and of the process type (2 x 32 bit per node)
+#  - edges: index of the source node, string index of its port, index of the target node,
+#    string index of its port (4 x 32 bit), 1 if the edge is a pipe (8 bit), per edge
+#  - size of the rest (32 bit), then the parameters of the nodes and the pinned ports, codecs
+#    and resources as UTF-8 JSON
+# Files are checked before anything is added to the graph, so that truncated or foreign files
+# are rejected with an error.
+GRAPH_FILE_MAGIC = b'INDPROG\0'
+GRAPH_FILE_VERSION = 1
+# 1 was a marshal dump, which is not readable across python versions
+GRAPH_BINARY_VERSION = 2
+GRAPH_BINARY_HEADER = struct.Struct('<5I')
+GRAPH_BINARY_NODE = struct.Struct('<2I')
+GRAPH_BINARY_EDGE = struct.Struct('<4IB')
+GRAPH_BINARY_SIZE = struct.Struct('<I')
+
+##
+# @brief Returns the graph <data> (see ProcessingGraph.saveToFile) in the binary form, without
+# GRAPH_FILE_MAGIC
+def packGraphData(data):
+    strings = {}
+    def string(s):
+        if '\0' in s:
+            raise ValueError('Name "%s" contains a zero byte' % s)
+        return strings.setdefault(s, len(strings))
+
+    nodes = b''.join(GRAPH_BINARY_NODE.pack(string(name), string(processType)) \
+            for name, processType, params in data['nodes'])
+    edges = b''.join(GRAPH_BINARY_EDGE.pack(fromIdx, string(fromPort), toIdx, string(toPort), bool(pipe)) \
+            for fromIdx, fromPort, toIdx, toPort, pipe in data['edges'])
+    blob = b''.join(s.encode('utf-8') + b'\0' for s in strings)
+    rest = {k : v for k, v in data.items() if k not in ('version', 'nodes', 'edges')}
+    rest['params'] = [params for name, processType, params in data['nodes']]
+    rest = json.dumps(rest, separators=(',', ':')).encode('utf-8')
+    return b''.join([GRAPH_BINARY_HEADER.pack(GRAPH_BINARY_VERSION, len(strings), len(blob), \
+            len(data['nodes']), len(data['edges'])), blob, nodes, edges, GRAPH_BINARY_SIZE.pack(len(rest)), rest])
+
+##
+# @brief Reads graph data from <buf>, the binary form without GRAPH_FILE_MAGIC
+#
+# @return Data as ProcessingGraph.saveToFile stores it, raises ValueError for invalid data
+def unpackGraphData(buf):
+    def read(size):
+        nonlocal pos
+        if pos + size > len(buf):
+            raise ValueError('File is truncated')
+        pos += size
+        return buf[pos - size:pos]
+    pos = 0
+
+    version, numStrings, blobSize, numNodes, numEdges = GRAPH_BINARY_HEADER.unpack(read(GRAPH_BINARY_HEADER.size))
+    if version != GRAPH_BINARY_VERSION:
+        raise ValueError('Unsupported binary version %d' % version)
+    strings = read(blobSize).decode('utf-8').split('\0')
+    if len(strings) != numStrings + 1 or strings.pop():
+        raise ValueError('Invalid string table')
+    nodes = GRAPH_BINARY_NODE.iter_unpack(read(numNodes * GRAPH_BINARY_NODE.size))
+    edges = GRAPH_BINARY_EDGE.iter_unpack(read(numEdges * GRAPH_BINARY_EDGE.size))
+    rest = json.loads(read(GRAPH_BINARY_SIZE.unpack(read(GRAPH_BINARY_SIZE.size))[0]).decode('utf-8'))
+    if pos != len(buf):
+        raise ValueError('Unexpected data at the end of the file')
+    if not isinstance(rest, dict) or not isinstance(rest.get('params'), list) or len(rest['params']) != numNodes \
+            or not all(type(params) is dict for params in rest['params']):
+        raise ValueError('Invalid node parameters')
+
+    try:
+        data = dict(rest, version=GRAPH_FILE_VERSION)
+        data['nodes'] = [[strings[name], strings[processType], params] \
+                for (name, processType), params in zip(nodes, data.pop('params'))]
+        data['edges'] = [[fromIdx, strings[fromPort], toIdx, strings[toPort], bool(pipe)] \
+                for fromIdx, fromPort, toIdx, toPort, pipe in edges]
+    except IndexError:
+        raise ValueError('Invalid string index')
+    return data
+
+##
+# @brief Checks that graph <data> (of either form) has the structure written by
+# ProcessingGraph.saveToFile, raises ValueError if not
+#
+# @param typed True if the nodes and edges have the right types already (as unpackGraphData
+# returns them), only the node indices of the edges are checked then
+def checkGraphData(data, typed=False):
+    def isIndex(i):
+        return type(i) is int and 0 <= i < numNodes
+    def isPort(spec):
+        return isIndex(spec[0]) and isinstance(spec[1], str)
+    def check(valid, key, length):
+        specs = data.get(key, [])
+        if not isinstance(specs, list) or not all(isinstance(s, list) and len(s) == length and valid(s) for s in specs):
+            raise ValueError('Invalid %s' % key)
+
+    if not isinstance(data, dict) or data.get('version') != GRAPH_FILE_VERSION:
+        raise ValueError('Unsupported version %s' % (data.get('version') if isinstance(data, dict) else None))
+    if not isinstance(data.get('nodes'), list) or not isinstance(data.get('edges'), list):
+        raise ValueError('No nodes or edges')
+    numNodes = len(data['nodes'])
+    if typed:
+        if any(fromIdx >= numNodes or toIdx >= numNodes for fromIdx, fromPort, toIdx, toPort, pipe in data['edges']):
+            raise ValueError('Invalid edges')
+    else:
+        check(lambda s: isinstance(s[0], str) and isinstance(s[1], str) and isinstance(s[2], dict), 'nodes', 3)
+        check(lambda s: isPort(s) and isPort(s[2:]) and isinstance(s[4], bool), 'edges', 5)
+    check(isPort, 'pinned', 2)
+    check(lambda s: isPort(s) and (s[2] is None or isinstance(s[2], str)), 'codecs', 3)
+    check(lambda s: isIndex(s[0]) and isinstance(s[1], (int, float)) \
+            and (s[2] is None or isinstance(s[2], (int, float))), 'resources', 3)
+
+##
+# @brief Handle of a run started by ProcessingGraph.processAsync
+#
+# Every node of the run goes through the states "queued", "running" and then "done" or "failed",
+# or from "queued" to "skipped" if it cannot run because an upstream node failed or the run was
+# cancelled. Listeners are told about every change.
+class ProcessingRun:
     def __init__(self):
+        # node -> current state
+        self.states = {}
+        self.cancelled = False
+        # return value of ProcessingGraph.process, None while running
+        self.result = None
+        self.thread = None
+        self.listeners = []
+        self.doneCallbacks = []
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+
+    ##
+    # @brief Calls <callback>(node, state) on every state change
+    def addListener(self, callback):
+        self.listeners.append(callback)
+
+    ##
+    # @brief Calls <callback>(handle) once the run finished, right away if it already did
+    def addDoneCallback(self, callback):
+        with self.lock:
+            if not self.finished.is_set():
+                self.doneCallbacks.append(callback)
+                return
+        callback(self)
+
+    def setState(self, node, state):
+        with self.lock:
+            self.states[node] = state
+        for callback in self.listeners:
+            try:
+                callback(node, state)
+            except Exception as e:
+                logger.exception(e)
+
+    ##
+    # @brief Stops the run: nodes that did not start yet are skipped, running children (scripts
+    # and script workers) are killed, which fails their nodes
+    def cancel(self):
+        logger.info('Cancelling run')
+        self.cancelled = True
+        ChildProcesses.defaultExecutor.cancel(self)
+
+    def done(self):
+        return self.finished.is_set()
+
+    ##
+    # @brief Waits until the run finished or <timeout> seconds passed
+    #
+    # @return Whether all nodes were processed successfully, None on timeout
+    def wait(self, timeout=None):
+        self.finished.wait(timeout)
+        return self.result
+
+    ##
+    # @brief Called by ProcessingGraph.processAsync with the <result> of the run
+    def finish(self, result):
+        with self.lock:
+            self.result = result
+            self.finished.set()
+            callbacks, self.doneCallbacks = self.doneCallbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.exception(e)
+
+
+class ProcessingGraph:
+    def __init__(self, cache=None):
         self.nodes = []
+        # optional ResultCache to restore outputs of previous runs from
+        self.cache = cache
+        # node level adjacency, kept up to date by ProcessingNode.connectPorts / disconnectPorts
+        self.index = GraphIndex()
+        # optional Profiling.Profiler that records every run
+        self.profiler = None
+        # delete intermediate data once all consumers are up to date, unless the output port is pinned.
+        # Saves scratch space, but an edit then runs everything upstream of the edited node again.
+        self.releaseIntermediates = False
+        # optional RemoteWorkers.RemoteExecutor that processes nodes on worker daemons
+        self.remote = None
+        # run linear chains of streaming processes as one unit, see planFusion
+        self.fuse = True
+        # names of the nodes in every chain that was fused in the last run
+        self.fusedChains = []
+        # runtimes of earlier runs, the nodes on the slowest chains start first (see Scheduling).
+        # None unless given with --costs, created on the first run with a profiler otherwise.
+        self.costs = Scheduling.defaultCostModel
+        # CPUs (None for one per worker) and bytes of memory that running nodes may need together
+        self.cpuBudget = None
+        self.memoryBudget = Scheduling.physicalMemory()
 
-    def createNode(self, name, processType):
-        node = ProcessingNode(name, processType)
+    def createNode(self, name, processType, proc=None):
+        node = ProcessingNode(name, processType, proc)
+        node.graph = self
         self.nodes.append(node)
+        self.index.addVertex(node)
         return node
 
+    ##
+    # @brief Disconnects <nodes> and removes them from the graph
+    def removeNodes(self, nodes):
+        nodes = set(nodes)
+        for n in nodes:
+            for ip in n.inputPorts.values():
+                for op in list(ip.connectedTo):
+                    ProcessingNode.disconnectPorts(op, ip)
+            for op in n.outputPorts.values():
+                for ip in list(op.connectedTo):
+                    ProcessingNode.disconnectPorts(op, ip)
+            self.index.removeVertex(n)
+            n.graph = None
+        self.nodes = [n for n in self.nodes if n not in nodes]
+
     def getSinks(self):
-        return [n for n in self.nodes if not n.outputPorts or not any([op.connectedTo for op in n.outputPorts.values()])]
+        return list(self.index.sinks)
+
+    ##
+    # @brief Returns <nodes> and all nodes upstream of them
+    def getAncestors(self, nodes):
+        return self.index.ancestors(nodes)
+
+    ##
+    # @brief Returns <nodes> and all nodes downstream of them
+    def getDescendants(self, nodes):
+        return self.index.descendants(nodes)
+
+    ##
+    # @brief Processes all nodes that are required by <startNodes> (all sinks by default)
+    #
+    # @param startNodes List of nodes whose inputs should be brought up to date
+    # @param workers Number of nodes (or groups of pipe-connected nodes) that may run
+    # concurrently. A node is started as soon as all of its predecessors have finished.
+    # @param handle ProcessingRun that is told the state of every node and can cancel the run
+    #
+    # @return True if all scheduled nodes were processed successfully
+    def process(self, startNodes=None, workers=1, handle=None):
+        scheduled, startNodes = self.__plan(startNodes or self.getSinks())
+        # before any node runs, so that concurrent pipe ends share the same pipe
+        for n in scheduled:
+            n.materializePorts()
+
+        logger.info('Start processing (%d / %d node(s), %d sink(s), %d worker(s))',
+                len(scheduled), len(self.nodes), len(startNodes), workers)
+        if handle:
+            for n in self.index.sort(scheduled):
+                handle.setState(n, 'queued')
+        # remote workers get single nodes
+        chains = self.planFusion(scheduled) if self.fuse and not self.remote else []
+        self.fusedChains = [[n.name for n in chain] for chain in chains]
+        for names in self.fusedChains:
+            logger.info('Fusing %s', ' -> '.join(names))
+        grouped = self.__groups(scheduled, chains)
+        if grouped is None:
+            if handle:
+                for n in scheduled:
+                    handle.setState(n, 'failed')
+            return False
+        groups, succs, preds = grouped
+        # the nodes are measured anyway, so the order of later runs can as well profit from it
+        if self.costs is None and self.profiler:
+            self.costs = Scheduling.CostModel()
+        costs, needs, unknown = self.__groupCosts(groups, len(chains))
+        scheduler = self.__scheduler(costs, needs, succs, preds, workers)
+        if self.costs:
+            logger.info('Estimated runtime %.1f s (critical path %.1f s, %d node(s) without earlier runs)', \
+                    scheduler.simulate(), max(scheduler.priority, default=0.0), unknown)
+
+        # the cost model learns from the records of a profiler
+        profiler = self.profiler or (Profiler() if self.costs else None)
+        if profiler:
+            run = profiler.beginRun(scheduled, self.getAncestors(startNodes) - scheduled)
+        EdgeStore.defaultStore.resetPeak()
+        ChildProcesses.defaultExecutor.useWorkers(workers)
+        failed, skipped = self.__execute(groups, len(chains), scheduler, handle, profiler)
+        peakUsed = EdgeStore.defaultStore.peakUsed
+        if profiler:
+            profiler.endRun(run, failed, skipped, peakUsed)
+        if self.costs:
+            self.__updateCosts(scheduled, chains, profiler)
+
+        for n in skipped:
+            logger.warning('Node "%s" was skipped because %s', n.name, \
+                    'the run was cancelled' if handle and handle.cancelled else 'an upstream node failed')
+            if handle:
+                handle.setState(n, 'skipped')
+        logger.info('Finished processing (%d failed, %d skipped, at most %d bytes of intermediate data)',
+                len(failed), len(skipped), peakUsed)
+        return not failed and not skipped
+
+    ##
+    # @brief Estimates how long process would take, from the runtimes of earlier runs (see
+    # Scheduling.CostModel). Nodes that never ran count with Scheduling.DEFAULT_WALL seconds.
+    #
+    # @return Estimated seconds for the run and for its critical path, i.e. the slowest chain
+    # of nodes that have to run one after another, None if the nodes cannot run
+    def estimateRuntime(self, startNodes=None, workers=1):
+        scheduled, startNodes = self.__plan(startNodes or self.getSinks(), False)
+        chains = self.planFusion(scheduled) if self.fuse and not self.remote else []
+        grouped = self.__groups(scheduled, chains)
+        if grouped is None:
+            return None
+        groups, succs, preds = grouped
+        costs, needs, unknown = self.__groupCosts(groups, len(chains))
+        scheduler = self.__scheduler(costs, needs, succs, preds, workers)
+        return scheduler.simulate(), max(scheduler.priority, default=0.0)
+
+    ##
+    # @brief Returns the nodes that have to run to bring <startNodes> up to date, and
+    # <startNodes> together with pipe peers that have to run along
+    #
+    # @param mark Whether to mark producers of released data to run again, otherwise they
+    # are only included
+    def __plan(self, startNodes, mark=True):
+        startNodes = set(startNodes)
+        regenerated = set()
+        # both ends of a pipe have to run, otherwise the other one blocks
+        while True:
+            scheduled = set(self.topologicalSort(startNodes)) | regenerated
+            peers = set(gn for n in scheduled for gn in n.getPipeGroup()) - scheduled
+            # released data has to be produced again
+            producers = set(op.node for n in scheduled for ip in n.inputPorts.values() \
+                    for op in ip.connectedTo if op.fileObj and op.fileObj.released) - scheduled
+            if not peers and not producers:
+                return scheduled, startNodes
+            startNodes.update(peers)
+            for gn in [gn for n in producers for gn in n.getPipeGroup()]:
+                if mark:
+                    gn.dirty = True
+                    gn.regenerate = True
+                else:
+                    regenerated.add(gn)
+
+    ##
+    # @brief Splits <scheduled> into the groups that run as a unit: the fused <chains> first,
+    # then groups of pipe connected nodes (mostly single nodes)
+    #
+    # @return Groups, and the sets of successor and predecessor groups of every group, None if
+    # pipe groups depend on each other through files, so that none of them could start
+    def __groups(self, scheduled, chains):
+        groups = list(chains)
+        groupOf = {n : gi for gi, chain in enumerate(chains) for n in chain}
+        for n in scheduled:
+            if n not in groupOf:
+                group = [gn for gn in n.getPipeGroup() if gn in scheduled]
+                groupOf.update({gn : len(groups) for gn in group})
+                groups.append(group)
 
-    def process(self, startNodes=None):
-        if not startNodes:
-            startNodes = self.getSinks()
-        sequence = self.topologicalSort(startNodes)
+        succs = [set() for g in groups]
+        preds = [set() for g in groups]
+        for n in scheduled:
+            for op in n.outputPorts.values():
+                for sn in [ip.node for ip in op.connectedTo if ip.node in scheduled]:
+                    # a file within a pipe group would be read while it is written
+                    if groupOf[sn] != groupOf[n] or (not op.pipe and groupOf[n] >= len(chains)):
+                        succs[groupOf[n]].add(groupOf[sn])
+                        preds[groupOf[sn]].add(groupOf[n])
 
-        logger.info('Start processing (%d / %d node(s), %d sink(s))', len(sequence), len(self.nodes), len(startNodes))
-        for n in reversed(sequence):
-            n.process()
-        logger.info('Finished processing')
+        pending = [len(p) for p in preds]
+        stack = [gi for gi in range(len(groups)) if pending[gi] == 0]
+        while stack:
+            for sgi in succs[stack.pop()]:
+                pending[sgi] -= 1
+                if pending[sgi] == 0:
+                    stack.append(sgi)
+        if any(pending):
+            logger.error('Cannot process, pipe groups depend on each other through files (nodes that cannot start: %s)',
+                    ', '.join(n.name for gi in range(len(groups)) if pending[gi] for n in groups[gi]))
+            return None
+        return groups, succs, preds
 
+    ##
+    # @brief Returns the estimated seconds, the CPUs and memory needed by every group, and the
+    # number of nodes without earlier runs. The first <fused> groups are chains.
+    def __groupCosts(self, groups, fused):
+        costs = []
+        needs = []
+        unknown = 0
+        for gi, group in enumerate(groups):
+            walls = []
+            cpus = []
+            memory = []
+            for n in group:
+                entry = self.costs.estimate(n) if self.costs else None
+                unknown += entry is None
+                walls.append(entry['wall'] if entry else Scheduling.DEFAULT_WALL)
+                cpus.append(n.cpus)
+                memory.append(n.memory if n.memory is not None else int(entry['memory']) if entry else 0)
+            # a chain runs in a single thread, the nodes of a pipe group all at once
+            if gi < fused:
+                costs.append(sum(walls))
+                needs.append((max(cpus), max(memory)))
+            else:
+                costs.append(max(walls))
+                needs.append((sum(cpus), sum(memory)))
+        return costs, needs, unknown
+
+    def __scheduler(self, costs, needs, succs, preds, workers):
+        return Scheduling.Scheduler(costs, needs, succs, preds, workers, self.cpuBudget, self.memoryBudget)
+
+    def __updateCosts(self, scheduled, chains, profiler):
+        # the nodes of a chain share its runtime
+        shares = {n : 1.0 / len(chain) for chain in chains for n in chain}
+        for n, record in profiler.latest().items():
+            if n in scheduled:
+                self.costs.update(n, record, shares.get(n, 1.0))
+        if self.costs.path:
+            self.costs.save()
+
+    ##
+    # @brief Like process, but processes the nodes in a background thread
+    #
+    # @param onEvent Called as onEvent(node, state) whenever a node changes its state, see
+    # ProcessingRun. Runs in the thread that processes the node.
+    # @param onDone Called as onDone(handle) once the run finished, in the background thread
+    #
+    # @return ProcessingRun to follow or cancel the run
+    def processAsync(self, startNodes=None, workers=1, onEvent=None, onDone=None):
+        handle = ProcessingRun()
+        if onEvent:
+            handle.addListener(onEvent)
+        if onDone:
+            handle.addDoneCallback(onDone)
+
+        def target():
+            result = False
+            try:
+                result = self.process(startNodes, workers, handle)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                handle.finish(result)
+        handle.thread = threading.Thread(target=target, name='indprog-run', daemon=True)
+        handle.thread.start()
+        return handle
+
+    ##
+    # @brief Finds the chains among <nodes> that can run as one unit: nodes with streaming
+    # processes (see Process.streaming) where each node but the last has a single output port
+    # that is connected to the next node only. Data is passed along the chain in memory and not
+    # written to the connection files, so pinned ports and pipes end a chain.
+    #
+    # @return List of chains (lists of nodes in processing order) of at least two nodes
+    def planFusion(self, nodes):
+        def fusible(n):
+            ports = list(n.inputPorts.values()) + list(n.outputPorts.values())
+            return n in nodes and n.proc.streaming and all(p.connectedTo and not p.pipe for p in ports)
+
+        successors = {}
+        for n in self.index.sort(nodes):
+            if not fusible(n) or len(n.outputPorts) != 1:
+                continue
+            op = next(iter(n.outputPorts.values()))
+            if op.pinned or len(op.connectedTo) != 1:
+                continue
+            sn = next(iter(op.connectedTo)).node
+            # a node continues only one chain, its other inputs are read from files
+            if fusible(sn) and sn not in successors.values():
+                successors[n] = sn
+
+        chains = []
+        for n in self.index.sort(set(successors) - set(successors.values())):
+            chain = [n]
+            while chain[-1] in successors:
+                chain.append(successors[chain[-1]])
+            chains.append(chain)
+        return chains
+
+    ##
+    # @brief Deletes the data on the inputs of <nodes> that is not needed anymore, i.e. all
+    # consumers are up to date and the output port is not pinned
+    def releaseInputs(self, nodes):
+        for n in nodes:
+            for op in [op for ip in n.inputPorts.values() if not ip.pipe for op in ip.connectedTo]:
+                if op.pinned or not op.fileObj or op.fileObj.released or any(ip.node.dirty for ip in op.connectedTo):
+                    continue
+                logger.debug('Releasing data of [%s:%s]', op.node.name, op.name)
+                op.fileObj.remove()
+                op.buffer = None
+                if self.remote:
+                    self.remote.release(op)
+
+    def __runNode(self, node, handle, profiler):
+        if handle:
+            handle.setState(node, 'running')
+            # so that cancelling kills the children of the node
+            ChildProcesses.defaultExecutor.setGroup(handle)
+        record = profiler.beginNode(node) if profiler else None
+        try:
+            status = self.remote.run(node, self.cache) if self.remote else node.process(self.cache)
+        except Exception as e:
+            logger.error('Processing node "%s" failed', node.name)
+            logger.exception(e)
+            status = None
+        if record:
+            profiler.endNode(record, node, status or 'failed')
+        if handle:
+            ChildProcesses.defaultExecutor.setGroup(None)
+            handle.setState(node, 'failed' if status is None else 'done')
+        return status is not None
+
+    ##
+    # @brief Runs the fused <chain> (see planFusion) by handing the chunks every node yields to
+    # the next one
+    #
+    # @return List of failed nodes
+    def __runChain(self, chain, handle, profiler):
+        from Wrappers import writeStream
+
+        if handle:
+            for n in chain:
+                handle.setState(n, 'running')
+            ChildProcesses.defaultExecutor.setGroup(handle)
+        records = [profiler.beginNode(n) for n in chain] if profiler else []
+        try:
+            for n in chain:
+                n.materializePorts()
+            tail = chain[-1]
+            for op in tail.outputPorts.values():
+                op.fileObj.restore()
+
+            stream = None
+            for i, n in enumerate(chain):
+                inputs = [stream if i > 0 and next(iter(ip.connectedTo)).node is chain[i - 1] \
+                        else ip.fileObj.chunks() for ip in n.inputPorts.values()]
+                if n is tail:
+                    logger.debug('Executing fused chain "%s" ... "%s"', chain[0].name, tail.name)
+                    writeStream(n.proc.runStream(inputs), [op.fileObj.name for op in n.outputPorts.values()])
+                else:
+                    stream = (chunk for index, chunk in n.proc.runStream(inputs))
+
+            # the data between the nodes of the chain was never written
+            for n in chain[:-1]:
+                for op in n.outputPorts.values():
+                    op.fileObj.remove()
+                    op.buffer = None
+            tail.settleOutputs()
+            for n in chain:
+                n.markProcessed()
+            status = 'fused'
+        except Exception as e:
+            logger.error('Processing fused chain "%s" ... "%s" failed', chain[0].name, chain[-1].name)
+            logger.exception(e)
+            status = None
+
+        for record, n in zip(records, chain):
+            profiler.endNode(record, n, status or 'failed')
+        if handle:
+            ChildProcesses.defaultExecutor.setGroup(None)
+            for n in chain:
+                handle.setState(n, 'failed' if status is None else 'done')
+        return [] if status else chain
+
+    ##
+    # @brief Runs all nodes of a group concurrently and keeps the pipes between them from
+    # blocking forever if one side exits without opening or draining its end.
+    #
+    # @param fused Whether the group is a chain from planFusion instead of pipe connected nodes
+    #
+    # @return List of failed nodes, None if the run was cancelled before the group started
+    def __runGroup(self, group, handle, fused, profiler):
+        if handle and handle.cancelled:
+            return None
+        if fused:
+            return self.__runChain(group, handle, profiler)
+        if len(group) == 1:
+            return [] if self.__runNode(group[0], handle, profiler) else group
+
+        results = {}
+        def runMember(n):
+            # all members have to run at once, so they must not wait for each other's child slots
+            with ChildProcesses.defaultExecutor.unlimited():
+                results[n] = self.__runNode(n, handle, profiler)
+        threads = {n : threading.Thread(target=runMember, args=(n,), name=n.name) for n in group}
+        pipes = [(op, ip) for n in group for op in n.outputPorts.values() if op.pipe for ip in op.connectedTo]
+        for t in threads.values():
+            t.start()
+
+        while any(t.is_alive() for t in threads.values()):
+            for op, ip in pipes:
+                producerAlive = threads[op.node].is_alive()
+                consumerAlive = threads[ip.node].is_alive()
+                if consumerAlive and not producerAlive:
+                    op.fileObj.wakeReader()
+                elif producerAlive and not consumerAlive:
+                    op.fileObj.wakeWriter()
+            for t in threads.values():
+                t.join(Fifo.POLL_INTERVAL / len(threads))
+
+        return [n for n in group if not results[n]]
+
+    ##
+    # @brief Runs <groups> (see __groups) in the order and with the concurrency <scheduler>
+    # decides. The first <fused> groups are chains.
+    #
+    # @return Lists of failed and skipped nodes
+    def __execute(self, groups, fused, scheduler, handle, profiler):
+        failed = []
+        done = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=scheduler.workers) as executor:
+            submit = lambda gi: executor.submit(self.__runGroup, groups[gi], handle, gi < fused, profiler)
+            running = {submit(gi) : gi for gi in scheduler.start()}
+            while running:
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    gi = running.pop(future)
+                    groupFailed = future.result()
+                    # successors of a failed or cancelled group never become ready
+                    scheduler.finish(gi, groupFailed == [])
+                    if groupFailed is None:
+                        continue
+                    done.update(groups[gi])
+                    if self.releaseIntermediates:
+                        self.releaseInputs(groups[gi])
+                    failed.extend(groupFailed)
+                for gi in scheduler.start():
+                    running[submit(gi)] = gi
+
+        skipped = [n for g in groups for n in g if n not in done]
+        return failed, skipped
+
+    ##
+    # @brief Switches all connections that have a single consumer to pipe (<pipe> = True)
+    # or file (<pipe> = False) mode. Connections that would make pipe groups depend on each
+    # other through files stay files.
+    def setEdgeMode(self, pipe):
+        edges = [(op, next(iter(op.connectedTo))) for n in self.nodes for op in n.outputPorts.values() \
+                if len(op.connectedTo) == 1 and op.pipe != pipe]
+        if pipe:
+            edges = self.__pipeable(edges)
+        for op, ip in edges:
+            ProcessingNode.disconnectPorts(op, ip)
+            ProcessingNode.connectPorts(op, ip, pipe, checkGroups=False)
+
+    ##
+    # @brief Returns the connections of <edges> that can become pipes together, for the whole
+    # graph at once (see ProcessingNode.dependsThroughFiles for single connections)
+    def __pipeable(self, edges):
+        while True:
+            pipes = set(edges)
+            # pipe groups as they would be, by union-find
+            parent = {n : n for n in self.nodes}
+            def find(n):
+                while parent[n] is not n:
+                    parent[n] = parent[parent[n]]
+                    n = parent[n]
+                return n
+            links = [(op, ip) for n in self.nodes for op in n.outputPorts.values() for ip in op.connectedTo]
+            for op, ip in links:
+                if op.pipe or (op, ip) in pipes:
+                    parent[find(op.node)] = find(ip.node)
+
+            succs = {find(n) : set() for n in self.nodes}
+            preds = {g : set() for g in succs}
+            for op, ip in links:
+                if not (op.pipe or (op, ip) in pipes) or find(op.node) is not find(ip.node):
+                    succs[find(op.node)].add(find(ip.node))
+                    preds[find(ip.node)].add(find(op.node))
+            # groups on cycles remain when sources and sinks are removed
+            blocked = self.__unsorted(succs, preds) & self.__unsorted(preds, succs)
+            if not blocked:
+                return edges
+            remaining = [(op, ip) for op, ip in edges if find(op.node) not in blocked]
+            if len(remaining) == len(edges):
+                return edges
+            edges = remaining
+
+    ##
+    # @brief Returns the vertices of the graph given by <succs> and <preds> that are left when
+    # vertices without predecessors are removed repeatedly
+    @staticmethod
+    def __unsorted(succs, preds):
+        pending = {v : len(p) for v, p in preds.items()}
+        stack = [v for v, d in pending.items() if d == 0]
+        while stack:
+            for sv in succs[stack.pop()]:
+                pending[sv] -= 1
+                if pending[sv] == 0:
+                    stack.append(sv)
+        return set(v for v, d in pending.items() if d)
+
+    ##
+    # @brief Marks all nodes dirty whose external inputs (files, scripts) changed since
+    # their last run, together with everything downstream of them.
+    def invalidateChanged(self):
+        ProcessingNode.invalidateNodes([n for n in self.nodes if not n.proc.upToDate()])
+
+    ##
+    # @brief Returns the nodes that need processing to bring <startNodesRef> up to date,
+    # in reverse topological order (i.e. the start nodes first)
     def topologicalSort(self, startNodesRef):
-        startNodes = list(startNodesRef)
-        # TODO: check for cycles by testing for leftover edges when done
-        # copy the main graph structure
-        pureGraph =  {n : n.getConnectedNodes() for n in self.nodes}
-
-        sequence = []
-        while startNodes:
-            n = startNodes.pop()
-            if not n.upToDate():
-                sequence.append(n)
-            for pn in pureGraph[n][0]:
-                pureGraph[pn][1].remove(n)
-                if len(pureGraph[pn][1]) == 0:
-                    startNodes.append(pn)
-            pureGraph[n][0] = []
-
-        return sequence
-
-    def saveToFile(self, path):
-        pass
+        self.invalidateChanged()
+        sequence = [n for n in self.getAncestors(startNodesRef) if not n.upToDate()]
+        return list(reversed(self.index.sort(sequence)))
 
-    def loadFromFile(self, path):
-        pass
+    ##
+    # @brief Saves nodes, parameters and connections to <path>
+    #
+    # @param binary If True, a compact binary file is written that loads faster than the
+    # default JSON file. By default, files with the extension ".json" are written as JSON.
+    #
+    # @return True on success
+    def saveToFile(self, path, binary=None):
+        if binary is None:
+            binary = not path.endswith('.json')
+
+        nodeIndex = {n : i for i, n in enumerate(self.nodes)}
+        data = {'version' : GRAPH_FILE_VERSION,
+                'nodes' : [[n.name, n.processType, n.getParams()] for n in self.nodes],
+                'edges' : [[nodeIndex[n], op.name, nodeIndex[ip.node], ip.name, op.pipe] \
+                        for n in self.nodes for op in n.outputPorts.values() for ip in op.connectedTo],
+                'pinned' : [[nodeIndex[n], op.name] for n in self.nodes for op in n.outputPorts.values() if op.pinned],
+                'codecs' : [[nodeIndex[n], op.name, op.codec] for n in self.nodes for op in n.outputPorts.values() \
+                        if op.codec is not None],
+                'resources' : [[nodeIndex[n], n.cpus, n.memory] for n in self.nodes if n.cpus != 1 or n.memory is not None]}
+
+        try:
+            if binary:
+                with open(path, 'wb') as f:
+                    f.write(GRAPH_FILE_MAGIC)
+                    f.write(packGraphData(data))
+            else:
+                with open(path, 'w') as f:
+                    json.dump(data, f, indent=1)
+        except (IOError, ValueError, struct.error) as e:
+            logger.error('Failed to save graph to "%s": %s', path, e)
+            return False
+
+        logger.info('Saved %d node(s) to "%s"', len(self.nodes), path)
+        return True
+
+    ##
+    # @brief Adds the nodes and connections stored in <path> (in either format) to the graph
+    #
+    # @param sinks Names of nodes, if given only these nodes and the nodes upstream of them are loaded
+    #
+    # @return True on success
+    def loadFromFile(self, path, sinks=None):
+        # large graphs create many objects at once, which would start the cycle collector over and over
+        gcEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.__load(path, sinks)
+        finally:
+            if gcEnabled:
+                gc.enable()
+
+    def __load(self, path, sinks):
+        try:
+            with open(path, 'rb') as f:
+                binary = f.read(len(GRAPH_FILE_MAGIC)) == GRAPH_FILE_MAGIC
+                if binary:
+                    data = unpackGraphData(f.read())
+                else:
+                    f.seek(0)
+                    data = json.loads(f.read().decode('utf-8'))
+            checkGraphData(data, binary)
+        except (IOError, ValueError, struct.error) as e:
+            logger.error('Failed to load graph from "%s": %s', path, e)
+            return False
+        nodeSpecs = data['nodes']
+        edgeSpecs = data['edges']
+
+        selected = range(len(nodeSpecs))
+        if sinks:
+            predecs = [[] for spec in nodeSpecs]
+            for edge in edgeSpecs:
+                predecs[edge[2]].append(edge[0])
+            stack = [i for i, spec in enumerate(nodeSpecs) if spec[0] in sinks]
+            selected = set(stack)
+            while stack:
+                for pi in predecs[stack.pop()]:
+                    if pi not in selected:
+                        selected.add(pi)
+                        stack.append(pi)
+
+        # before any node is added, e.g. a plugin may be missing
+        procClasses = {}
+        for processType in set(nodeSpecs[i][1] for i in selected):
+            try:
+                procClasses[processType] = NodeTypes.defaultRegistry.get(processType)
+            except (NodeTypes.UnknownNodeType, ImportError, AttributeError) as e:
+                logger.error('Failed to load graph from "%s": %s', path, e)
+                return False
+
+        nodes = {}
+        for i in selected:
+            name, processType, params = nodeSpecs[i]
+            # the ports are created for the loaded parameters
+            proc = procClasses[processType](name)
+            proc.params.update(params)
+            nodes[i] = self.createNode(name, processType, proc)
+
+        connections = []
+        for fromIdx, fromPort, toIdx, toPort, pipe in edgeSpecs:
+            if fromIdx not in nodes or toIdx not in nodes:
+                continue
+            try:
+                connections.append((nodes[fromIdx].outputPorts[fromPort], nodes[toIdx].inputPorts[toPort], pipe))
+            except KeyError:
+                logger.error('Cannot connect [%s:%s] to [%s:%s], no such port.',
+                        nodeSpecs[fromIdx][0], fromPort, nodeSpecs[toIdx][0], toPort)
+
+        # the checks of connectPorts, for all connections at once
+        sinkCounts = collections.Counter(portTo for portFrom, portTo, pipe in connections)
+        sourceCounts = collections.Counter(portFrom for portFrom, portTo, pipe in connections)
+        for portFrom, portTo, pipe in connections:
+            if sinkCounts[portTo] > 1 or (pipe and sourceCounts[portFrom] > 1):
+                logger.error('Failed to load graph from "%s": [%s:%s] to [%s:%s] is not the only connection of the %s', \
+                        path, portFrom.node.name, portFrom.name, portTo.node.name, portTo.name, \
+                        'sink' if sinkCounts[portTo] > 1 else 'pipe')
+                self.__discardNodes(nodes.values())
+                return False
+
+        if not self.index.addEdges([(portFrom.node, portTo.node) for portFrom, portTo, pipe in connections]):
+            logger.error('Failed to load graph from "%s": the connections contain a cycle', path)
+            self.__discardNodes(nodes.values())
+            return False
+
+        # connect in bulk, the backing files are created on demand when the nodes run
+        for portFrom, portTo, pipe in connections:
+            portFrom.connectedTo.add(portTo)
+            portFrom.pipe = pipe
+            portTo.connectedTo.add(portFrom)
+            portTo.pipe = pipe
+        # not written by older versions
+        for nodeIdx, portName in data.get('pinned', []):
+            if nodeIdx in nodes and portName in nodes[nodeIdx].outputPorts:
+                nodes[nodeIdx].outputPorts[portName].pinned = True
+        for nodeIdx, portName, codec in data.get('codecs', []):
+            if nodeIdx in nodes and portName in nodes[nodeIdx].outputPorts:
+                nodes[nodeIdx].outputPorts[portName].codec = codec
+        for nodeIdx, cpus, memory in data.get('resources', []):
+            if nodeIdx in nodes:
+                nodes[nodeIdx].cpus = cpus
+                nodes[nodeIdx].memory = memory
+
+        logger.info('Loaded %d node(s) from "%s"', len(nodes), path)
+        return True
+
+    ##
+    # @brief Removes the unconnected <nodes> again
+    def __discardNodes(self, nodes):
+        nodes = set(nodes)
+        for n in nodes:
+            self.index.removeVertex(n)
+        self.nodes = [n for n in self.nodes if n not in nodes]
 
 
 ##
 # @brief A node bundles a process with input and output ports.
 class ProcessingNode:
+    ##
+    # @brief Connects an output port to an input port.
+    #
+    # @param pipe If True, the connection is backed by a named pipe instead of a file. Data
+    # then streams from producer to consumer while both run concurrently, but it is not
+    # stored, and the output port cannot be connected to further input ports.
+    # @param checkGroups If False, pipes are not checked for nodes that also depend on each
+    # other through files, for callers that checked the whole graph
     @classmethod
-    def connectPorts(self, portFrom, portTo):
+    def connectPorts(self, portFrom, portTo, pipe=False, checkGroups=True):
         if portFrom.direction == portTo.direction:
             logger.error('Cannot connect [%s:%s] to [%s:%s], both are of the same type ("%s").', \
                 portFrom.node.name, portFrom.name, portTo.node.name, portTo.name, portTo.direction)
@@ -69,18 +911,63 @@ class ProcessingNode:
         elif len(portTo.connectedTo) >= 1:
             logger.error('Cannot connect [%s:%s] to [%s:%s], sink is already connected.',
                 portFrom.node.name, portFrom.name, portTo.node.name, portTo.name)
-            return false
+            return False
+        elif (pipe or portFrom.pipe) and portFrom.connectedTo:
+            logger.error('Cannot connect [%s:%s] to [%s:%s], pipes cannot have more than one sink.',
+                portFrom.node.name, portFrom.name, portTo.node.name, portTo.name)
+            return False
+        elif pipe and checkGroups and ProcessingNode.dependsThroughFiles(set(portFrom.node.getPipeGroup()) | set(portTo.node.getPipeGroup())):
+            logger.error('Cannot connect [%s:%s] to [%s:%s] by a pipe, the nodes also depend on each other through files.',
+                portFrom.node.name, portFrom.name, portTo.node.name, portTo.name)
+            return False
+
+        graph = portFrom.node.graph
+        if graph and not graph.index.addEdge(portFrom.node, portTo.node):
+            logger.error('Cannot connect [%s:%s] to [%s:%s], the connection would create a cycle.',
+                portFrom.node.name, portFrom.name, portTo.node.name, portTo.name)
+            return False
 
         portFrom.connectedTo.add(portTo)
         portTo.connectedTo.add(portFrom)
         if not portFrom.fileObj:
-            portFrom.fileObj = tempfile.NamedTemporaryFile(delete = False)
-        portTo.fileObj = open(portFrom.fileObj.name, 'rb')
+            portFrom.pipe = pipe
+            # the producer has to fill the new file
+            portFrom.node.invalidate()
+        portTo.pipe = pipe
+        portTo.materialize()
+        # data produced in memory was only written to the file if a consumer needed it
+        if portFrom.buffer is not None and not portFrom.pipe and not portFrom.fileObj.released \
+                and not portTo.node.proc.inMemory \
+                and all(p.node.proc.inMemory for p in portFrom.connectedTo if p is not portTo):
+            with open(portFrom.fileObj.name, 'wb') as f:
+                f.write(portFrom.buffer)
+            portFrom.fileObj.settle()
+        portTo.node.invalidate()
 
         logger.debug('Connected [%s:%s] =>(%s)=> [%s:%s]', portFrom.node.name,\
                 portFrom.name, portFrom.fileObj.name, portTo.node.name, portTo.name)
         return True
 
+    ##
+    # @brief Returns True if a node of <group> depends on a node of <group> through a file,
+    # directly or through other pipe groups. The nodes of a pipe group run at the same time, so
+    # they could not wait for such a file.
+    @staticmethod
+    def dependsThroughFiles(group):
+        stack = [ip.node for n in group for op in n.outputPorts.values() if not op.pipe for ip in op.connectedTo]
+        visited = set()
+        while stack:
+            n = stack.pop()
+            if n in group:
+                return True
+            if n in visited:
+                continue
+            # the whole pipe group of a node runs once all of its inputs are there
+            pipeGroup = n.getPipeGroup()
+            visited.update(pipeGroup)
+            stack.extend(sn for gn in pipeGroup for sn in gn.getConnectedNodes()[1] if sn not in visited)
+        return False
+
     @classmethod
     def disconnectPorts(self, portFrom, portTo):
         names = (portFrom.node.name, portFrom.name, portTo.node.name, portTo.name)
@@ -90,14 +977,21 @@ class ProcessingNode:
 
             portFrom.connectedTo.remove(portTo)
             portTo.connectedTo.remove(portFrom)
-            portTo.fileObj.close()
-            portTo.fileObj = None
+            if portFrom.node.graph:
+                portFrom.node.graph.index.removeEdge(portFrom.node, portTo.node)
+            if portTo.fileObj:
+                portTo.fileObj.close()
+                portTo.fileObj = None
+            portTo.pipe = False
+            portTo.node.invalidate()
 
             # if no sink ports are connected anymore, close the file
             if not portFrom.connectedTo:
-                portFrom.fileObj.close()
-                os.remove(portFrom.fileObj.name)
-                portFrom.fileObj = None
+                if portFrom.fileObj:
+                    portFrom.fileObj.remove()
+                    portFrom.fileObj = None
+                portFrom.buffer = None
+                portFrom.pipe = False
 
         except Exception as e:
             logger.critical('Failed to disconnect [%s:%s] =x= [%s:%s]', *names)
@@ -107,24 +1001,44 @@ class ProcessingNode:
         logger.debug('Disconnected [%s:%s] =x= [%s:%s]', *(names))
         return True
 
-    def __init__(self, name, processType):
+    ##
+    # @brief Marks <nodes> and all nodes downstream of them as dirty, so that they are
+    # scheduled by the next call to ProcessingGraph.process. Pipes do not store data, so
+    # producers that feed a dirty node through a pipe are marked dirty as well.
+    #
+    # Everything downstream of a dirty node is dirty already, so the search stops there
+    # (unless the node is only dirty to regenerate its data).
+    @classmethod
+    def invalidateNodes(self, nodes):
+        stack = list(nodes)
+        visited = set(stack)
+        while stack:
+            n = stack.pop()
+            n.dirty = True
+            n.regenerate = False
+            pipePredecNodes = [port.node for inPort in n.inputPorts.values() if inPort.pipe for port in inPort.connectedTo]
+            for sn in n.getConnectedNodes()[1] | set(pipePredecNodes):
+                if sn not in visited and not (sn.dirty and not sn.regenerate):
+                    visited.add(sn)
+                    stack.append(sn)
+
+    ##
+    # @param processType Name of the node type, see NodeTypes
+    # @param proc Process to use instead of creating one for <processType>
+    def __init__(self, name, processType, proc=None):
         self.name = name
-        if processType == "":
-            self.proc = Process(name)
-        elif processType == "fileread":
-            self.proc = FileReadProcess(name)
-        elif processType == "filewrite":
-            self.proc = FileWriteProcess(name)
-        elif processType == "const":
-            self.proc = ConstantProcess(name)
-        elif processType == "add":
-            self.proc = AdditionProcess(name)
-        elif processType == "print":
-            self.proc = PrinterProcess(name)
-        elif processType == "bash":
-            self.proc = BashProcess(name)
-        elif processType == "matlab":
-            self.proc = MatlabProcess(name)
+        self.processType = processType
+        self.dirty = True
+        # the node only runs to produce released outputs again, which does not change them
+        self.regenerate = False
+        # CPUs and bytes of memory the node needs while it runs, None to use the memory
+        # measured in earlier runs (see Scheduling)
+        self.cpus = 1
+        self.memory = None
+        # set by ProcessingGraph.createNode
+        self.graph = None
+        # raises NodeTypes.UnknownNodeType
+        self.proc = proc or NodeTypes.defaultRegistry.create(processType, name)
 
         # create ports
         portSpecs = self.proc.getPortSpecs()
@@ -137,8 +1051,13 @@ class ProcessingNode:
     def getParams(self):
         return self.proc.getParams()
 
+    def invalidate(self):
+        ProcessingNode.invalidateNodes([self])
+
     def upToDate(self):
-        return all([p.upToDate() for p in self.inputPorts.values()]) \
+        return not self.dirty \
+                and all([p.upToDate() for p in self.inputPorts.values()]) \
+                and all([p.upToDate() for p in self.outputPorts.values()]) \
                 and self.proc.upToDate()
 
     ##
@@ -146,24 +1065,176 @@ class ProcessingNode:
     # This method does not create new parameters.
     def setParam(self, name, value):
         if name in self.proc.params:
-            self.proc.params[name] = value
+            if self.proc.params[name] != value:
+                self.proc.params[name] = value
+                if name in self.proc.portParams:
+                    self.updatePorts()
+                self.invalidate()
             return True
         else:
             return False
 
+    ##
+    # @brief Adds and removes ports to match the port specs of the process, e.g. after a
+    # parameter in Process.portParams changed. Connections of removed ports are dropped.
+    def updatePorts(self):
+        portSpecs = self.proc.getPortSpecs()
+        if [list(self.inputPorts), list(self.outputPorts)] == portSpecs:
+            return
+
+        for p in [p for n, p in self.inputPorts.items() if n not in portSpecs[0]]:
+            for cp in list(p.connectedTo):
+                ProcessingNode.disconnectPorts(cp, p)
+        for p in [p for n, p in self.outputPorts.items() if n not in portSpecs[1]]:
+            for cp in list(p.connectedTo):
+                ProcessingNode.disconnectPorts(p, cp)
+
+        self.inputPorts = {ip : self.inputPorts.get(ip) or Port(self, ip, 'in') for ip in portSpecs[0]}
+        self.outputPorts = {op : self.outputPorts.get(op) or Port(self, op, 'out') for op in portSpecs[1]}
+        logger.debug('Updated ports of node "%s": %s', self.name, portSpecs)
+
     def getConnectedNodes(self):
         predecNodes = set([port.node for inPort in self.inputPorts.values() if inPort.connectedTo for port in inPort.connectedTo])
         succesNodes = set([port.node for outPort in self.outputPorts.values() if outPort.connectedTo for port in outPort.connectedTo])
         return [predecNodes, succesNodes]
 
-    def process(self):
-        inFiles = [inPort.fileObj.name if inPort.fileObj else None for inPort in self.inputPorts.values()]
+    ##
+    # @brief Returns all nodes that are connected to this node through pipes, directly or
+    # indirectly, including this node. These nodes have to run concurrently.
+    def getPipeGroup(self):
+        group = [self]
+        visited = set(group)
+        for n in group:
+            ports = list(n.inputPorts.values()) + list(n.outputPorts.values())
+            for pn in [cp.node for p in ports if p.pipe for cp in p.connectedTo]:
+                if pn not in visited:
+                    visited.add(pn)
+                    group.append(pn)
+        return group
+
+    ##
+    # @brief Creates the files (or pipes) backing the connected ports of this node,
+    # if that did not happen yet
+    def materializePorts(self):
+        for p in list(self.inputPorts.values()) + list(self.outputPorts.values()):
+            p.materialize()
+
+    ##
+    # @brief Runs the process of this node, or restores its outputs from <cache> if the
+    # process already ran with the same parameters and inputs
+    #
+    # @return What was done: "executed", "in memory", "cached" or "not connected"
+    def process(self, cache=None):
+        self.materializePorts()
+        for outPort in self.outputPorts.values():
+            if outPort.fileObj:
+                outPort.fileObj.restore()
+        ports = list(self.inputPorts.values()) + list(self.outputPorts.values())
+        if all(p.fileObj for p in ports) and self.proc.streaming and not self.proc.inMemory \
+                and not any(p.pipe for p in ports) and any(ip.fileObj.compressed for ip in self.inputPorts.values()):
+            from Wrappers import writeStream
+            # decompressed while the process reads it, the plain data never hits the disk
+            logger.debug('Executing process "%s" on compressed inputs', self.name)
+            writeStream(self.proc.runStream([ip.fileObj.chunks() for ip in self.inputPorts.values()]), \
+                    [op.fileObj.name for op in self.outputPorts.values()])
+            self.settleOutputs()
+            self.markProcessed()
+            return 'executed'
+
+        inFiles = [inPort.fileObj.acquirePlain() if inPort.fileObj else None for inPort in self.inputPorts.values()]
+        try:
+            return self.__processFiles(cache, inFiles)
+        finally:
+            for inPort, inFile in zip(self.inputPorts.values(), inFiles):
+                if inFile:
+                    inPort.fileObj.releasePlain(inFile)
+
+    def __processFiles(self, cache, inFiles):
         outFiles = [outPort.fileObj.name if outPort.fileObj else None for outPort in self.outputPorts.values()]
-        if all(inFiles) and all(outFiles):
-            logger.debug('Executing process "%s"', self.name)
-            self.proc.run(inFiles, outFiles)
+        if all(inFiles) and all(outFiles) and self.proc.inMemory:
+            logger.debug('Executing process "%s" in memory', self.name)
+            self.__processInMemory(inFiles)
+            self.settleOutputs()
+            self.markProcessed()
+            return 'in memory'
+        elif all(inFiles) and all(outFiles):
+            key = None
+            ports = list(self.inputPorts.values()) + list(self.outputPorts.values())
+            if cache and outFiles and self.proc.cacheable and not any(p.pipe for p in ports):
+                key = cache.key(self.proc, inFiles)
+
+            if self.reserveOutputs(self.proc.getOutputSizes(inFiles)):
+                outFiles = [outPort.fileObj.name for outPort in self.outputPorts.values()]
+            if key and cache.fetch(key, outFiles):
+                logger.debug('Restored outputs of process "%s" from cache', self.name)
+                status = 'cached'
+            else:
+                logger.debug('Executing process "%s"', self.name)
+                self.proc.run(inFiles, outFiles)
+                if key:
+                    cache.store(key, outFiles)
+                status = 'executed'
+            self.settleOutputs()
+            self.markProcessed()
+            return status
         else:
             logger.warning('One or more ports are not connected. Node "%s" will not be processed!', self.name)
+            return 'not connected'
+
+    ##
+    # @brief Marks this node as up to date after its outputs were produced, e.g. by a worker daemon
+    def markProcessed(self):
+        self.proc.commitState()
+        self.dirty = False
+        self.__invalidateConsumers()
+
+    def __invalidateConsumers(self):
+        if self.regenerate:
+            self.regenerate = False
+            return
+        # downstream nodes now see new input data, pipe consumers ran along with this node
+        ProcessingNode.invalidateNodes([port.node for outPort in self.outputPorts.values() \
+                if not outPort.pipe for port in outPort.connectedTo])
+
+    ##
+    # @brief Lets the edge store move outputs to disk before they are written if they are
+    # expected to be too large for memory
+    #
+    # @param sizes Expected sizes of the outputs (see Process.getOutputSizes), may be None
+    #
+    # @return True if an output file moved
+    def reserveOutputs(self, sizes):
+        moved = False
+        for outPort, size in zip(self.outputPorts.values(), sizes or []):
+            if not outPort.pipe and outPort.fileObj.reserve(size):
+                moved = True
+        return moved
+
+    ##
+    # @brief Lets the edge store move outputs that turned out too large for memory to disk
+    def settleOutputs(self):
+        for outPort in self.outputPorts.values():
+            if not outPort.pipe and outPort.fileObj:
+                outPort.fileObj.settle()
+
+    def __processInMemory(self, inFiles):
+        inputs = []
+        for inPort, inFile in zip(self.inputPorts.values(), inFiles):
+            outPort = next(iter(inPort.connectedTo))
+            if outPort.buffer is not None:
+                inputs.append(outPort.buffer)
+            elif inPort.pipe:
+                with open(inFile, 'rb') as f:
+                    inputs.append(f.read())
+            else:
+                inputs.append(mapFile(inFile))
+
+        for outPort, data in zip(self.outputPorts.values(), self.proc.runBuffers(inputs)):
+            outPort.buffer = data
+            # other processes only see files
+            if outPort.pipe or not all(p.node.proc.inMemory for p in outPort.connectedTo):
+                with open(outPort.fileObj.name, 'wb') as f:
+                    f.write(data)
 
     def __str__(self):
         return 'Processing Node "%s", %d input ports, %d output ports' % (self.name, len(self.inputPorts), len(self.outputPorts))
@@ -180,18 +1251,100 @@ class Port:
         self.connectedTo = set()
 
         self.fileObj = None
+        self.pipe = False
+        # data of an output port that was produced in memory (see Process.inMemory)
+        self.buffer = None
+        # keep the data of this output port after all consumers read it
+        self.pinned = False
+        # codec for the data of this output port once it is on disk (see EdgeStore), "none" to
+        # not compress it, None for the codec of the store
+        self.codec = None
+
+
+    ##
+    # @brief Creates the file that backs a connection of this port. Output ports own the
+    # file, input ports share the file of the output port they are connected to. Files are
+    # only opened by the processes while they run.
+    def materialize(self):
+        if self.fileObj or not self.connectedTo:
+            return
+
+        if self.direction == 'out':
+            self.fileObj = Fifo() if self.pipe else EdgeStore.defaultStore.create(self.codec)
+            return
 
+        portFrom = next(iter(self.connectedTo))
+        portFrom.materialize()
+        self.fileObj = portFrom.fileObj
 
     def __del__(self):
         pass
         #if self.fileObj:
         #    os.unlink(self.fileObj)
 
+    ##
+    # @brief A port is up to date as long as the file that backs it still exists (possibly
+    # compressed), or was released after all consumers read it
     def upToDate(self):
-        return False
+        return self.fileObj is not None and (self.fileObj.released or self.fileObj.compressed is not None \
+                or os.path.exists(self.fileObj.name))
 
     def __str__(self):
         foName = self.fileObj.name if self.fileObj else str(None)
         return 'Port "%s", parent node: "%s", direction: %s, tempfile name: %s, %d connections: %s' \
                 % (self.name, self.node.name, self.direction, foName, len(self.connectedTo), \
                 str([p.name for p in self.connectedTo]))
+
+
+
+##
+# @brief A named pipe that backs a streaming connection. Mimics the parts of a file object
+# that ports rely on (name, close).
+class Fifo:
+    POLL_INTERVAL = 0.05
+    # pipes hold no data that could be released or compressed
+    released = False
+    compressed = None
+
+    __dir = None
+    __ids = itertools.count()
+
+    def __init__(self):
+        if not Fifo.__dir:
+            Fifo.__dir = tempfile.mkdtemp(prefix='indprog-')
+        self.name = os.path.join(Fifo.__dir, 'fifo%d' % next(Fifo.__ids))
+        os.mkfifo(self.name)
+
+    def close(self):
+        pass
+
+    def restore(self):
+        pass
+
+    def remove(self):
+        os.remove(self.name)
+
+    def acquirePlain(self):
+        return self.name
+
+    def releasePlain(self, path):
+        pass
+
+    ##
+    # @brief Unblocks a reader that waits for a writer which will never come,
+    # the reader sees end of file instead
+    def wakeReader(self):
+        try:
+            os.close(os.open(self.name, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            # no reader yet
+            pass
+
+    ##
+    # @brief Unblocks a writer that waits for a reader which will never come,
+    # the writer gets a broken pipe error instead
+    def wakeWriter(self):
+        try:
+            os.close(os.open(self.name, os.O_RDONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
@@ -0,0 +1,149 @@
+import os
+import time
+import json
+import threading
+import ChildProcesses
+import logging
+logger = logging.getLogger(__name__)
+
+##
+# @brief Records what happened to every node during ProcessingGraph.process.
+#
+# Attach an instance to ProcessingGraph.profiler to enable it. For each node that was scheduled,
+# a record (a dict) with the following entries is kept:
+#   name, type       of the node
+#   status           executed, in memory, cached, not connected, failed or skipped (upstream failed)
+#   start, wall      seconds since the profiler was created, and how long the node took
+#   cpu              CPU seconds of the thread that processed the node
+#   childCpu         CPU seconds of the child processes the node started
+#   childMaxRss      peak resident memory of these children in bytes
+#   inputs, outputs  bytes per port, None for pipes
+#   thread           name of the processing thread
+# Nodes that were up to date get a record with status "up to date" and no timings.
+class Profiler:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.records = []
+        # one entry per call of ProcessingGraph.process
+        self.runs = []
+        # last record of every node
+        self.lastRecords = {}
+        self.lock = threading.Lock()
+
+    ##
+    # @brief Called by ProcessingGraph.process before <scheduled> nodes run, <upToDate> nodes
+    # were needed but did not have to run
+    def beginRun(self, scheduled, upToDate):
+        run = {'start' : self.__now(), 'wall' : None, 'scheduled' : len(scheduled), 'failed' : None, \
+                'peakScratch' : None}
+        for n in upToDate:
+            self.__add(n, self.__record(n, 'up to date'))
+        self.runs.append(run)
+        return run
+
+    ##
+    # @param peakScratch Most bytes of intermediate data that existed at once during the run
+    def endRun(self, run, failed, skipped, peakScratch=None):
+        for n in skipped:
+            self.__add(n, self.__record(n, 'skipped'))
+        run['wall'] = self.__now() - run['start']
+        run['failed'] = len(failed)
+        run['peakScratch'] = peakScratch
+
+    ##
+    # @brief Called in the thread that processes <node>, right before it starts
+    def beginNode(self, node):
+        record = self.__record(node, None)
+        record['cpu'] = time.thread_time()
+        record['childCpu'] = 0.0
+        record['childMaxRss'] = 0
+        ChildProcesses.defaultExecutor.setUsageRecord(record)
+        record['start'] = self.__now()
+        return record
+
+    ##
+    # @brief Called in the same thread as beginNode, after the node finished with <status>
+    def endNode(self, record, node, status):
+        record['wall'] = self.__now() - record['start']
+        record['cpu'] = time.thread_time() - record['cpu']
+        ChildProcesses.defaultExecutor.setUsageRecord(None)
+        record['status'] = status
+        record['inputs'] = {p.name : Profiler.__portSize(next(iter(p.connectedTo), None)) for p in node.inputPorts.values()}
+        record['outputs'] = {p.name : Profiler.__portSize(p) for p in node.outputPorts.values()}
+        self.__add(node, record)
+
+    ##
+    # @brief Returns the last record of every node, by node
+    def latest(self):
+        with self.lock:
+            return dict(self.lastRecords)
+
+    ##
+    # @brief Writes runs and node records to <path> as JSON
+    def saveJson(self, path):
+        with self.lock:
+            data = {'runs' : list(self.runs), 'nodes' : list(self.records)}
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
+
+    ##
+    # @brief Writes the runs as a trace in the Chrome trace event format to <path>, which can
+    # be opened in chrome://tracing or https://ui.perfetto.dev
+    def saveTrace(self, path):
+        us = lambda seconds: round(seconds * 1e6)
+        pid = os.getpid()
+        with self.lock:
+            events = [{'name' : 'process', 'cat' : 'graph', 'ph' : 'X', 'pid' : pid, 'tid' : 0, \
+                    'ts' : us(r['start']), 'dur' : us(r['wall'] or 0), \
+                    'args' : {k : r[k] for k in ('scheduled', 'failed', 'peakScratch')}} for r in self.runs]
+            # thread ids have to be numbers, the names are given by metadata events
+            tids = {'graph' : 0}
+            for r in self.records:
+                tid = tids.setdefault(r['thread'], len(tids))
+                args = {k : v for k, v in r.items() if k not in ('name', 'start', 'wall', 'thread')}
+                if r['wall'] is None:
+                    events.append({'name' : r['name'], 'cat' : r['status'], 'ph' : 'i', 's' : 't', \
+                            'pid' : pid, 'tid' : tid, 'ts' : us(r['start']), 'args' : args})
+                else:
+                    events.append({'name' : r['name'], 'cat' : r['type'], 'ph' : 'X', 'pid' : pid, \
+                            'tid' : tid, 'ts' : us(r['start']), 'dur' : us(r['wall']), 'args' : args})
+        events += [{'name' : 'thread_name', 'ph' : 'M', 'pid' : pid, 'tid' : tid, 'args' : {'name' : name}} \
+                for name, tid in tids.items()]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, f)
+
+    def __now(self):
+        return time.perf_counter() - self.origin
+
+    def __record(self, node, status):
+        return {'name' : node.name, 'type' : node.processType, 'status' : status, \
+                'start' : self.__now(), 'wall' : None, 'thread' : threading.current_thread().name}
+
+    def __add(self, node, record):
+        with self.lock:
+            self.records.append(record)
+            self.lastRecords[node] = record
+
+    @staticmethod
+    def __portSize(port):
+        if port is None or port.pipe:
+            return None
+        if port.buffer is not None:
+            return memoryview(port.buffer).nbytes
+        if port.fileObj and port.fileObj.compressed:
+            return port.fileObj.dataSize
+        try:
+            return os.path.getsize(port.fileObj.name)
+        except (AttributeError, OSError):
+            return None
+
+
+##
+# @brief Short summary of <record> for display next to a node, e.g. "executed 1.23 s"
+def formatRecord(record):
+    if record['wall'] is None:
+        return record['status']
+    text = '%s %.3g s' % (record['status'], record['wall'])
+    if record.get('childMaxRss'):
+        text += ', %.3g MiB' % (record['childMaxRss'] / (1024 * 1024))
+    return text
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import struct
+import socket
+import argparse
+import threading
+import itertools
+import socketserver
+import logging
+logger = logging.getLogger(__name__)
+
+import EdgeStore
+import NodeTypes
+
+##
+# Nodes can be processed by worker daemons on other hosts (or on the same host). A daemon keeps
+# the outputs of the nodes it ran, so that a node placed on the same daemon reads them without
+# any transfer, and daemons fetch data from each other directly.
+#
+# Every message is a 4 byte length, a JSON header and the binary blobs whose sizes the header
+# lists in "blobs". Requests (header "op") and replies:
+#   ping                                   -> ok
+#   run name type params inputs outputs    -> ok outputs (id and size per output) | error [lost]
+#       inputs are {"blob" : i} for data sent along, {"id" : id} for data stored on the
+#       daemon and {"id" : id, "peer" : address} for data to fetch from another daemon
+#   fetch id                               -> ok, the data as blob
+#   release ids                            -> ok
+# Addresses are HOST:PORT or unix:PATH.
+
+DEFAULT_PORT = 7411
+READ_SIZE = 1024 * 1024
+
+##
+# @brief Raised if a daemon cannot be reached or does not answer
+class WorkerError(Exception):
+    pass
+
+
+def connect(address, timeout=None):
+    if address.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        target = address[len('unix:'):]
+    else:
+        host, _, port = address.rpartition(':')
+        sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+        target = (host.strip('[]') or 'localhost', int(port or DEFAULT_PORT))
+    sock.settimeout(timeout)
+    try:
+        sock.connect(target)
+    except OSError as e:
+        sock.close()
+        raise WorkerError('Cannot connect to %s: %s' % (address, e))
+    sock.settimeout(None)
+    return sock
+
+
+##
+# @brief Sends <header> followed by <blobs>, which are bytes or names of files to stream
+def sendMessage(sock, header, blobs=()):
+    sizes = [len(b) if isinstance(b, bytes) else os.path.getsize(b) for b in blobs]
+    data = json.dumps(dict(header, blobs=sizes)).encode('utf-8')
+    sock.sendall(struct.pack('!I', len(data)) + data)
+    for b, size in zip(blobs, sizes):
+        if isinstance(b, bytes):
+            sock.sendall(b)
+        elif size:
+            with open(b, 'rb') as f:
+                sock.sendfile(f, 0, size)
+
+
+def recvExactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), READ_SIZE))
+        if not chunk:
+            raise EOFError('Connection closed')
+        data += chunk
+    return bytes(data)
+
+
+##
+# @brief Receives a header, the blobs have to be read with recvBlob afterwards
+def recvMessage(sock):
+    size = struct.unpack('!I', recvExactly(sock, 4))[0]
+    return json.loads(recvExactly(sock, size).decode('utf-8'))
+
+
+##
+# @brief Receives a blob of <size> bytes into the file <path>
+def recvBlob(sock, size, path):
+    with open(path, 'wb') as f:
+        while size > 0:
+            chunk = sock.recv(min(size, READ_SIZE))
+            if not chunk:
+                raise EOFError('Connection closed')
+            f.write(chunk)
+            size -= len(chunk)
+
+
+##
+# @brief Sends the request <header> with <blobs> to the daemon at <address> and returns the reply.
+# Blobs of the reply are written to <blobPaths>.
+def request(address, header, blobs=(), blobPaths=()):
+    try:
+        with connect(address, 10) as sock:
+            sendMessage(sock, header, blobs)
+            reply = recvMessage(sock)
+            for size, path in zip(reply.get('blobs', []), blobPaths):
+                recvBlob(sock, size, path)
+            return reply
+    except (OSError, EOFError, ValueError, struct.error) as e:
+        raise WorkerError('Request to %s failed: %s' % (address, e))
+
+
+##
+# @brief Handles the requests of one connection inside a worker daemon
+class WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            header = recvMessage(self.request)
+            handler = getattr(self, 'handle_' + header.get('op', ''), None)
+            if not handler:
+                sendMessage(self.request, {'ok' : False, 'error' : 'Unknown request'})
+                return
+            handler(header)
+        except (OSError, EOFError, ValueError) as e:
+            logger.error('Request from %s failed: %s', self.client_address, e)
+
+    def handle_ping(self, header):
+        sendMessage(self.request, {'ok' : True})
+
+    def handle_fetch(self, header):
+        edgeFile = self.server.data.get(header['id'])
+        if not edgeFile:
+            sendMessage(self.request, {'ok' : False, 'error' : 'No data %s' % header['id']})
+            return
+        sendMessage(self.request, {'ok' : True}, [edgeFile.name])
+
+    def handle_release(self, header):
+        for dataId in header['ids']:
+            edgeFile = self.server.data.pop(dataId, None)
+            if edgeFile:
+                edgeFile.remove()
+        sendMessage(self.request, {'ok' : True})
+
+    def handle_run(self, header):
+        from Processing import ProcessingNode
+
+        store = EdgeStore.defaultStore
+        inFiles = []
+        temporary = []
+        try:
+            for size in header['blobs']:
+                edgeFile = store.create()
+                temporary.append(edgeFile)
+                recvBlob(self.request, size, edgeFile.name)
+
+            for spec in header['inputs']:
+                if 'blob' in spec:
+                    inFiles.append(temporary[spec['blob']].name)
+                elif 'peer' in spec:
+                    edgeFile = store.create()
+                    temporary.append(edgeFile)
+                    try:
+                        reply = request(spec['peer'], {'op' : 'fetch', 'id' : spec['id']}, blobPaths=[edgeFile.name])
+                    except WorkerError as e:
+                        reply = {'ok' : False, 'error' : str(e)}
+                    if not reply.get('ok'):
+                        sendMessage(self.request, {'ok' : False, 'error' : reply.get('error'), 'lost' : spec['id']})
+                        return
+                    inFiles.append(edgeFile.name)
+                elif spec['id'] in self.server.data:
+                    inFiles.append(self.server.data[spec['id']].name)
+                else:
+                    sendMessage(self.request, {'ok' : False, 'error' : 'No data %s' % spec['id'], 'lost' : spec['id']})
+                    return
+
+            try:
+                node = ProcessingNode(header['name'], header['type'])
+            except (NodeTypes.UnknownNodeType, ImportError) as e:
+                # e.g. a plugin that is not installed on this host
+                sendMessage(self.request, {'ok' : False, 'error' : str(e)})
+                return
+            node.proc.params.update(header['params'])
+            node.updatePorts()
+            outFiles = [store.create() for op in node.outputPorts]
+            try:
+                logger.info('Running "%s" (%s)', header['name'], header['type'])
+                node.proc.run(inFiles, [f.name for f in outFiles])
+            except Exception as e:
+                logger.exception(e)
+                for f in outFiles:
+                    f.remove()
+                sendMessage(self.request, {'ok' : False, 'error' : '%s: %s' % (type(e).__name__, e)})
+                return
+
+            outputs = []
+            for f in outFiles:
+                f.settle()
+                dataId = self.server.newId()
+                self.server.data[dataId] = f
+                outputs.append({'id' : dataId, 'size' : os.path.getsize(f.name)})
+            sendMessage(self.request, {'ok' : True, 'outputs' : outputs})
+        finally:
+            for f in temporary:
+                f.remove()
+
+
+##
+# @brief Worker daemon that processes nodes for RemoteExecutor
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        self.address = address
+        if address.startswith('unix:'):
+            self.address_family = socket.AF_UNIX
+            target = address[len('unix:'):]
+            if os.path.exists(target):
+                os.remove(target)
+        else:
+            host, _, port = address.rpartition(':')
+            if ':' in host:
+                self.address_family = socket.AF_INET6
+            target = (host.strip('[]') or 'localhost', int(port or DEFAULT_PORT))
+        super(WorkerServer, self).__init__(target, WorkerHandler)
+        # outputs of the nodes that ran here, by id
+        self.data = {}
+        self.prefix = os.urandom(4).hex()
+        self.ids = itertools.count()
+
+    def newId(self):
+        return '%s-%d' % (self.prefix, next(self.ids))
+
+
+##
+# @brief Runs nodes of a ProcessingGraph on worker daemons, see ProcessingGraph.remote.
+#
+# Nodes are placed on the daemon that already holds most of their input data among the daemons
+# with the fewest running nodes. Outputs stay on the daemon until a node elsewhere needs
+# them. Nodes that cannot run remotely (see Process.remote) or are connected through pipes run
+# locally, after their remote inputs were fetched. If a daemon fails, its nodes are placed on
+# another one (or run locally) and data that was only stored there is produced again.
+class RemoteExecutor:
+    def __init__(self, addresses):
+        self.workers = list(addresses)
+        self.dead = set()
+        self.running = {a : 0 for a in self.workers}
+        # where the data of output ports is, port -> (address, id, size)
+        self.locations = {}
+        # output ports whose remote data was also fetched into the local file
+        self.fetched = set()
+        self.lock = threading.Lock()
+
+    ##
+    # @brief Returns the addresses of the daemons that answer
+    def ping(self):
+        alive = []
+        for a in self.workers:
+            try:
+                request(a, {'op' : 'ping'})
+                alive.append(a)
+            except WorkerError as e:
+                logger.warning('%s', e)
+        return alive
+
+    ##
+    # @brief Processes <node> like ProcessingNode.process
+    def run(self, node, cache=None):
+        if self.__runsRemotely(node):
+            while True:
+                worker = self.__place(node)
+                if not worker:
+                    break
+                if self.__runRemote(node, worker):
+                    node.markProcessed()
+                    return 'remote'
+
+        self.__fetchInputs(node)
+        status = node.process(cache)
+        self.__forget(node)
+        return status
+
+    ##
+    # @brief Deletes the remote data of the output port <port>
+    def release(self, port):
+        with self.lock:
+            location = self.locations.pop(port, None)
+            self.fetched.discard(port)
+        if location and location[0] not in self.dead:
+            try:
+                request(location[0], {'op' : 'release', 'ids' : [location[1]]})
+            except WorkerError as e:
+                logger.warning('%s', e)
+
+    def __runsRemotely(self, node):
+        ports = list(node.inputPorts.values()) + list(node.outputPorts.values())
+        return node.proc.remote and all(p.connectedTo and not p.pipe for p in ports)
+
+    def __place(self, node):
+        with self.lock:
+            alive = [a for a in self.workers if a not in self.dead]
+            if not alive:
+                return None
+            local = {a : 0 for a in alive}
+            for ip in node.inputPorts.values():
+                location = self.locations.get(next(iter(ip.connectedTo)))
+                if location and location[0] in local:
+                    local[location[0]] += location[2]
+            least = min(self.running[a] for a in alive)
+            worker = max(alive, key=lambda a: (self.running[a] == least, local[a], -self.running[a]))
+            self.running[worker] += 1
+            return worker
+
+    ##
+    # @return False if the node has to be placed again because a daemon failed
+    def __runRemote(self, node, worker):
+        plain = []
+        try:
+            inputs = []
+            blobs = []
+            for ip in node.inputPorts.values():
+                op = next(iter(ip.connectedTo))
+                location = self.__locate(op)
+                if location is None:
+                    inputs.append({'blob' : len(blobs)})
+                    if op.buffer is not None:
+                        blobs.append(bytes(op.buffer))
+                    else:
+                        plain.append((op.fileObj, op.fileObj.acquirePlain()))
+                        blobs.append(plain[-1][1])
+                elif location[0] == worker:
+                    inputs.append({'id' : location[1]})
+                else:
+                    inputs.append({'id' : location[1], 'peer' : location[0]})
+
+            header = {'op' : 'run', 'name' : node.name, 'type' : node.processType, \
+                    'params' : node.getParams(), 'inputs' : inputs}
+            try:
+                reply = request(worker, header, blobs)
+            except WorkerError as e:
+                logger.error('%s, placing node "%s" again', e, node.name)
+                self.dead.add(worker)
+                return False
+        finally:
+            for fileObj, path in plain:
+                fileObj.releasePlain(path)
+            with self.lock:
+                self.running[worker] -= 1
+
+        if reply.get('lost'):
+            # the data was on a daemon that failed in the meantime
+            self.__lose(reply['lost'])
+            return False
+        if not reply.get('ok'):
+            raise RuntimeError('Node "%s" failed on %s: %s' % (node.name, worker, reply.get('error')))
+
+        for op, output in zip(node.outputPorts.values(), reply['outputs']):
+            self.release(op)
+            # the data exists again, only elsewhere
+            op.fileObj.restore()
+            op.buffer = None
+            with self.lock:
+                self.locations[op] = (worker, output['id'], output['size'])
+        logger.debug('Processed node "%s" on %s', node.name, worker)
+        return True
+
+    ##
+    # @brief Returns the location of the data of <port>, None if it is local. Data that was
+    # lost with a daemon is produced again.
+    def __locate(self, port):
+        with self.lock:
+            location = self.locations.get(port)
+            if location is None or location[0] not in self.dead:
+                return location
+            del self.locations[port]
+            if port in self.fetched:
+                self.fetched.discard(port)
+                return None
+
+        logger.warning('Data of [%s:%s] was lost, processing node "%s" again', port.node.name, port.name, port.node.name)
+        port.node.regenerate = True
+        self.run(port.node)
+        return self.__locate(port)
+
+    def __lose(self, dataId):
+        with self.lock:
+            for port, location in self.locations.items():
+                if location[1] == dataId:
+                    self.dead.add(location[0])
+
+    def __fetchInputs(self, node):
+        for ip in node.inputPorts.values():
+            if ip.pipe or not ip.connectedTo:
+                continue
+            op = next(iter(ip.connectedTo))
+            location = self.__locate(op)
+            if location is None or op in self.fetched:
+                continue
+            op.fileObj.restore()
+            reply = request(location[0], {'op' : 'fetch', 'id' : location[1]}, blobPaths=[op.fileObj.name])
+            if not reply.get('ok'):
+                raise RuntimeError('Fetching data of [%s:%s] failed: %s' % (op.node.name, op.name, reply.get('error')))
+            op.fileObj.settle()
+            with self.lock:
+                self.fetched.add(op)
+
+    def __forget(self, node):
+        for op in node.outputPorts.values():
+            self.release(op)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker daemon that processes nodes for indprog -r')
+    parser.add_argument("-l", "--listen", dest="address", default='localhost:%d' % DEFAULT_PORT, \
+            help="Address to listen on, HOST:PORT or unix:PATH. Anyone who can connect can run scripts " \
+            "on this host, so only listen on trusted networks.")
+    parser.add_argument("--log", dest="logLevel", default='INFO', \
+            choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], help="Set the logging level")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.getLevelName(args.logLevel),
+            format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+            datefmt="%H:%M:%S", stream=sys.stdout)
+
+    server = WorkerServer(args.address)
+    logger.info('Listening on %s', args.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        EdgeStore.defaultStore.clear()
+    sys.exit(0)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import argparse
+import logging
+logger = logging.getLogger(__name__)
+
+from SecureFileOps import secureFileCopy
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'indprog')
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+##
+# @brief Persistent, content-addressed store for the outputs of processes.
+#
+# Entries are keyed by a hash over the process type, its parameters, its external state
+# and the contents of its input files. Every entry is a directory holding one file per
+# output port. The modification time of an entry is refreshed on every hit and serves as
+# the LRU timestamp for eviction once the store grows beyond <maxSize> bytes.
+class ResultCache:
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, maxSize=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.maxSize = maxSize
+        os.makedirs(self.path, exist_ok=True)
+
+    ##
+    # @brief Computes the cache key of running <proc> on the files <inFiles>
+    #
+    # @return Hex digest identifying the result
+    def key(self, proc, inFiles):
+        h = hashlib.sha256()
+        h.update(type(proc).__name__.encode('utf-8'))
+        h.update(repr(sorted(proc.getParams().items())).encode('utf-8'))
+        h.update(repr(proc.getState()).encode('utf-8'))
+        for i in inFiles:
+            h.update(b'\0')
+            with open(i, 'rb') as f:
+                for chunk in iter(lambda: f.read(ResultCache.CHUNK_SIZE), b''):
+                    h.update(chunk)
+        return h.hexdigest()
+
+    def entryPath(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    ##
+    # @brief Copies the cached outputs for <key> into <outFiles>
+    #
+    # @return True on a cache hit, False otherwise
+    def fetch(self, key, outFiles):
+        entry = self.entryPath(key)
+        cached = [os.path.join(entry, str(i)) for i in range(len(outFiles))]
+        if not all(os.path.isfile(c) for c in cached):
+            return False
+
+        # copies instead of links: producers rewrite edge files in place
+        if not all([secureFileCopy(c, o) for c, o in zip(cached, outFiles)]):
+            logger.error('Failed to restore cache entry %s', key)
+            return False
+        os.utime(entry)
+
+        logger.debug('Cache hit for %s', key)
+        return True
+
+    ##
+    # @brief Stores copies of <outFiles> under <key> and evicts old entries if necessary
+    def store(self, key, outFiles):
+        entry = self.entryPath(key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+            return
+
+        tmpDir = None
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            tmpDir = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+            for i, o in enumerate(outFiles):
+                if not secureFileCopy(o, os.path.join(tmpDir, str(i))):
+                    raise OSError('cannot copy "%s"' % o)
+            os.rename(tmpDir, entry)
+        except OSError as e:
+            logger.error('Failed to store cache entry %s: %s', key, e)
+            if tmpDir:
+                shutil.rmtree(tmpDir, ignore_errors=True)
+            return
+
+        logger.debug('Stored cache entry %s', key)
+        self.evict()
+
+    ##
+    # @brief Lists all entries as tuples of (key, size in bytes, last access time),
+    # least recently used first
+    def entries(self):
+        result = []
+        for prefix in os.listdir(self.path):
+            prefixPath = os.path.join(self.path, prefix)
+            if prefix.startswith('.') or not os.path.isdir(prefixPath):
+                continue
+            for key in os.listdir(prefixPath):
+                entry = os.path.join(prefixPath, key)
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                    result.append((key, size, os.path.getmtime(entry)))
+                except OSError:
+                    pass
+        return sorted(result, key=lambda e: e[2])
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    ##
+    # @brief Removes least recently used entries until the store fits into <maxSize>
+    def evict(self):
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for key, size, _ in entries:
+            if total <= self.maxSize:
+                break
+            logger.debug('Evicting cache entry %s (%d bytes)', key, size)
+            shutil.rmtree(self.entryPath(key), ignore_errors=True)
+            total -= size
+
+    ##
+    # @brief Removes all entries
+    def purge(self):
+        for name in os.listdir(self.path):
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or purge the indprog result cache')
+    parser.add_argument("-d", "--dir", dest="cacheDir", default=DEFAULT_CACHE_DIR, \
+            help="Cache directory")
+    parser.add_argument("command", choices=['info', 'list', 'purge'], \
+            help="info: print summary, list: print all entries, purge: remove all entries")
+
+    args = parser.parse_args()
+    cache = ResultCache(args.cacheDir)
+    if args.command == 'info':
+        entries = cache.entries()
+        print('%s: %d entries, %d bytes' % (cache.path, len(entries), sum(e[1] for e in entries)))
+    elif args.command == 'list':
+        for key, size, atime in cache.entries():
+            print('%s %12d %s' % (key, size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(atime))))
+    elif args.command == 'purge':
+        cache.purge()
+    sys.exit(0)
@@ -0,0 +1,221 @@
+import os
+import copy
+import json
+import heapq
+import hashlib
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+##
+# ProcessingGraph.process runs the nodes that are ready in the order of their critical path:
+# the estimated time from the start of a node to the end of the run along its slowest chain of
+# successors. Nodes on long chains start first, so that they do not wait for short ones at the
+# end of the run.
+#
+# Estimates come from a CostModel, which keeps how long every node ran, how much memory its
+# scripts used and how much data it wrote, by process type and parameters. Nodes declare how
+# many CPUs (ProcessingNode.cpus) and how much memory (ProcessingNode.memory, in bytes) they
+# need, the memory measured in earlier runs is used for nodes that do not declare it. Nodes
+# only start while they fit into the budgets of the graph, a node that needs more than the
+# budget runs alone.
+
+DEFAULT_COST_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'indprog', 'costs.json')
+# seconds assumed for nodes that never ran
+DEFAULT_WALL = 1.0
+# weight of the latest run in the averages
+SMOOTHING = 0.5
+# statuses of profiler records whose timings are worth keeping
+MEASURED = ('executed', 'in memory', 'fused')
+
+##
+# @brief Returns the size of the physical memory in bytes, None if it is unknown
+def physicalMemory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+##
+# @brief Runtime, memory use and output size of nodes in earlier runs
+#
+# Every entry is a dict with "type", "runs" and the averages of "wall" (seconds), "memory"
+# (peak resident memory of the scripts in bytes) and "output" (bytes written to all output
+# ports). Entries are kept per process type and parameters, and per process type for nodes
+# whose parameters never ran.
+class CostModel:
+    ##
+    # @param path JSON file the model is loaded from and saved to, None to keep it in memory
+    def __init__(self, path=None):
+        self.path = path
+        self.stats = {}
+        self.types = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    @staticmethod
+    def key(node):
+        params = json.dumps(node.getParams(), sort_keys=True, default=str)
+        return '%s:%s' % (node.processType, hashlib.sha1(params.encode()).hexdigest()[:16])
+
+    ##
+    # @brief Adds the profiler <record> (see Profiling.Profiler) of <node>
+    #
+    # @param share Part of the wall time that belongs to the node, for nodes of fused chains
+    def update(self, node, record, share=1.0):
+        if record.get('status') not in MEASURED or record.get('wall') is None:
+            return
+        sample = {'wall' : record['wall'] * share, 'memory' : record.get('childMaxRss') or 0, \
+                'output' : sum(s for s in record.get('outputs', {}).values() if s is not None)}
+        with self.lock:
+            for table, key in ((self.stats, CostModel.key(node)), (self.types, node.processType)):
+                entry = table.setdefault(key, dict(sample, type=node.processType, runs=0))
+                if entry['runs']:
+                    for k, v in sample.items():
+                        entry[k] = (1 - SMOOTHING) * entry[k] + SMOOTHING * v
+                entry['runs'] += 1
+
+    ##
+    # @brief Returns the entry for <node>, the one of its process type if the node never ran
+    # with its parameters, None if no node of the type ran
+    def estimate(self, node):
+        with self.lock:
+            return self.stats.get(CostModel.key(node)) or self.types.get(node.processType)
+
+    ##
+    # @return True on success
+    def load(self, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.error('Failed to load costs from "%s": %s', path, e)
+            return False
+        with self.lock:
+            self.stats = data.get('nodes', {})
+            self.types = data.get('types', {})
+        return True
+
+    ##
+    # @brief Writes the model to <path> (the path it was loaded from by default)
+    #
+    # @return True on success
+    def save(self, path=None):
+        path = path or self.path
+        with self.lock:
+            data = {'nodes' : dict(self.stats), 'types' : dict(self.types)}
+        try:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(data, f, indent=1)
+        except (IOError, TypeError) as e:
+            logger.error('Failed to save costs to "%s": %s', path, e)
+            return False
+        return True
+
+
+##
+# @brief Decides which groups of nodes start next. Groups are given by index, together with
+# their estimated cost, the CPUs and memory they need and the groups they depend on.
+class Scheduler:
+    ##
+    # @param costs Estimated seconds per group
+    # @param needs Tuple of CPUs and bytes of memory per group
+    # @param succs, preds Sets of the indices of the successors / predecessors of every group
+    # @param workers Number of groups that may run at the same time
+    # @param cpuBudget CPUs that all running groups may need together, <workers> by default
+    # @param memoryBudget Bytes that all running groups may need together, None for no limit
+    def __init__(self, costs, needs, succs, preds, workers, cpuBudget=None, memoryBudget=None):
+        self.costs = costs
+        self.needs = needs
+        self.succs = succs
+        self.workers = workers
+        self.cpuBudget = cpuBudget or workers
+        self.memoryBudget = memoryBudget
+        self.priority = Scheduler.criticalPaths(costs, succs, preds)
+        self.pending = [len(p) for p in preds]
+        self.ready = [(-self.priority[gi], gi) for gi in range(len(costs)) if self.pending[gi] == 0]
+        heapq.heapify(self.ready)
+        self.running = set()
+        self.cpus = 0
+        self.memory = 0
+
+    ##
+    # @brief Returns the time from the start of every group to the end of the slowest chain
+    # of successors it starts
+    @staticmethod
+    def criticalPaths(costs, succs, preds):
+        pending = [len(s) for s in succs]
+        stack = [gi for gi in range(len(costs)) if pending[gi] == 0]
+        paths = [0.0] * len(costs)
+        while stack:
+            gi = stack.pop()
+            paths[gi] = costs[gi] + max([paths[sgi] for sgi in succs[gi]], default=0.0)
+            for pgi in preds[gi]:
+                pending[pgi] -= 1
+                if pending[pgi] == 0:
+                    stack.append(pgi)
+        return paths
+
+    ##
+    # @brief Returns the groups to start now, by priority, and accounts them as running
+    def start(self):
+        started = []
+        deferred = []
+        while self.ready and len(self.running) < self.workers:
+            item = heapq.heappop(self.ready)
+            gi = item[1]
+            cpus, memory = self.needs[gi]
+            # groups that need more than the budget run alone
+            if self.running and (self.cpus + cpus > self.cpuBudget \
+                    or (self.memoryBudget is not None and self.memory + memory > self.memoryBudget)):
+                deferred.append(item)
+                continue
+            self.running.add(gi)
+            self.cpus += cpus
+            self.memory += memory
+            started.append(gi)
+        for item in deferred:
+            heapq.heappush(self.ready, item)
+        return started
+
+    ##
+    # @brief Accounts group <gi> as finished, its successors become ready if it <succeeded>
+    def finish(self, gi, succeeded=True):
+        self.running.remove(gi)
+        cpus, memory = self.needs[gi]
+        self.cpus -= cpus
+        self.memory -= memory
+        if not succeeded:
+            return
+        for sgi in self.succs[gi]:
+            self.pending[sgi] -= 1
+            if self.pending[sgi] == 0:
+                heapq.heappush(self.ready, (-self.priority[sgi], sgi))
+
+    ##
+    # @brief Runs the schedule with the estimated costs instead of processing the groups, on a
+    # copy of the scheduler, which can still be used afterwards
+    #
+    # @return Estimated seconds until all groups finished
+    def simulate(self):
+        sim = copy.copy(self)
+        sim.pending = list(self.pending)
+        sim.ready = list(self.ready)
+        sim.running = set(self.running)
+        now = 0.0
+        events = []
+        while True:
+            for gi in sim.start():
+                heapq.heappush(events, (now + sim.costs[gi], gi))
+            if not events:
+                return now
+            now, gi = heapq.heappop(events)
+            sim.finish(gi)
+
+
+# shared by all graphs if set (indprog sets it for --costs)
+defaultCostModel = None
@@ -1,3 +1,7 @@
+import os
+import stat
+import fcntl
+import mmap
 import logging
 logger = logging.getLogger(__name__)
 
@@ -23,3 +27,91 @@ def secureFileWrite(path, mode, data):
             f.write(data)
     except IOError as e:
         logger.error('Failed to write file: %s', e)
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+# ioctl request to share the extents of one file with another (copy on write)
+FICLONE = 0x40049409
+
+##
+# @brief Copies the contents of <src> to <dst> without passing the data through user space
+# if possible. <dst> may be a named pipe.
+#
+# @param link If True, <dst> is replaced by a hard link to <src> if both are on the same
+# file system. Only use this if nobody writes into <dst> in place.
+#
+# @return True on success
+def secureFileCopy(src, dst, link=False):
+    logger.debug('Copying file "%s" to "%s"', src, dst)
+    try:
+        dstStat = os.stat(dst) if os.path.exists(dst) else None
+        dstIsFifo = dstStat is not None and stat.S_ISFIFO(dstStat.st_mode)
+        if dstStat is not None and not dstIsFifo and dstStat.st_nlink > 1:
+            # do not write through a link created by a previous call
+            os.remove(dst)
+
+        if link and not dstIsFifo:
+            try:
+                tmp = dst + '.lnk'
+                os.link(src, tmp)
+                os.replace(tmp, dst)
+                return True
+            except OSError:
+                pass
+
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            if not dstIsFifo:
+                try:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                    return True
+                except OSError:
+                    pass
+            __kernelCopy(fsrc.fileno(), fdst.fileno())
+    except (IOError, OSError) as e:
+        logger.error('Failed to copy file: %s', e)
+        return False
+    return True
+
+
+def __kernelCopy(fdIn, fdOut):
+    copyFuns = [lambda: os.sendfile(fdOut, fdIn, None, COPY_CHUNK_SIZE)]
+    if hasattr(os, 'copy_file_range'):
+        copyFuns.insert(0, lambda: os.copy_file_range(fdIn, fdOut, COPY_CHUNK_SIZE))
+
+    for copyFun in copyFuns:
+        try:
+            while copyFun() > 0:
+                pass
+            return
+        except OSError:
+            # not supported for these files, the offset of fdIn is still 0 in that case
+            if os.lseek(fdIn, 0, os.SEEK_CUR) != 0:
+                raise
+
+    while True:
+        chunk = os.read(fdIn, COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(fdOut, view):]
+
+
+##
+# @brief Maps the file <path> into memory read-only and returns a bytes-like object for it
+def mapFile(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+##
+# @brief Returns a snapshot of the file's modification state, or None if the file
+# cannot be accessed. Two equal snapshots mean the file (most likely) did not change.
+def secureFileStat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
@@ -0,0 +1,195 @@
+import json
+import base64
+import itertools
+import logging
+logger = logging.getLogger(__name__)
+
+from Wrappers import Process
+from Processing import ProcessingNode
+
+##
+# A sweep processes a graph once for every binding of parameters in a list. A binding maps
+# "node.param" to a value. Nodes that do not depend on any bound parameter are processed once
+# and shared by all variants. The nodes downstream of the bound ones are copied for every
+# variant and all copies are processed together, so variants run in parallel.
+#
+# The data arriving at the sinks of every variant is collected instead of running the sinks,
+# which would e.g. all write the same file. Sinks with bound parameters (e.g. a filename per
+# variant) are run.
+
+##
+# @brief Returns the bindings for all combinations of the values in <axes>
+#
+# @param axes Dict of "node.param" and a list of values
+def grid(axes):
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in itertools.product(*[axes[k] for k in keys])]
+
+
+##
+# @brief Converts <value> to the type of the parameter value <current>, if <value> is a string
+# (e.g. given on the command line)
+def coerce(current, value):
+    if not isinstance(value, str) or isinstance(current, str):
+        return value
+    if isinstance(current, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return type(current)(value)
+
+
+##
+# @brief Stands in for a sink in every variant and keeps the data of its inputs
+class CollectProcess(Process):
+    cacheable = False
+    inMemory = True
+    remote = False
+
+    def __init__(self, name, inputs):
+        super(CollectProcess, self).__init__(name)
+        self.portSpecs = [list(inputs), []]
+        self.data = None
+
+    def runBuffers(self, inputs):
+        self.data = [bytes(i) for i in inputs]
+        return []
+
+    def run(self, inFds, outFds):
+        data = []
+        for i in inFds:
+            with open(i, 'rb') as f:
+                data.append(f.read())
+        self.data = data
+
+
+##
+# @brief Results of a sweep, indexed like the bindings it ran. Every variant is a dict with
+# its "bindings", whether it was processed successfully ("ok") and the collected "outputs"
+# ({sink name : {port name : bytes}}).
+class SweepResults:
+    def __init__(self, shared=(), varied=()):
+        self.variants = []
+        # names of the nodes that were processed once and of the nodes copied for every variant
+        self.shared = sorted(shared)
+        self.varied = sorted(varied)
+
+    def __len__(self):
+        return len(self.variants)
+
+    def __getitem__(self, index):
+        return self.variants[index]
+
+    def __iter__(self):
+        return iter(self.variants)
+
+    ##
+    # @brief Returns the indices of the variants whose bindings contain all of <bindings>
+    def find(self, bindings):
+        return [i for i, v in enumerate(self.variants) \
+                if all(k in v['bindings'] and v['bindings'][k] == val for k, val in bindings.items())]
+
+    ##
+    # @brief Returns the data variant <index> delivered to input <port> of <sink> (the only
+    # input by default), None if there is none
+    def get(self, index, sink, port=None):
+        inputs = self.variants[index]['outputs'].get(sink, {})
+        if port is None and len(inputs) == 1:
+            port = next(iter(inputs))
+        return inputs.get(port)
+
+    ##
+    # @brief Writes the results to <path> as JSON, with the data base64 encoded
+    #
+    # @return True on success
+    def saveJson(self, path):
+        data = {'shared' : self.shared, 'varied' : self.varied, 'variants' : [{'bindings' : v['bindings'], 'ok' : v['ok'], \
+                'outputs' : {s : {p : base64.b64encode(d).decode('ascii') for p, d in ports.items()} \
+                for s, ports in v['outputs'].items()}} for v in self.variants]}
+        try:
+            with open(path, 'w') as f:
+                json.dump(data, f, indent=1)
+        except (IOError, TypeError) as e:
+            logger.error('Failed to save sweep results to "%s": %s', path, e)
+            return False
+        return True
+
+
+##
+# @brief Processes <procGraph> for every binding in <bindings>, see above. The graph itself is
+# left as it was, apart from the shared nodes, which are up to date afterwards.
+#
+# @param bindings List of dicts of "node.param" and value, e.g. from grid
+# @param workers Number of nodes that are processed in parallel
+#
+# @return SweepResults, or None if a binding names an unknown node or parameter
+def runSweep(procGraph, bindings, workers=1):
+    bindings = list(bindings)
+    targets = {}
+    for key in set(k for b in bindings for k in b):
+        name, _, param = key.rpartition('.')
+        nodes = [n for n in procGraph.nodes if n.name == name]
+        if len(nodes) != 1:
+            logger.error('Cannot sweep "%s", there are %d nodes named "%s"', key, len(nodes), name)
+            return None
+        if param not in nodes[0].proc.params:
+            logger.error('Cannot sweep "%s", node "%s" has no parameter "%s"', key, name, param)
+            return None
+        targets[key] = (nodes[0], param)
+
+    bound = set(n for n, param in targets.values())
+    # pipe peers of copied nodes have to be copied as well, pipes have a single consumer
+    dependent = set()
+    frontier = bound
+    while frontier:
+        dependent |= procGraph.getDescendants(frontier)
+        frontier = set(gn for n in dependent for gn in n.getPipeGroup()) - dependent
+    dependent = procGraph.index.sort(dependent)
+    collected = set(n for n in dependent if not n.getConnectedNodes()[1] and n not in bound)
+
+    results = SweepResults([n.name for n in procGraph.getAncestors(dependent) if n not in dependent], \
+            [n.name for n in dependent])
+    logger.info('Sweeping %d variant(s), %d node(s) shared, %d node(s) per variant', \
+            len(bindings), len(results.shared), len(dependent))
+
+    variants = []
+    try:
+        for i, binding in enumerate(bindings):
+            copies = {}
+            for n in dependent:
+                name = '%s[%d]' % (n.name, i)
+                if n in collected:
+                    copies[n] = procGraph.createNode(name, 'collect', CollectProcess(name, n.inputPorts))
+                    continue
+                c = procGraph.createNode(name, n.processType)
+                c.proc.params.update(n.getParams())
+                c.updatePorts()
+                for key, value in binding.items():
+                    if targets[key][0] is n:
+                        c.setParam(targets[key][1], coerce(n.getParam(targets[key][1]), value))
+                copies[n] = c
+            variants.append(copies)
+
+            for n in dependent:
+                for ip in n.inputPorts.values():
+                    for op in ip.connectedTo:
+                        portFrom = copies[op.node].outputPorts.get(op.name) if op.node in copies else op
+                        portTo = copies[n].inputPorts.get(ip.name)
+                        if not portFrom or not portTo:
+                            logger.error('Cannot connect [%s:%s] to [%s:%s] in variant %d, no such port', \
+                                    op.node.name, op.name, n.name, ip.name, i)
+                            continue
+                        ProcessingNode.connectPorts(portFrom, portTo, ip.pipe)
+
+        sinks = [c for copies in variants for n, c in copies.items() if not n.getConnectedNodes()[1]]
+        if sinks:
+            procGraph.process(sinks, workers)
+
+        for binding, copies in zip(bindings, variants):
+            outputs = {n.name : dict(zip(c.proc.getPortSpecs()[0], c.proc.data)) \
+                    for n, c in copies.items() if n in collected and c.proc.data is not None}
+            results.variants.append({'bindings' : binding, 'ok' : not any(c.dirty for c in copies.values()), \
+                    'outputs' : outputs})
+    finally:
+        procGraph.removeNodes([c for copies in variants for c in copies.values()])
+
+    logger.info('Finished sweep (%d of %d variant(s) failed)', sum(not v['ok'] for v in results), len(results))
+    return results
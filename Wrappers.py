@@ -1,22 +1,116 @@
 
-#import matlab.engine
-
 import subprocess
+import os
 import struct
 import codecs
+import tempfile
+import contextlib
+import importlib.util
 from abc import ABC, abstractmethod
 import logging
 logger = logging.getLogger(__name__)
 
 from SecureFileOps import *
+import ChildProcesses
+import Coprocesses
+
+##
+# @brief Returns <enc> if python knows the encoding, otherwise logs an error and falls back to ascii
+def lookupEncoding(enc):
+    try:
+        codecs.lookup(enc)
+    except LookupError:
+        logger.error('Encoding %s not available, falling back to %s' % (enc, 'ascii'))
+        return 'ascii'
+    return enc
+
+
+##
+# @brief Reads the file <path> in chunks of at most <chunkSize> bytes
+def readChunks(path, chunkSize=COPY_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            yield chunk
+
+
+##
+# @brief Regroups the byte chunks of every iterable in <streams> so that they advance together:
+# yields tuples with one chunk per stream, all of the same length and a multiple of <recordSize>
+#
+# @raise ValueError if the streams are not equally long or end within a record
+def alignChunks(streams, recordSize=1):
+    iterators = [iter(s) for s in streams]
+    buffers = [b''] * len(iterators)
+    ended = [False] * len(iterators)
+    while True:
+        # at least a record from every stream, as much as the fullest buffer from the others
+        target = max([recordSize] + [len(b) for b in buffers])
+        for i, it in enumerate(iterators):
+            while not ended[i] and len(buffers[i]) < target:
+                chunk = next(it, None)
+                if chunk is None:
+                    ended[i] = True
+                else:
+                    buffers[i] += chunk
+        size = min(len(b) for b in buffers) // recordSize * recordSize
+        if size == 0:
+            break
+        yield tuple(b[:size] for b in buffers)
+        buffers = [b[size:] for b in buffers]
+    if any(buffers):
+        raise ValueError('Inputs differ in length or end within a record of %d bytes' % recordSize)
+
+
+##
+# @brief Writes the (output index, chunk) pairs of <chunks> to the files <outFds>, see Process.runStream
+def writeStream(chunks, outFds):
+    with contextlib.ExitStack() as stack:
+        files = [stack.enter_context(open(o, 'wb')) for o in outFds]
+        for index, chunk in chunks:
+            files[index].write(chunk)
+
+
+##
+# @brief Runs <proc> (which only implements Process.run) on the chunks of <inputs> by writing
+# them to temporary files, and yields the chunks of its output files like Process.runStream
+def runThroughFiles(proc, inputs):
+    with tempfile.TemporaryDirectory(prefix='indprog-') as directory:
+        inFds = []
+        for i, chunks in enumerate(inputs):
+            inFds.append(os.path.join(directory, 'in%d' % i))
+            with open(inFds[-1], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        outFds = [os.path.join(directory, 'out%d' % i) for i in range(len(proc.getPortSpecs()[1]))]
+        for o in outFds:
+            open(o, 'wb').close()
+
+        proc.run(inFds, outFds)
+        for i, o in enumerate(outFds):
+            for chunk in readChunks(o):
+                yield i, chunk
+
 
 ##
 # @brief Wrapper for the process that a node represents. Can wrap a variety of actions.
 class Process(ABC):
+    # whether the outputs of this process may be restored from a ResultCache
+    cacheable = True
+    # whether the process implements runBuffers, which exchanges data in memory instead of files
+    inMemory = False
+    # whether the process implements runStream itself (see StreamProcess)
+    streaming = False
+    # names of the parameters that change the port specs
+    portParams = ()
+    # whether the process may run on a worker daemon (see RemoteWorkers), i.e. it only depends
+    # on its inputs and parameters and not on files or the terminal of this host
+    remote = True
+
     def __init__(self, name):
         self.name = name
         self.params = {}
         self.portSpecs = [[],[]]
+        self.lastState = None
 
     ##
     # @brief Returns the port specifications of this process so that the containing node
@@ -34,35 +128,99 @@ class Process(ABC):
     def getParams(self):
         return self.params
 
+    ##
+    # @brief Returns a snapshot of the external resources (files, scripts) the process
+    # depends on. Subclasses that read from outside the graph should override this.
+    #
+    # @return Hashable snapshot of the external state
+    def getState(self):
+        return ()
+
+    ##
+    # @brief Returns the expected size in bytes of every output for the input files <inFds>,
+    # None if unknown. Outputs that are expected to be large are written to disk directly.
+    def getOutputSizes(self, inFds):
+        return None
+
+    ##
+    # @brief Records the external state after a successful run
+    def commitState(self):
+        self.lastState = self.getState()
+
+    ##
+    # @brief A process is up to date if it has been run and its external state did not change
+    # since. Changes to parameters or inputs are tracked by the containing node.
     def upToDate(self):
-        return False
+        return self.lastState is not None and self.lastState == self.getState()
 
     @abstractmethod
     def run(self, inFds, outFds):
         pass
 
+    ##
+    # @brief Streaming interface of the process
+    #
+    # @param inputs One iterable of byte chunks per input port
+    #
+    # @return Iterable of (output index, chunk) pairs. Processes that only implement run are
+    # adapted by passing the data through temporary files.
+    def runStream(self, inputs):
+        return runThroughFiles(self, inputs)
+
+
+##
+# @brief Base for processes that handle their data in chunks, so that their memory use is bounded
+# by the chunk size instead of the size of the data. Subclasses implement runStream, run feeds it
+# from the input files and writes what it yields to the output files. Input chunks are only read
+# when the process asks for them and the next output chunk is only produced after the previous one
+# was written, so a consumer that reads slowly (e.g. through a pipe) slows the producer down.
+class StreamProcess(Process):
+    streaming = True
+    chunkSize = COPY_CHUNK_SIZE
+
+    @abstractmethod
+    def runStream(self, inputs):
+        pass
+
+    def run(self, inFds, outFds):
+        writeStream(self.runStream([readChunks(i, self.chunkSize) for i in inFds]), outFds)
+
+
+class FileReadProcess(StreamProcess):
+    # restoring from the cache is not cheaper than reading the file again
+    cacheable = False
+    remote = False
 
-class FileReadProcess(Process):
     def __init__(self, name):
         super(FileReadProcess, self).__init__(name)
         self.params['filename'] = './file.txt'
+        # hand the file itself to consumers (via a hard link) instead of a copy where possible
+        self.params['zerocopy'] = True
 
     def getPortSpecs(self):
         return [[],['out']]
 
+    def getState(self):
+        return (self.params['filename'], secureFileStat(self.params['filename']))
+
+    def getOutputSizes(self, inFds):
+        fileStat = secureFileStat(self.params['filename'])
+        return [fileStat[1]] if fileStat else None
+
     def run(self, inFds, outFds):
-        # TODO: make this more efficient than copying one file into another
         logger.debug('Reading file "%s"', self.params['filename'])
+        # all consumers of the output port share the same file, so one copy (or link) serves them all
+        secureFileCopy(self.params['filename'], outFds[0], link=self.params['zerocopy'])
 
-        data = secureFileRead(self.params['filename'], 'rb')
-        if not data:
-            return
+    def runStream(self, inputs):
+        logger.debug('Reading file "%s"', self.params['filename'])
+        for chunk in readChunks(self.params['filename'], self.chunkSize):
+            yield 0, chunk
 
-        with open(outFds[0], 'wb') as oop:
-            oop.write(data)
 
+class FileWriteProcess(StreamProcess):
+    remote = False
 
-class FileWriteProcess(Process):
     def __init__(self, name):
         super(FileWriteProcess, self).__init__(name)
         self.params['filename'] = './file.txt'
@@ -72,61 +230,67 @@ class FileWriteProcess(Process):
     def getPortSpecs(self):
         return [['in'],[]]
 
-    def run(self, inFds, outFds):
-        # TODO: make this more efficient than copying one file into another
+    def getState(self):
+        return (self.params['filename'], secureFileStat(self.params['filename']))
+
+    def runStream(self, inputs):
         logger.debug('Writing file "%s"', self.params['filename'])
         mode = 'a' if self.params['append'] else 'w'
 
         enc = self.params['encoding']
-
-        binary = False
         if enc == '' or enc == 'None':
-            mode += 'b'
-            binary = True
-        else:
-            try:
-                codecs.lookup(enc)
-            except LookupError:
-                enc = 'ascii'
-                logger.error('Encoding %s not available, falling back to %s' % (self.params['encoding'], enc))
-
-        with open(self.params['filename'], mode) as sinkFile, open(inFds[0], 'rb') as iop:
-            for line in iop:
-                if binary:
-                    sinkFile.write(line)
-                else:
-                    sinkFile.write(line.decode(enc))
+            with open(self.params['filename'], mode + 'b') as sinkFile:
+                for chunk in inputs[0]:
+                    sinkFile.write(chunk)
+            return
+
+        # an incremental decoder keeps multi-byte characters that are split between chunks intact
+        decoder = codecs.getincrementaldecoder(lookupEncoding(enc))()
+        with open(self.params['filename'], mode) as sinkFile:
+            for chunk in inputs[0]:
+                sinkFile.write(decoder.decode(chunk))
+            sinkFile.write(decoder.decode(b'', final=True))
+        yield from ()
 
 
-class PrinterProcess(Process):
+class PrinterProcess(StreamProcess):
+    remote = False
+
     def __init__(self, name):
         super(PrinterProcess, self).__init__(name)
         self.params['encoding'] = 'ascii'
+        # maximum number of bytes to print per input, 0 prints everything
+        self.params['preview'] = 0
 
     def getPortSpecs(self):
         return [['in'],[]]
 
-    def run(self, inFds, outFds):
-        for  i in inFds:
-            with open(i, 'rb') as oip:
-                logger.info('PRINTER: Read from input file:')
-                while True:
-                    line = oip.read()
-                    if not line:
-                        break
-
-                    enc = self.params['encoding']
-                    try:
-                        codecs.lookup(enc)
-                    except LookupError:
-                        enc = 'ascii'
-                        logger.error('Encoding %s not available, falling back to %s' % (self.params['encoding'], enc))
-
-                    string = line.decode(enc)
-                    logger.info('PRINTER: \t%s (%s)', string, line)
-
-
-class ConstantProcess(Process):
+    def runStream(self, inputs):
+        enc = lookupEncoding(self.params['encoding'])
+        limit = self.params['preview']
+        for  i in inputs:
+            logger.info('PRINTER: Read from input file:')
+            decoder = codecs.getincrementaldecoder(enc)(errors='replace')
+            remaining = limit
+            for chunk in i:
+                if limit > 0:
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+
+                string = decoder.decode(chunk, final=(limit > 0 and remaining == 0))
+                logger.info('PRINTER: \t%s (%s)', string, chunk)
+                if limit > 0 and remaining == 0:
+                    logger.info('PRINTER: Preview limit of %d bytes reached', limit)
+                    break
+            else:
+                # the data may end within a multi-byte character
+                string = decoder.decode(b'', final=True)
+                if string:
+                    logger.info('PRINTER: \t%s', string)
+        yield from ()
+
+
+class ConstantProcess(StreamProcess):
     def __init__(self, name):
         super(ConstantProcess, self).__init__(name)
         self.params['value'] = "text"
@@ -135,60 +299,40 @@ class ConstantProcess(Process):
     def getPortSpecs(self):
         return [[],['out']]
 
-    def run(self, inFds, outFds):
-        for o in outFds:
-            oop = open(o, 'wb')
-            if oop:
-
-                enc = self.params['encoding']
-                try:
-                    codecs.lookup(enc)
-                except LookupError:
-                    enc = 'ascii'
-                    logger.error('Encoding %s not available, falling back to %s' % (self.params['encoding'], enc))
-
-                data = str(self.params['value']).encode(enc)
+    def runStream(self, inputs):
+        enc = lookupEncoding(self.params['encoding'])
+        data = str(self.params['value']).encode(enc)
+        logger.debug('Write to output file: %s (%s)', self.params['value'], str(data))
+        for o in range(len(self.getPortSpecs()[1])):
+            yield o, data
 
-                logger.debug('Write to output file: %s (%s)', self.params['value'], str(data))
-                oop.write(data)
-                oop.flush()
-                oop.close()
 
-
-class AdditionProcess(Process):
+##
+# @brief Adds its inputs element-wise, both are streams of 32 bit floats
+class AdditionProcess(StreamProcess):
     def __init__(self, name):
         super(AdditionProcess, self).__init__(name)
 
     def getPortSpecs(self):
         return [['summand1', 'summand2'],['sum']]
 
-    def run(self, inFds, outFds):
-        valSum = 0
-        print('Adding: ')
-        for i in inFds:
-            iop = open(i, 'rb')
-            if iop:
-                data = iop.read()
-                val = struct.unpack('f', data)[0]
-                print(' + ' + str(val))
-                valSum += val
-                iop.close()
-
-        print(' = ' + str(valSum))
-
-        oop = open(outFds[0], 'wb')
-        if oop:
-            data = struct.pack('f',valSum)
-            oop.write(data)
-            oop.flush()
-            oop.close()
+    def runStream(self, inputs):
+        for chunks in alignChunks(inputs, 4):
+            sums = [sum(val for val, in vals) for vals in zip(*[struct.iter_unpack('f', c) for c in chunks])]
+            logger.debug('Added %d value(s) in process "%s"', len(sums), self.name)
+            yield 0, struct.pack('%df' % len(sums), *sums)
 
 
 class MatlabProcess(Process):
+    cacheable = False
+    remote = False
+
     def __init__(self, name):
         super(MatlabProcess, self).__init__(name)
         logger.error('The matlab process is not yet implemented. Do not use it')
 
+        # import the engine here, it is slow to load and only needed by matlab nodes
+#        import matlab.engine
 #        self.eng = matlab.engine.start_matlab()
 #        self.scriptFun = getattr(self.eng, "matlabTemplate")
 #
@@ -200,22 +344,175 @@ class MatlabProcess(Process):
     def run(self, inFds, outFds):
         logger.error('The matlab process is not yet implemented. Do not use it')
         #self.scriptFun(inFds, outFds, list(self.params.values()), nargout=0)
+        # the engine takes seconds to start, so it should be kept alive between runs with a
+        # wrapper that speaks the worker protocol of Coprocesses:
+        #Coprocesses.getPool(matlabWorkerCommand).run(inFds, outFds, self.params, self.name)
 
 class BashProcess(Process):
+    portParams = ('filename',)
+
+    # port specs by script path and modification state, scripts are only started when they changed
+    portSpecCache = {}
+
     def __init__(self, name):
         super(BashProcess, self).__init__(name)
         self.params['filename'] = './bashTemplate.bash'
+        # seconds after which the script is killed, 0 to wait forever
+        self.params['timeout'] = 0
+        # keep the script running in worker mode between runs, see Coprocesses
+        self.params['worker'] = False
+
+    def getPortSpecs(self):
+        filename = self.params['filename']
+        key = (os.path.abspath(filename), secureFileStat(filename))
+        if key not in BashProcess.portSpecCache:
+            BashProcess.portSpecCache[key] = self.__readPortSpecs(filename)
+        return [list(ports) for ports in BashProcess.portSpecCache[key]]
+
+    def __readPortSpecs(self, filename):
         try:
-            bashProc = subprocess.Popen(self.params['filename'], shell=True, stdout=subprocess.PIPE)
-            portSpecStr = bashProc.stdout.readline().decode('ascii').rstrip('\n').split(' ')
-            self.portSpecs = [portSpecStr[0].split(','),portSpecStr[1].split(',')]
+            bashProc = subprocess.run(filename, shell=True, stdout=subprocess.PIPE, timeout=10)
+            portSpecStr = bashProc.stdout.decode('ascii').split('\n')[0].split(' ')
+            return [portSpecStr[0].split(','),portSpecStr[1].split(',')]
         except:
             logger.error('Failed to get port specs from bash script. Make sure that your script echoes \
                     a list of ports in the form in1,...,inN out1,...,outM when executed without arguments')
-            self.portSpecs = [[],[]]
+            return [[],[]]
 
+    def getState(self):
+        return (self.params['filename'], secureFileStat(self.params['filename']))
 
     def run(self, inFds, outFds):
+        if self.params['worker']:
+            path = os.path.abspath(self.params['filename'])
+            pool = Coprocesses.getPool(path, secureFileStat(path))
+            pool.run(inFds, outFds, {}, self.name, self.params['timeout'] or None)
+            return
         cmd = self.params['filename'] + ' ' + ','.join(inFds) + ' ' + ','.join(outFds)
-        bashProc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
-        print(bashProc.stdout.read())
+        ChildProcesses.defaultExecutor.run(cmd, self.name, self.params['timeout'] or None)
+
+##
+# @brief Returns the function <function> of <module>, which is either the name of an importable
+# module or the path to a python file. Files are loaded again when they change.
+def loadPythonFunction(module, function):
+    if module.endswith('.py'):
+        path = os.path.abspath(module)
+        key = (path, secureFileStat(path))
+        if key not in loadedPythonFiles:
+            spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3], path)
+            mod = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(mod)
+            loadedPythonFiles[key] = mod
+        mod = loadedPythonFiles[key]
+    else:
+        mod = importlib.import_module(module)
+    return getattr(mod, function)
+
+loadedPythonFiles = {}
+
+
+##
+# @brief Entry point of worker processes for PythonProcess: runs the function on the inputs in the
+# shared memory blocks <inputs> (pairs of name and size) and returns the outputs the same way
+def runPythonWorker(module, function, inputs, params):
+    from multiprocessing import shared_memory
+
+    inBlocks = [shared_memory.SharedMemory(name) for name, size in inputs]
+    try:
+        outputs = loadPythonFunction(module, function)([b.buf[:size] for b, (name, size) in zip(inBlocks, inputs)], params)
+        result = []
+        for data in outputs:
+            data = memoryview(data).cast('B')
+            block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+            block.buf[:data.nbytes] = data
+            result.append((block.name, data.nbytes))
+            block.close()
+        return result
+    finally:
+        outputs = data = None
+        for b in inBlocks:
+            b.close()
+
+
+##
+# @brief Runs a python function inside indprog, or in a pool of worker processes.
+#
+# The function is called as function(inputs, params) with one bytes-like object per input port and
+# the parameter dictionary, and returns one bytes-like object per output port. Data between python
+# nodes stays in memory; it is only written to the connection files for other consumers.
+class PythonProcess(Process):
+    cacheable = False
+    inMemory = True
+    portParams = ('inputs', 'outputs')
+
+    workerPool = None
+
+    def __init__(self, name):
+        super(PythonProcess, self).__init__(name)
+        # importable module name or path to a python file
+        self.params['module'] = ''
+        self.params['function'] = 'process'
+        # comma separated port names
+        self.params['inputs'] = 'in'
+        self.params['outputs'] = 'out'
+        # run in a separate process, exchanging data through shared memory
+        self.params['worker'] = False
+
+    def getPortSpecs(self):
+        return [[p.strip() for p in str(self.params[key]).split(',') if p.strip()] for key in ('inputs', 'outputs')]
+
+    def getState(self):
+        module = self.params['module']
+        return (module, secureFileStat(module) if module.endswith('.py') else None)
+
+    def runBuffers(self, inputs):
+        if self.params['worker']:
+            outputs = self.__runInWorker(inputs)
+        else:
+            outputs = loadPythonFunction(self.params['module'], self.params['function'])(inputs, self.params)
+
+        outputs = list(outputs)
+        if len(outputs) != len(self.getPortSpecs()[1]):
+            raise ValueError('Python function returned %d outputs, expected %d' % (len(outputs), len(self.getPortSpecs()[1])))
+        return outputs
+
+    def run(self, inFds, outFds):
+        inputs = []
+        for i in inFds:
+            with open(i, 'rb') as f:
+                inputs.append(f.read())
+        for o, data in zip(outFds, self.runBuffers(inputs)):
+            with open(o, 'wb') as f:
+                f.write(data)
+
+    def __runInWorker(self, inputs):
+        from multiprocessing import shared_memory, resource_tracker, get_context
+        import concurrent.futures
+
+        if not PythonProcess.workerPool:
+            # workers must share the resource tracker, so that blocks they create are not
+            # destroyed when they exit
+            resource_tracker.ensure_running()
+            PythonProcess.workerPool = concurrent.futures.ProcessPoolExecutor(mp_context=get_context('fork'))
+
+        inBlocks = []
+        outputs = []
+        try:
+            for data in inputs:
+                data = memoryview(data).cast('B')
+                block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+                block.buf[:data.nbytes] = data
+                inBlocks.append((block, data.nbytes))
+
+            result = PythonProcess.workerPool.submit(runPythonWorker, self.params['module'], self.params['function'], \
+                    [(b.name, size) for b, size in inBlocks], dict(self.params)).result()
+            for name, size in result:
+                block = shared_memory.SharedMemory(name)
+                outputs.append(bytes(block.buf[:size]))
+                block.close()
+                block.unlink()
+        finally:
+            for b, size in inBlocks:
+                b.close()
+                b.unlink()
+        return outputs
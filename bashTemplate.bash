@@ -1,11 +1,48 @@
 #!/bin/bash
 
+# the actual processing routine, called with the arrays inFiles and outFiles set
+process() {
+  # print files
+  #echo "Input Files:"
+  #for i in ${inFiles[@]}; do
+  #  echo $i
+  #done
+  #
+  #echo "Output Files:"
+  #for i in ${outFiles[@]}; do
+  #  echo $i
+  #done
+
+  # a sample functionality
+  cat ${inFiles[0]} | tr 'e' '$' > ${outFiles[0]}
+}
+
 # when called without arguments (i.e. input / output files),
 # return the port specs
 if [ "$#" -eq 0 ]; then
   echo "in1 out1"
   exit 1
 
+# In worker mode, keep running and process one job per line of stdin:
+# "RUN<tab>in1,...,inN<tab>out1,...,outM" is answered with "OK" or "ERROR<tab>message",
+# "PING" with "PONG". Anything else written to stdout would confuse indprog, so the
+# processing routine writes to stderr instead.
+elif [ "$#" -eq 1 ] && [ "$1" == "--worker" ]; then
+  while IFS=$'\t' read -r request ins outs params; do
+    case "$request" in
+      PING) echo "PONG" ;;
+      RUN)
+        IFS=',' read -r -a inFiles <<< "$ins"
+        IFS=',' read -r -a outFiles <<< "$outs"
+        if ( process ) 1>&2; then
+          echo "OK"
+        else
+          echo -e "ERROR\tprocessing failed"
+        fi ;;
+      *) echo -e "ERROR\tunknown request $request" ;;
+    esac
+  done
+
 # When provided with the list of input and output files, run
 # the actual processing routine
 elif [ "$#" -eq 2 ]; then
@@ -14,23 +51,12 @@ elif [ "$#" -eq 2 ]; then
 IFS=',' read -r -a inFiles <<< "$1"
 IFS=',' read -r -a outFiles <<< "$2"
 
-# print files
-#echo "Input Files:"
-#for i in ${inFiles[@]}; do
-#  echo $i
-#done
-#
-#echo "Output Files:"
-#for i in ${outFiles[@]}; do
-#  echo $i
-#done
-
-# a sample functionality
-cat ${inFiles[0]} | tr 'e' '$' > ${outFiles[0]}
+process
 
 # otherwise, print the usage information
 else
   echo "Usage:"
   echo -e "\tscipt.sh []: returns port specs as a list of port names"
   echo -e "\tscipt.sh infile1,...,inFileN outFile1,...,outFileM : run script with the input/output file names as arguments"
+  echo -e "\tscipt.sh --worker : process jobs read from stdin until it is closed"
 fi
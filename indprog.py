@@ -1,133 +1,124 @@
 #!/usr/bin/env python3
 
-import gi
-gi.require_version('Gtk', '3.0')
-gi.require_version('GFlow', '0.2')
-gi.require_version('GtkFlow', '0.2')
-from gi.repository import GLib
-from gi.repository import Gtk
-from gi.repository import GFlow
-from gi.repository import GtkFlow
-
 import sys
+import atexit
 import argparse
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-from Processing import ProcessingGraph, ProcessingNode
-from Gui import FlowGui
-
-class Indprog(object):
-    def __init__(self):
-        self.w = Gtk.Window.new(Gtk.WindowType.TOPLEVEL)
-        self.w.connect("destroy", self.__quit)
-        self.vbox = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
-        self.w.add(self.vbox)
-
-        self.createHud()
-
-        self.fgui = FlowGui(self.w, self.vbox)
-        self.procGraph = ProcessingGraph()
-
-    def __quit(self, widget=None, data=None):
-        Gtk.main_quit()
-        sys.exit(0)
-
-    def __createNode(self, nodeType, widget=None, data=None):
-        node = self.procGraph.createNode('node_' + nodeType, nodeType)
-        self.fgui.createFlowNode(node)
-
-    def __loadGraph(self, widget=None, data=None):
-        dialog = Gtk.FileChooserDialog('Load Graph From File', self.w,
-                Gtk.FileChooserAction.OPEN,
-                (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
-                 Gtk.STOCK_OPEN, Gtk.ResponseType.OK))
-        response = dialog.run()
-        if response == Gtk.ResponseType.OK:
-            print("Open clicked")
-            print("File selected: " + dialog.get_filename())
-        elif response == Gtk.ResponseType.CANCEL \
-            or response == Gtk.ResponseType.CLOSE \
-            or response == Gtk.ResponseType.DELETE_EVENT:
-            print("Cancel clicked")
-
-        dialog.destroy()
-
-    def __saveGraph(self, widget=None, data=None):
-        print('blasave')
-
-    def __executeGraph(self, widget=None, data=None):
-        self.procGraph.process()
-
-    def createHud(self):
-        self.tools = Gtk.ToolPalette()
-
-        # general functions
-        generalTools = Gtk.ToolItemGroup.new('General')
-        self.tools.add(generalTools)
-
-        loadItem = Gtk.ToolButton.new(None, 'Load')
-        loadItem.connect("clicked", self.__loadGraph)
-        generalTools.insert(loadItem, -1)
-
-        saveItem = Gtk.ToolButton.new(None, 'Save')
-        saveItem.connect("clicked", self.__saveGraph)
-        generalTools.insert(saveItem, -1)
+# exit codes of the batch mode
+EXIT_OK = 0
+EXIT_PROCESSING_FAILED = 1
+EXIT_USAGE = 2
+
+##
+# @brief Loads the graph in <graphFile> and processes it without a GUI
+#
+# @param sinkNames Names of the nodes to bring up to date, all sinks if empty
+# @param sweep Dict of "node.param" and list of values, if given the graph is processed for all
+# combinations of them (see Sweeps) and the results are written to <sweepResults>
+# @param memoryBudget Bytes of memory the running nodes may need together, None for the default
+# @param estimate If True, only print how long processing would take
+# @param release Delete intermediate data once all consumers are up to date
+#
+# @return Exit code for the process
+def runBatch(graphFile, sinkNames, workers, cache, pipes, profiler=None, remote=None, sweep=None, sweepResults=None, \
+        memoryBudget=None, estimate=False, release=False):
+    # the toolkit is not needed (nor imported) in batch mode
+    from Processing import ProcessingGraph
+
+    procGraph = ProcessingGraph(cache)
+    procGraph.profiler = profiler
+    procGraph.remote = remote
+    procGraph.releaseIntermediates = release
+    if memoryBudget is not None:
+        procGraph.memoryBudget = memoryBudget
+    if not procGraph.loadFromFile(graphFile):
+        logger.error('Failed to load graph from "%s"', graphFile)
+        return EXIT_USAGE
+
+    startNodes = []
+    for name in sinkNames:
+        nodes = [n for n in procGraph.nodes if n.name == name]
+        if not nodes:
+            logger.error('There is no node named "%s" in "%s"', name, graphFile)
+            return EXIT_USAGE
+        startNodes.extend(nodes)
+
+    if pipes:
+        procGraph.setEdgeMode(True)
+    if estimate:
+        estimate = procGraph.estimateRuntime(startNodes, workers)
+        if estimate is None:
+            return EXIT_PROCESSING_FAILED
+        total, criticalPath = estimate
+        print('Estimated runtime: %.1f s (critical path %.1f s)' % (total, criticalPath))
+        return EXIT_OK
+    if sweep:
+        import Sweeps
+        results = Sweeps.runSweep(procGraph, Sweeps.grid(sweep), workers)
+        if results is None:
+            return EXIT_USAGE
+        if not results.saveJson(sweepResults) or not all(v['ok'] for v in results):
+            return EXIT_PROCESSING_FAILED
+        return EXIT_OK
+    if not procGraph.process(startNodes, workers):
+        return EXIT_PROCESSING_FAILED
+    return EXIT_OK
 
-        runItem = Gtk.ToolButton.new(None, 'Run')
-        runItem.connect("clicked", self.__executeGraph)
-        generalTools.insert(runItem, -1)
-
-        # node functions
-        newNodeTools = Gtk.ToolItemGroup.new('New Node')
-        self.tools.add(newNodeTools)
-
-        constNodeItem = Gtk.ToolButton.new(None, 'FileRead')
-        constNodeItem.connect("clicked", lambda w = None, d = None: self.__createNode('fileread', w, d))
-        newNodeTools.insert(constNodeItem, -1)
-
-        constNodeItem = Gtk.ToolButton.new(None, 'FileWrite')
-        constNodeItem.connect("clicked", lambda w = None, d = None: self.__createNode('filewrite', w, d))
-        newNodeTools.insert(constNodeItem, -1)
-
-        constNodeItem = Gtk.ToolButton.new(None, 'Constant')
-        constNodeItem.connect("clicked", lambda w = None, d = None: self.__createNode('const', w, d))
-        newNodeTools.insert(constNodeItem, -1)
-
-        printNodeItem = Gtk.ToolButton.new(None, 'Printer')
-        printNodeItem.connect("clicked", lambda w = None, d = None: self.__createNode('print', w, d))
-        newNodeTools.insert(printNodeItem, -1)
-
-        adderNodeItem = Gtk.ToolButton.new(None, 'Adder')
-        adderNodeItem.connect("clicked", lambda w = None, d = None: self.__createNode('add', w, d))
-        newNodeTools.insert(adderNodeItem, -1)
-
-        adderNodeItem = Gtk.ToolButton.new(None, 'Bash')
-        adderNodeItem.connect("clicked", lambda w = None, d = None: self.__createNode('bash', w, d))
-        newNodeTools.insert(adderNodeItem, -1)
-
-        adderNodeItem = Gtk.ToolButton.new(None, 'MatLab')
-        adderNodeItem.connect("clicked", lambda w = None, d = None: self.__createNode('matlab', w, d))
-        newNodeTools.insert(adderNodeItem, -1)
-
-        self.vbox.pack_start(self.tools, False, False, 0)
-
-        vsep = Gtk.VSeparator()
-        self.vbox.pack_start(vsep, False, False, 0)
-
-        logger.debug('HUD populated')
-
-
-    def run(self):
-        self.w.show_all()
-        Gtk.main()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("-l", "--log", dest="logLevel", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], \
             help="Set the logging level")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, \
+            help="Number of nodes that are processed in parallel")
+    parser.add_argument("-c", "--cache", dest="cacheDir", nargs='?', const='', \
+            help="Restore results of previous runs from a persistent cache in CACHEDIR")
+    parser.add_argument("--cache-size", dest="cacheSize", type=int, default=1024, \
+            help="Maximum size of the result cache in MiB")
+    parser.add_argument("--max-children", dest="maxChildren", type=int, \
+            help="Maximum number of scripts that run at the same time (default: number of CPUs or JOBS, whichever is larger)")
+    parser.add_argument("--scratch", dest="scratchDir", \
+            help="Directory for data passed between nodes that does not fit into memory (default: system temp dir)")
+    parser.add_argument("--edge-memory", dest="edgeMemory", type=int, default=256, \
+            help="Memory in MiB for data passed between nodes, 0 to keep all data on disk")
+    parser.add_argument("--release", dest="release", action='store_true', \
+            help="Delete data passed between nodes once all nodes that read it are up to date (saves space, but nodes " \
+            "upstream of an edited node run again)")
+    parser.add_argument("--compress", dest="codec", choices=['none', 'auto', 'zlib', 'lzma', 'zstd'], \
+            help="Compress data passed between nodes once it is on disk (auto: fastest available codec)")
+    parser.add_argument("--memory-budget", dest="memoryBudget", type=int, \
+            help="Memory in MiB that the nodes running at the same time may need together (default: physical memory)")
+    parser.add_argument("--costs", dest="costFile", nargs='?', const='', \
+            help="Keep the runtimes of nodes in COSTFILE (default: ~/.cache/indprog/costs.json) to start slow nodes first " \
+            "in later runs")
+    parser.add_argument("-p", "--pipes", dest="pipes", action='store_true', \
+            help="Stream data through pipes between nodes instead of storing it in files")
+    parser.add_argument("-r", "--remote", dest="workers", action='append', default=[], \
+            help="Process nodes on the worker daemon (RemoteWorkers.py) at WORKERS, HOST:PORT or unix:PATH " \
+            "(may be repeated)")
+    parser.add_argument("--profile", dest="profileFile", \
+            help="Record timings and data sizes of every node and write them to PROFILEFILE as JSON on exit")
+    parser.add_argument("--trace", dest="traceFile", \
+            help="Record timings of every node and write them to TRACEFILE on exit, in the trace format of " \
+            "chrome://tracing and Perfetto")
+    parser.add_argument("--plugins", dest="pluginDirs", action='append', default=[], \
+            help="Load node types from the python files in PLUGINDIRS (may be repeated), see NodeTypes.py")
+    parser.add_argument("-b", "--batch", dest="graphFile", \
+            help="Process the graph in GRAPHFILE without starting the GUI and exit with status 0 on success, " \
+            "1 if processing failed and 2 if the graph could not be loaded")
+    parser.add_argument("--sweep", dest="sweep", action='append', default=[], metavar='NODE.PARAM=V1,V2,...', \
+            help="In batch mode, process the graph for every value of parameter PARAM of node NODE (may be repeated " \
+            "for all combinations). Nodes that do not depend on these parameters are processed once.")
+    parser.add_argument("--sweep-results", dest="sweepResults", default='sweep.json', \
+            help="File the data arriving at the sinks of every sweep variant is written to as JSON")
+    parser.add_argument("--estimate", dest="estimate", action='store_true', \
+            help="In batch mode, print how long processing would take (from the runtimes in COSTFILE) and exit")
+    parser.add_argument("-s", "--sink", dest="sinks", action='append', default=[], \
+            help="In batch mode, only process the nodes needed by the node named SINK (may be repeated)")
 
     args = parser.parse_args()
     if args.logLevel:
@@ -140,7 +131,61 @@ if __name__ == '__main__':
             format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
             datefmt="%H:%M:%S", stream=sys.stdout)
 
+    if args.pluginDirs:
+        import NodeTypes
+        for d in args.pluginDirs:
+            NodeTypes.defaultRegistry.addPluginDirectory(d)
+
+    if args.maxChildren:
+        import ChildProcesses
+        ChildProcesses.defaultExecutor.setMaxProcesses(args.maxChildren)
+
+    if args.scratchDir or args.edgeMemory != 256 or args.codec:
+        import EdgeStore
+        EdgeStore.defaultStore = EdgeStore.EdgeStore(args.scratchDir, memoryBudget=args.edgeMemory * 1024 * 1024, \
+                codec=args.codec)
+
+    if args.costFile is not None:
+        import Scheduling
+        Scheduling.defaultCostModel = Scheduling.CostModel(args.costFile or Scheduling.DEFAULT_COST_FILE)
+
+    cache = None
+    if args.cacheDir is not None:
+        from ResultCache import ResultCache, DEFAULT_CACHE_DIR
+        cache = ResultCache(args.cacheDir or DEFAULT_CACHE_DIR, args.cacheSize * 1024 * 1024)
+
+    profiler = None
+    if args.profileFile or args.traceFile:
+        from Profiling import Profiler
+        profiler = Profiler()
+        if args.profileFile:
+            atexit.register(profiler.saveJson, args.profileFile)
+        if args.traceFile:
+            atexit.register(profiler.saveTrace, args.traceFile)
+
+    remote = None
+    if args.workers:
+        from RemoteWorkers import RemoteExecutor
+        remote = RemoteExecutor(args.workers)
+        if not remote.ping():
+            logger.error('None of the worker daemons answers, processing locally')
+
+    sweep = {}
+    for axis in args.sweep:
+        key, sep, values = axis.partition('=')
+        if not sep or '.' not in key:
+            parser.error('--sweep expects NODE.PARAM=V1,V2,...')
+        sweep[key] = values.split(',')
+
+    memoryBudget = args.memoryBudget * 1024 * 1024 if args.memoryBudget is not None else None
+    if args.graphFile:
+        sys.exit(runBatch(args.graphFile, args.sinks, args.jobs, cache, args.pipes, profiler, remote, sweep, args.sweepResults, \
+                memoryBudget, args.estimate, args.release))
+    elif args.sinks or sweep or args.estimate:
+        parser.error('--sink, --sweep and --estimate require --batch')
+
     logger.info('Starting...')
-    mp = Indprog()
+    from Gui import Indprog
+    mp = Indprog(args.jobs, cache, args.pipes, profiler, remote, memoryBudget, args.release)
     mp.run()
     logger.info('Quitting')
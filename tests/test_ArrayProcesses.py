@@ -0,0 +1,55 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import ArrayProcesses
+from Processing import ProcessingGraph, ProcessingNode
+
+
+def buildGraph(tmp_path):
+    g = ProcessingGraph()
+    a = g.createNode('a', 'array')
+    a.setParam('value', '1,2,3,4,5,6')
+    a.setParam('shape', '2,3')
+    a.setParam('dtype', 'int64')
+    b = g.createNode('b', 'array')
+    b.setParam('value', '10,20,30')
+    ar = g.createNode('ar', 'arith')
+    ar.setParam('operation', 'multiply')
+    r = g.createNode('r', 'reduce')
+    r.setParam('axis', '0')
+    c = g.createNode('c', 'cast')
+    w = g.createNode('w', 'filewrite')
+    w.setParam('filename', str(tmp_path / 'out.npy'))
+    w.setParam('append', False)
+    ProcessingNode.connectPorts(a.outputPorts['out'], ar.inputPorts['a'])
+    ProcessingNode.connectPorts(b.outputPorts['out'], ar.inputPorts['b'])
+    ProcessingNode.connectPorts(ar.outputPorts['result'], r.inputPorts['in'])
+    ProcessingNode.connectPorts(r.outputPorts['result'], c.inputPorts['in'])
+    ProcessingNode.connectPorts(c.outputPorts['out'], w.inputPorts['in'])
+    return g
+
+
+@pytest.mark.parametrize('pipe', [False, True])
+def test_array_graph(tmp_path, pipe):
+    g = buildGraph(tmp_path)
+    g.setEdgeMode(pipe)
+    assert g.process(workers=2)
+    result = np.load(str(tmp_path / 'out.npy'))
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, [50, 140, 270])
+
+
+@pytest.mark.parametrize('array', [np.arange(12.0).reshape(3, 4), np.asfortranarray(np.arange(6).reshape(2, 3)),
+        np.float64(2.5), np.zeros((0, 3)), np.array(['a', 'bc'])])
+def test_fifo_round_trip(tmp_path, array):
+    path = str(tmp_path / 'fifo')
+    os.mkfifo(path)
+    writer = threading.Thread(target=ArrayProcesses.finishArray, args=(path, array))
+    writer.start()
+    result = ArrayProcesses.readArray(path)
+    writer.join()
+    assert result.shape == np.shape(array)
+    np.testing.assert_array_equal(result, array)
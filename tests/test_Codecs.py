@@ -0,0 +1,53 @@
+import os
+import importlib.util
+
+import pytest
+
+import Codecs
+
+CODECS = ['zlib', 'lzma', pytest.param('zstd', marks=pytest.mark.skipif(importlib.util.find_spec('zstandard') is None, \
+        reason='zstandard is not installed'))]
+
+
+@pytest.mark.parametrize('name', CODECS)
+def test_round_trip(tmp_path, name):
+    codec = Codecs.getCodec(name)
+    data = b''.join(b'line %d of the data\n' % i for i in range(100000))
+    src, dst, out = tmp_path / 'src', str(tmp_path / 'dst'), str(tmp_path / 'out')
+    src.write_bytes(data)
+
+    size = Codecs.compressFile(str(src), dst, codec)
+    assert size == os.path.getsize(dst) < len(data)
+    Codecs.decompressFile(dst, out, codec)
+    with open(out, 'rb') as f:
+        assert f.read() == data
+
+
+@pytest.mark.parametrize('name', CODECS)
+def test_chunks_are_bounded(tmp_path, name):
+    codec = Codecs.getCodec(name)
+    src, dst = tmp_path / 'src', str(tmp_path / 'dst')
+    src.write_bytes(bytes(8 * 1024 * 1024))
+    assert Codecs.compressFile(str(src), dst, codec)
+
+    chunks = [len(c) for c in Codecs.decompressChunks(dst, codec, chunkSize=1024 * 1024)]
+    assert sum(chunks) == 8 * 1024 * 1024
+    assert max(chunks) <= 1024 * 1024
+
+
+def test_data_that_does_not_shrink_is_kept(tmp_path):
+    codec = Codecs.getCodec('zlib')
+    random, small = tmp_path / 'random', tmp_path / 'small'
+    random.write_bytes(os.urandom(Codecs.SAMPLE_SIZE * 2))
+    small.write_bytes(bytes(Codecs.MIN_SIZE - 1))
+    for src in (random, small):
+        assert Codecs.compressFile(str(src), str(tmp_path / 'dst'), codec) is None
+        assert not (tmp_path / 'dst').exists()
+
+
+def test_get_codec():
+    assert Codecs.getCodec(None) is None
+    assert Codecs.getCodec('none') is None
+    assert Codecs.getCodec('unknown') is None
+    assert Codecs.getCodec('zlib').name == 'zlib'
+    assert Codecs.getCodec('auto').name in Codecs.AUTO_ORDER
@@ -0,0 +1,48 @@
+import stat
+
+import Coprocesses
+from Processing import ProcessingGraph, ProcessingNode
+
+WORKER_SCRIPT = '''#!/bin/bash
+process() {
+  echo %s > ${outFiles[0]}
+}
+if [ "$#" -eq 0 ]; then echo "in1 out1"; exit 1
+elif [ "$1" == "--worker" ]; then
+  while IFS=$'\\t' read -r request ins outs params; do
+    case "$request" in
+      PING) echo "PONG" ;;
+      RUN) IFS=',' read -r -a outFiles <<< "$outs"; ( process ) 1>&2 && echo "OK" ;;
+    esac
+  done
+fi
+'''
+
+
+def test_worker_restarts_after_script_change(tmp_path):
+    script = tmp_path / 'worker.bash'
+    script.write_text(WORKER_SCRIPT % 'old')
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+
+    g = ProcessingGraph()
+    source = g.createNode('source', 'const')
+    node = g.createNode('node', 'bash')
+    node.setParam('filename', str(script))
+    node.setParam('worker', True)
+    node.updatePorts()
+    sink = g.createNode('sink', 'filewrite')
+    sink.setParam('filename', str(tmp_path / 'out'))
+    sink.setParam('append', False)
+    ProcessingNode.connectPorts(source.outputPorts['out'], node.inputPorts['in1'])
+    ProcessingNode.connectPorts(node.outputPorts['out1'], sink.inputPorts['in'])
+
+    try:
+        assert g.process()
+        assert (tmp_path / 'out').read_text() == 'old\n'
+
+        script.write_text(WORKER_SCRIPT % 'changed')
+        g.invalidateChanged()
+        assert g.process()
+        assert (tmp_path / 'out').read_text() == 'changed\n'
+    finally:
+        Coprocesses.closePools()
@@ -0,0 +1,68 @@
+from GraphIndex import GraphIndex
+
+
+def chain(n):
+    index = GraphIndex()
+    for v in range(n):
+        index.addVertex(v)
+    for v in range(n - 1):
+        assert index.addEdge(v, v + 1)
+    return index
+
+
+def snapshot(index):
+    return ({v : dict(s) for v, s in index.succs.items()}, {v : dict(p) for v, p in index.preds.items()}, \
+            dict(index.order), list(index.sinks))
+
+
+def isSorted(index):
+    return all(index.order[u] < index.order[v] for u in index.succs for v in index.succs[u])
+
+
+def test_edges_keep_the_order_topological():
+    index = GraphIndex()
+    for v in 'abcde':
+        index.addVertex(v)
+    # added against the insertion order, so the vertices have to be reordered
+    for u, v in ['ea', 'db', 'ca', 'ed', 'bc']:
+        assert index.addEdge(u, v)
+    assert isSorted(index)
+    assert index.sort('abcde') == ['e', 'd', 'b', 'c', 'a']
+    assert list(index.sinks) == ['a']
+
+
+def test_cycle_is_rejected_and_index_unchanged():
+    index = chain(5)
+    before = snapshot(index)
+    assert not index.addEdge(4, 0)
+    assert not index.addEdge(2, 2)
+    assert snapshot(index) == before
+
+
+def test_bulk_edges_roll_back_on_cycle():
+    index = chain(5)
+    index.addVertex(5)
+    before = snapshot(index)
+    assert not index.addEdges([(4, 5), (5, 1)])
+    assert snapshot(index) == before
+
+    assert index.addEdges([(5, 0), (4, 5)]) is False
+    assert snapshot(index) == before
+    assert index.addEdges([(5, 0)])
+    assert isSorted(index)
+
+
+def test_counted_edges_and_removal():
+    index = chain(3)
+    assert index.addEdge(0, 1)
+    index.removeEdge(0, 1)
+    assert 1 in index.succs[0]
+    index.removeEdge(0, 1)
+    assert 1 not in index.succs[0]
+    assert 0 in index.sinks
+
+    index.removeVertex(1)
+    assert 1 not in index.order
+    assert not index.preds[2]
+    assert index.ancestors([2]) == {2}
+    assert index.descendants([0]) == {0}
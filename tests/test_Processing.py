@@ -0,0 +1,205 @@
+import json
+import stat
+import struct
+
+import pytest
+
+from Processing import ProcessingGraph, ProcessingNode, packGraphData, unpackGraphData, checkGraphData
+
+SPLIT_SCRIPT = '''#!/bin/bash
+if [ "$#" -eq 0 ]; then echo "in1 out1,out2"; exit 1; fi
+IFS=',' read -r -a inFiles <<< "$1"
+IFS=',' read -r -a outFiles <<< "$2"
+cat ${inFiles[0]} > ${outFiles[0]} &
+cat ${inFiles[0]} > ${outFiles[1]}
+wait
+'''
+
+JOIN_SCRIPT = '''#!/bin/bash
+if [ "$#" -eq 0 ]; then echo "in1,in2 out1"; exit 1; fi
+IFS=',' read -r -a inFiles <<< "$1"
+IFS=',' read -r -a outFiles <<< "$2"
+cat ${inFiles[0]} ${inFiles[1]} > ${outFiles[0]}
+'''
+
+COPY_SCRIPT = '''#!/bin/bash
+if [ "$#" -eq 0 ]; then echo "in1 out1"; exit 1; fi
+cat $1 > $2
+'''
+
+
+def writeScript(path, content):
+    path.write_text(content)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(path)
+
+
+##
+# @brief Builds source -> split -> (mid) -> join -> sink, the connections between split, mid and
+# join are left to the test
+def diamond(tmp_path):
+    (tmp_path / 'in').write_text('abc\n')
+    g = ProcessingGraph()
+    source = g.createNode('source', 'fileread')
+    source.setParam('filename', str(tmp_path / 'in'))
+    split = g.createNode('split', 'bash')
+    split.setParam('filename', writeScript(tmp_path / 'split.bash', SPLIT_SCRIPT))
+    mid = g.createNode('mid', 'bash')
+    mid.setParam('filename', writeScript(tmp_path / 'copy.bash', COPY_SCRIPT))
+    join = g.createNode('join', 'bash')
+    join.setParam('filename', writeScript(tmp_path / 'join.bash', JOIN_SCRIPT))
+    sink = g.createNode('sink', 'filewrite')
+    sink.setParam('filename', str(tmp_path / 'out'))
+    sink.setParam('append', False)
+    for n in g.nodes:
+        n.updatePorts()
+    assert ProcessingNode.connectPorts(source.outputPorts['out'], split.inputPorts['in1'])
+    assert ProcessingNode.connectPorts(join.outputPorts['out1'], sink.inputPorts['in'])
+    return g, split, mid, join
+
+
+def test_pipe_rejected_if_group_depends_on_itself(tmp_path):
+    g, split, mid, join = diamond(tmp_path)
+    assert ProcessingNode.connectPorts(split.outputPorts['out2'], mid.inputPorts['in1'])
+    assert ProcessingNode.connectPorts(mid.outputPorts['out1'], join.inputPorts['in2'])
+    assert not ProcessingNode.connectPorts(split.outputPorts['out1'], join.inputPorts['in1'], pipe=True)
+    assert not split.outputPorts['out1'].connectedTo
+
+
+def test_group_cycle_is_an_error(tmp_path, caplog):
+    g, split, mid, join = diamond(tmp_path)
+    # the pipe is accepted before the file path exists
+    assert ProcessingNode.connectPorts(split.outputPorts['out1'], join.inputPorts['in1'], pipe=True)
+    assert ProcessingNode.connectPorts(split.outputPorts['out2'], mid.inputPorts['in1'])
+    assert ProcessingNode.connectPorts(mid.outputPorts['out1'], join.inputPorts['in2'])
+    assert not g.process(workers=2)
+    assert 'depend on each other through files' in caplog.text
+    assert 'skipped' not in caplog.text
+    assert g.estimateRuntime() is None
+
+
+def test_edge_mode_keeps_files_within_groups(tmp_path):
+    g, split, mid, join = diamond(tmp_path)
+    other = g.createNode('other', 'filewrite')
+    other.setParam('filename', str(tmp_path / 'other'))
+    other.setParam('append', False)
+    ProcessingNode.connectPorts(split.outputPorts['out1'], join.inputPorts['in1'])
+    # two consumers, so this connection stays a file
+    ProcessingNode.connectPorts(split.outputPorts['out2'], mid.inputPorts['in1'])
+    ProcessingNode.connectPorts(split.outputPorts['out2'], other.inputPorts['in'])
+    ProcessingNode.connectPorts(mid.outputPorts['out1'], join.inputPorts['in2'])
+    g.setEdgeMode(True)
+    assert g.process(workers=4)
+    assert (tmp_path / 'out').read_text() == 'abc\nabc\n'
+
+
+def graphFile(tmp_path, edges):
+    path = tmp_path / 'graph.json'
+    path.write_text(json.dumps({'version' : 1, 'nodes' : [['a', 'const', {}], ['b', 'const', {}], ['add', 'add', {}]],
+            'edges' : edges}))
+    return str(path)
+
+
+@pytest.mark.parametrize('edges', [
+        # two connections into one input port
+        [[0, 'out', 2, 'summand1', False], [1, 'out', 2, 'summand1', False]],
+        # a pipe with two sinks
+        [[0, 'out', 2, 'summand1', True], [0, 'out', 2, 'summand2', True]],
+        # a cycle
+        [[2, 'sum', 2, 'summand1', False]]])
+def test_load_rejects_invalid_connections(tmp_path, edges):
+    g = ProcessingGraph()
+    assert not g.loadFromFile(graphFile(tmp_path, edges))
+    assert not g.nodes
+    assert not g.index.order
+
+
+def test_load_connects_valid_graph(tmp_path):
+    g = ProcessingGraph()
+    assert g.loadFromFile(graphFile(tmp_path, [[0, 'out', 2, 'summand1', False], [1, 'out', 2, 'summand2', True]]))
+    a, b, add = g.nodes
+    assert add.getConnectedNodes()[0] == {a, b}
+    assert b.outputPorts['out'].pipe
+
+
+GRAPH_DATA = {'version' : 1,
+        'nodes' : [['c', 'const', {'value' : 'x'}], ['ü', 'filewrite', {'append' : False, 'n' : [1, 2.5]}]],
+        'edges' : [[0, 'out', 1, 'in', True]],
+        'pinned' : [[0, 'out']], 'codecs' : [[0, 'out', 'zlib']], 'resources' : [[1, 2, 1024]]}
+
+
+def test_pack_graph_data_round_trip():
+    buf = packGraphData(GRAPH_DATA)
+    assert unpackGraphData(buf) == GRAPH_DATA
+    checkGraphData(unpackGraphData(buf), True)
+
+
+@pytest.mark.parametrize('corrupt', [lambda b: b[:-1], lambda b: b + b'\0', lambda b: b[:10],
+        lambda b: b'\x01\0\0\0' + b[4:]])
+def test_unpack_graph_data_rejects_corrupt_data(corrupt):
+    with pytest.raises((ValueError, struct.error)):
+        unpackGraphData(corrupt(packGraphData(GRAPH_DATA)))
+
+
+def test_check_graph_data():
+    checkGraphData(GRAPH_DATA)
+    for key, value in [('edges', [[0, 'out', 2, 'in', False]]), ('nodes', [['c', 'const']]), \
+            ('pinned', [[-1, 'out']]), ('version', 2)]:
+        with pytest.raises(ValueError):
+            checkGraphData(dict(GRAPH_DATA, **{key : value}))
+
+
+def scalarGraph(tmp_path):
+    g = ProcessingGraph()
+    constants = []
+    for name, value in [('c1', 1.5), ('c2', 2.25)]:
+        c = g.createNode(name, 'const')
+        c.setParam('encoding', 'latin-1')
+        c.setParam('value', struct.pack('f', value).decode('latin-1'))
+        constants.append(c)
+    add = g.createNode('add', 'add')
+    sink = g.createNode('sink', 'filewrite')
+    sink.setParam('filename', str(tmp_path / 'sum'))
+    sink.setParam('encoding', '')
+    sink.setParam('append', False)
+    ProcessingNode.connectPorts(constants[0].outputPorts['out'], add.inputPorts['summand1'])
+    ProcessingNode.connectPorts(constants[1].outputPorts['out'], add.inputPorts['summand2'])
+    ProcessingNode.connectPorts(add.outputPorts['sum'], sink.inputPorts['in'])
+    return g
+
+
+@pytest.mark.parametrize('mode', ['file', 'pipe', 'fused'])
+def test_process_modes(tmp_path, mode):
+    g = scalarGraph(tmp_path)
+    g.fuse = mode == 'fused'
+    g.setEdgeMode(mode == 'pipe')
+    assert all(op.pipe == (mode == 'pipe') for n in g.nodes for op in n.outputPorts.values())
+    assert g.process(workers=2)
+    assert struct.unpack('f', (tmp_path / 'sum').read_bytes()) == (3.75,)
+    assert bool(g.fusedChains) == (mode == 'fused')
+    # nothing changed, so nothing has to run again
+    assert g.topologicalSort(g.getSinks()) == []
+
+
+@pytest.mark.parametrize('extension', ['.bin', '.json'])
+def test_save_and_load(tmp_path, extension):
+    g = scalarGraph(tmp_path)
+    add = g.nodes[2]
+    add.outputPorts['sum'].pinned = True
+    add.outputPorts['sum'].codec = 'zlib'
+    add.cpus = 2
+    path = str(tmp_path / ('graph' + extension))
+    assert g.saveToFile(path)
+
+    loaded = ProcessingGraph()
+    assert loaded.loadFromFile(path)
+    assert [(n.name, n.processType, n.getParams()) for n in loaded.nodes] == \
+            [(n.name, n.processType, n.getParams()) for n in g.nodes]
+    add = loaded.nodes[2]
+    assert add.outputPorts['sum'].pinned and add.outputPorts['sum'].codec == 'zlib' and add.cpus == 2
+    assert loaded.process()
+    assert struct.unpack('f', (tmp_path / 'sum').read_bytes()) == (3.75,)
+
+    partial = ProcessingGraph()
+    assert partial.loadFromFile(path, sinks=['c1'])
+    assert [n.name for n in partial.nodes] == ['c1']
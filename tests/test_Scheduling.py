@@ -0,0 +1,71 @@
+from Scheduling import CostModel, Scheduler
+
+
+def scheduler(costs, edges, needs=None, workers=1, **budgets):
+    succs = [set() for c in costs]
+    preds = [set() for c in costs]
+    for u, v in edges:
+        succs[u].add(v)
+        preds[v].add(u)
+    return Scheduler(costs, needs or [(1, 0)] * len(costs), succs, preds, workers, **budgets)
+
+
+def test_critical_paths():
+    # 0 -> 1 -> 3 and 0 -> 2 -> 3
+    s = scheduler([1.0, 5.0, 2.0, 1.0], [(0, 1), (0, 2), (1, 3), (2, 3)])
+    assert s.priority == [7.0, 6.0, 3.0, 1.0]
+
+
+def test_long_chain_starts_first():
+    # a short group, and a group that starts a long chain
+    s = scheduler([1.0, 1.0, 10.0], [(1, 2)])
+    assert s.start() == [1]
+    assert s.start() == []
+    s.finish(1)
+    assert s.start() == [2]
+    s.finish(2)
+    assert s.start() == [0]
+
+
+def test_failed_groups_do_not_release_successors():
+    s = scheduler([1.0, 1.0], [(0, 1)], workers=2)
+    assert s.start() == [0]
+    s.finish(0, succeeded=False)
+    assert s.start() == []
+
+
+def test_budgets():
+    needs = [(1, 600), (1, 600), (1, 100), (4, 0)]
+    s = scheduler([4.0, 3.0, 2.0, 1.0], [], needs, workers=4, cpuBudget=4, memoryBudget=1000)
+    # the second memory hungry group does not fit, neither do the 4 CPUs of the last one
+    assert s.start() == [0, 2]
+    s.finish(0)
+    assert s.start() == [1]
+    s.finish(1)
+    s.finish(2)
+    # more than the budget, but nothing else runs
+    s.cpuBudget = 2
+    assert s.start() == [3]
+
+
+def test_simulate_does_not_change_the_scheduler():
+    s = scheduler([1.0, 2.0, 3.0], [(0, 2)], workers=2)
+    assert s.simulate() == 4.0
+    assert s.start() == [0, 1]
+
+
+def test_cost_model_averages(tmp_path):
+    class Node:
+        processType = 'bash'
+
+        def getParams(self):
+            return {'filename' : 'a.bash'}
+
+    model = CostModel(str(tmp_path / 'costs.json'))
+    assert model.estimate(Node()) is None
+    model.update(Node(), {'status' : 'executed', 'wall' : 2.0, 'outputs' : {'out' : 10}})
+    model.update(Node(), {'status' : 'executed', 'wall' : 4.0, 'outputs' : {'out' : 10}})
+    model.update(Node(), {'status' : 'failed', 'wall' : 100.0})
+    assert model.estimate(Node())['wall'] == 3.0
+    assert model.save()
+    assert CostModel(model.path).estimate(Node())['runs'] == 2
@@ -0,0 +1,12 @@
+import logging
+
+from Wrappers import PrinterProcess
+
+
+def test_printer_shows_truncated_character(caplog):
+    proc = PrinterProcess('printer')
+    proc.params['encoding'] = 'utf-8'
+    with caplog.at_level(logging.INFO):
+        list(proc.runStream([iter([b'ab\xc3'])]))
+    assert 'ab' in caplog.text
+    assert '�' in caplog.text